@@ -0,0 +1,616 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import re
+import sys
+import time
+
+from argparse import ArgumentParser
+from datetime import (
+    datetime,
+    timezone,
+)
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from threading import (
+    Lock,
+    Thread,
+)
+from urllib.parse import (
+    parse_qs,
+    urlencode,
+    urlsplit,
+)
+
+# Commits are a minute apart, the newest base commit is a day old,
+# so commits added by advance() are still in the past
+COMMIT_STEP = 60
+BASE_AGE = 86400
+
+DEFAULT_PER_PAGE = 30
+MAX_PER_PAGE = 100
+
+
+def format_ts(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_ts(value: str) -> float:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def make_sha(*parts) -> str:
+    return hashlib.sha1('/'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+class SyntheticRepo():
+    """Generated content of a single repo.
+
+    Branch "main" has the base history, every other branch forks from
+    it and has a few commits of its own. Odd issue numbers are pull requests.
+    """
+
+    def __init__(self, org, index: int):
+        self.org = org
+        self.index = index
+        self.name = 'repo-%03d' % index
+        self.full_name = '%s/%s' % (org.name, self.name)
+        self.__lock = Lock()
+        self.__generation = None
+
+    def __build(self):
+        org = self.org
+        main_len = org.commits + org.added_commits
+
+        self.branches = {}
+        self.commits = {}
+
+        main = [self.__commit('main', i, org.base + i * COMMIT_STEP, i - 1)
+                for i in range(main_len)]
+        self.branches['main'] = main[::-1]
+
+        own = max(1, org.commits // 20)
+        for b in range(1, org.branches):
+            fork = max(1, org.commits * b // org.branches)
+            name = 'feature-%d' % b
+            history = []
+            parent_sha = main[fork - 1]['sha']
+            for j in range(own):
+                ts = org.base + (fork - 1) * COMMIT_STEP + j + 1
+                commit = self.__commit(name, j, ts, parent_sha=parent_sha)
+                parent_sha = commit['sha']
+                history.append(commit)
+
+            self.branches[name] = history[::-1] + main[:fork][::-1]
+
+        self.tags = []
+        step = max(1, org.commits // max(org.tags, 1))
+        for t in range(min(org.tags, org.commits)):
+            commit = main[t * step]
+            self.tags.append({
+                'name': 'v0.%d.0' % t,
+                'commit': {'sha': commit['sha'], 'url': commit['url']},
+                'tarball_url': '%s/repos/%s/tarball/v0.%d.0' % (org.url, self.full_name, t),
+                'zipball_url': '%s/repos/%s/zipball/v0.%d.0' % (org.url, self.full_name, t),
+            })
+
+        self.issues = {}
+        self.comments = []
+        for number in range(1, org.issues + org.added_issues + 1):
+            self.__issue(number)
+
+        self.comments.sort(key=lambda c: c['id'])
+
+    def __commit(self, branch: str, i: int, ts: float, parent=None, parent_sha=None):
+        org = self.org
+        sha = make_sha(self.full_name, branch, i)
+        if parent is not None and parent >= 0:
+            parent_sha = make_sha(self.full_name, branch, parent)
+
+        login = org.user_login(self.index * 7919 + i)
+        person = {'name': login.title(), 'email': '%s@example.com' % login,
+                  'date': format_ts(ts)}
+        commit = {
+            'sha': sha,
+            'url': '%s/repos/%s/commits/%s' % (org.url, self.full_name, sha),
+            'html_url': 'https://github.com/%s/commit/%s' % (self.full_name, sha),
+            'commit': {
+                'author': person,
+                'committer': person,
+                'message': 'Change %s of %s' % (i, branch),
+            },
+            'author': org.user(login),
+            'committer': org.user(login),
+            'parents': [{'sha': parent_sha}] if parent_sha else [],
+        }
+        self.commits[sha] = commit
+        return commit
+
+    def __issue(self, number: int):
+        org = self.org
+        created = org.created.get(number, org.base + number)
+        updated = org.touched.get(number, created)
+        is_pr = number % 2 == 1
+        comment_cnt = org.comments + (1 if number in org.touched else 0)
+
+        url = '%s/repos/%s/issues/%s' % (org.url, self.full_name, number)
+        issue = {
+            'id': self.index * 10 ** 6 + number,
+            'number': number,
+            'title': 'Synthetic %s %s' % ('pull request' if is_pr else 'issue', number),
+            'state': 'closed' if number % 3 == 0 else 'open',
+            'user': org.user(org.user_login(self.index * 31 + number)),
+            'url': url,
+            'comments_url': url + '/comments',
+            'html_url': 'https://github.com/%s/%s/%s' % (
+                self.full_name, 'pull' if is_pr else 'issues', number),
+            'created_at': format_ts(created),
+            'updated_at': format_ts(updated),
+            'closed_at': format_ts(created + 3600) if number % 3 == 0 else None,
+            'comments': comment_cnt,
+            'labels': [],
+        }
+        if is_pr:
+            issue['pull_request'] = {'url': '%s/repos/%s/pulls/%s' % (
+                org.url, self.full_name, number)}
+        self.issues[number] = issue
+
+        issue['_comments'] = []
+        for j in range(comment_cnt):
+            ts = created + (j + 1) * 60
+            if j == org.comments:
+                # Added by advance()
+                ts = updated
+
+            comment = {
+                'id': (self.index * 10 ** 6 + number) * 1000 + j,
+                'user': org.user(org.user_login(number + j)),
+                'issue_url': url,
+                'url': '%s/repos/%s/issues/comments/%s' % (
+                    org.url, self.full_name, (self.index * 10 ** 6 + number) * 1000 + j),
+                'created_at': format_ts(ts),
+                'updated_at': format_ts(ts),
+                'body': 'Comment %s' % j,
+            }
+            issue['_comments'].append(comment)
+            self.comments.append(comment)
+
+    def data(self):
+        """Build the content on first use and after the org changes."""
+        with self.__lock:
+            if self.__generation != self.org.generation:
+                self.__build()
+                self.__generation = self.org.generation
+        return self
+
+    def payload(self) -> dict:
+        org = self.org
+        return {
+            'id': self.index + 1,
+            'name': self.name,
+            'full_name': self.full_name,
+            'owner': org.payload(),
+            'private': False,
+            'url': '%s/repos/%s' % (org.url, self.full_name),
+            'html_url': 'https://github.com/%s' % self.full_name,
+            'default_branch': 'main',
+        }
+
+
+class SyntheticOrg():
+    """A generated organization: repos, branches, commits, issues, comments and tags.
+
+    The content is deterministic, the same parameters give the same data.
+    advance() adds commits and issues and updates some issues,
+    so that an incremental sync has something to pick up.
+    """
+
+    def __init__(self, name='bench-org', repos=10, branches=3, commits=200,
+                 issues=50, comments=2, tags=5, users=50):
+        self.name = name
+        self.url = ''
+        self.commits = commits
+        self.branches = max(1, branches)
+        self.issues = issues
+        self.comments = comments
+        self.tags = tags
+        self.users = max(1, users)
+
+        self.generation = 0
+        self.added_commits = 0
+        self.added_issues = 0
+        self.touched = {}  # {issue number: updated_at}
+        self.created = {}  # {issue number: created_at} of added issues
+
+        self.base = int(time.time()) - BASE_AGE - commits * COMMIT_STEP
+        self.repos = [SyntheticRepo(self, i) for i in range(repos)]
+        self.repo_by_name = {repo.name: repo for repo in self.repos}
+
+    def advance(self, commits=10, issues=5, touched=5):
+        """Add commits to main, add new issues and comment on existing ones."""
+        now = int(time.time())
+        for number in range(1, min(touched, self.issues) + 1):
+            self.touched[number] = now
+
+        first = self.issues + self.added_issues + 1
+        for number in range(first, first + issues):
+            self.created[number] = now
+
+        self.added_commits += commits
+        self.added_issues += issues
+        self.generation += 1
+
+    def user_login(self, n: int) -> str:
+        return 'user-%d' % (n % self.users)
+
+    def user(self, login: str, full=False) -> dict:
+        user = {
+            'login': login,
+            'id': int(login.rsplit('-', 1)[1]) + 1,
+            'url': '%s/users/%s' % (self.url, login),
+            'type': 'User',
+            'site_admin': False,
+        }
+        if full:
+            user['name'] = login.title()
+            user['email'] = '%s@example.com' % login
+        return user
+
+    def payload(self) -> dict:
+        return {
+            'login': self.name,
+            'id': 1,
+            'url': '%s/orgs/%s' % (self.url, self.name),
+            'repos_url': '%s/orgs/%s/repos' % (self.url, self.name),
+            'type': 'Organization',
+        }
+
+    def objects(self) -> int:
+        """Number of objects a full sync stores (not counting contributors)."""
+        total = 0
+        for repo in self.repos:
+            repo = repo.data()
+            total += 1 + len(repo.branches) + len(repo.commits)
+            total += len(repo.issues) + len(repo.comments) + len(repo.tags)
+        return total
+
+
+class RateLimit():
+    """Core rate-limit window of the fake API, shared by all tokens."""
+
+    def __init__(self, limit: int, window=3600):
+        self.limit = limit
+        self.window = window
+        self.reset = time.time() + window
+        self.remaining = limit
+
+    def take(self) -> bool:
+        """Count a request, return False if the limit is exhausted."""
+        now = time.time()
+        if now >= self.reset:
+            self.reset = now + self.window
+            self.remaining = self.limit
+
+        if self.remaining == 0:
+            return False
+
+        self.remaining -= 1
+        return True
+
+    def headers(self) -> dict:
+        return {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(int(self.reset)),
+            'X-RateLimit-Resource': 'core',
+        }
+
+
+class FakeGitHub():
+    """The REST API subset the collector uses, served from a SyntheticOrg.
+
+    Lists are paginated with Link headers, responses carry rate-limit
+    headers and ETags, conditional requests are answered 304 without
+    counting against the limit, as GitHub does. latency is added to every
+    response. Request counts are kept by endpoint.
+    """
+
+    ROUTES = (
+        ('org', re.compile(r'^/orgs/(?P<org>[^/]+)$')),
+        ('repos', re.compile(r'^/orgs/(?P<org>[^/]+)/repos$')),
+        ('repo', re.compile(r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)$')),
+        ('branches', re.compile(r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/branches$')),
+        ('commits', re.compile(r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/commits$')),
+        ('commit', re.compile(r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/commits/(?P<sha>\w+)$')),
+        ('issues', re.compile(r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/issues$')),
+        ('repo_comments', re.compile(
+            r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/issues/comments$')),
+        ('issue_comments', re.compile(
+            r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/issues/(?P<number>\d+)/comments$')),
+        ('tags', re.compile(r'^/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/tags$')),
+        ('user', re.compile(r'^/users/(?P<login>[^/]+)$')),
+    )
+
+    def __init__(self, org: SyntheticOrg, latency=0.0, rate_limit=5000,
+                 host='127.0.0.1', port=0):
+        self.org = org
+        self.latency = latency
+        self.rate_limit = RateLimit(rate_limit)
+        self.counts = {}
+        self.not_modified = 0
+        self.rate_limited = 0
+        self.__lock = Lock()
+
+        app = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                app.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://%s:%s' % self.server.server_address[:2]
+        org.url = self.url
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                'requests': sum(self.counts.values()),
+                'by_endpoint': dict(self.counts),
+                'not_modified': self.not_modified,
+                'rate_limited': self.rate_limited,
+            }
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlsplit(request.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        for endpoint, pattern in self.ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            endpoint, match = 'unknown', None
+
+        with self.__lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+        body = None
+        if match is not None:
+            body = getattr(self, 'get_%s' % endpoint)(params, **match.groupdict())
+
+        if body is None:
+            self.respond(request, 404, {'message': 'Not Found'})
+            return
+
+        headers = {}
+        if isinstance(body, list):
+            body, headers = self.paginate(url.path, params, body)
+
+        payload = json.dumps(body).encode()
+        etag = '"%s"' % hashlib.sha1(payload).hexdigest()
+
+        if request.headers.get('If-None-Match') == etag:
+            with self.__lock:
+                self.not_modified += 1
+                headers.update(self.rate_limit.headers())
+            headers['ETag'] = etag
+            self.respond(request, 304, None, headers)
+            return
+
+        with self.__lock:
+            allowed = self.rate_limit.take()
+            headers.update(self.rate_limit.headers())
+            if not allowed:
+                self.rate_limited += 1
+
+        if not allowed:
+            self.respond(request, 403, {'message': 'API rate limit exceeded'}, headers)
+            return
+
+        headers['ETag'] = etag
+        self.respond(request, 200, payload, headers)
+
+    def paginate(self, path: str, params: dict, items: list) -> tuple:
+        per_page = min(int(params.get('per_page', DEFAULT_PER_PAGE)), MAX_PER_PAGE)
+        page = max(int(params.get('page', 1)), 1)
+        last = max((len(items) + per_page - 1) // per_page, 1)
+
+        def link(n):
+            query = dict(params, page=n)
+            return '<%s%s?%s>' % (self.url, path, urlencode(query))
+
+        links = []
+        if page < last:
+            links.append('%s; rel="next"' % link(page + 1))
+            links.append('%s; rel="last"' % link(last))
+        if page > 1:
+            links.append('%s; rel="first"' % link(1))
+            links.append('%s; rel="prev"' % link(page - 1))
+
+        headers = {'Link': ', '.join(links)} if links else {}
+        return items[(page - 1) * per_page:page * per_page], headers
+
+    @staticmethod
+    def respond(request: BaseHTTPRequestHandler, status: int,
+                body=None, headers=None):
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        if status != 304:
+            request.send_header('Content-Type', 'application/json; charset=utf-8')
+            request.send_header('Content-Length', str(len(body or b'')))
+        request.end_headers()
+        if body and status != 304:
+            request.wfile.write(body)
+
+    # Endpoints, each returns a payload or None for 404
+
+    def __repo(self, org: str, repo: str) -> SyntheticRepo:
+        if org != self.org.name or repo not in self.org.repo_by_name:
+            return None
+        return self.org.repo_by_name[repo].data()
+
+    @staticmethod
+    def __public(items: list) -> list:
+        return [{k: v for k, v in item.items() if not k.startswith('_')}
+                for item in items]
+
+    def get_org(self, params, org):
+        return self.org.payload() if org == self.org.name else None
+
+    def get_repos(self, params, org):
+        if org != self.org.name:
+            return None
+        return [repo.payload() for repo in self.org.repos]
+
+    def get_repo(self, params, org, repo):
+        repo = self.__repo(org, repo)
+        return repo.payload() if repo else None
+
+    def get_branches(self, params, org, repo):
+        repo = self.__repo(org, repo)
+        if repo is None:
+            return None
+        return [{'name': name, 'protected': False,
+                 'commit': {'sha': history[0]['sha'], 'url': history[0]['url']}}
+                for name, history in repo.branches.items()]
+
+    def get_commits(self, params, org, repo):
+        repo = self.__repo(org, repo)
+        if repo is None:
+            return None
+
+        history = repo.branches.get(params.get('sha', 'main'))
+        if history is None:
+            return None
+
+        if params.get('since'):
+            since = params['since']
+            history = [c for c in history
+                       if parse_ts(c['commit']['committer']['date']) >= parse_ts(since)]
+        return history
+
+    def get_commit(self, params, org, repo, sha):
+        repo = self.__repo(org, repo)
+        return repo.commits.get(sha) if repo else None
+
+    def get_issues(self, params, org, repo):
+        repo = self.__repo(org, repo)
+        if repo is None:
+            return None
+
+        issues = sorted(repo.issues.values(), key=lambda i: i['number'], reverse=True)
+        if params.get('state', 'open') != 'all':
+            issues = [i for i in issues if i['state'] == params.get('state', 'open')]
+        if params.get('since'):
+            since = parse_ts(params['since'])
+            issues = [i for i in issues if parse_ts(i['updated_at']) >= since]
+        return self.__public(issues)
+
+    def get_issue_comments(self, params, org, repo, number):
+        repo = self.__repo(org, repo)
+        if repo is None or int(number) not in repo.issues:
+            return None
+        return repo.issues[int(number)]['_comments']
+
+    def get_repo_comments(self, params, org, repo):
+        repo = self.__repo(org, repo)
+        if repo is None:
+            return None
+
+        comments = repo.comments
+        if params.get('since'):
+            since = parse_ts(params['since'])
+            comments = [c for c in comments if parse_ts(c['updated_at']) >= since]
+        return comments
+
+    def get_tags(self, params, org, repo):
+        repo = self.__repo(org, repo)
+        return repo.tags if repo else None
+
+    def get_user(self, params, login):
+        if not re.match(r'^user-\d+$', login):
+            return None
+        return self.org.user(login, full=True)
+
+
+def add_org_args(parser: ArgumentParser):
+    """Add options that shape the synthetic org and the fake API."""
+    parser.add_argument('--org', dest='org', default='bench-org',
+                        help='Organization name (default bench-org)', metavar='ORG')
+    parser.add_argument('--repos', dest='repos', type=int, default=10,
+                        help='Number of repos (default 10)', metavar='N')
+    parser.add_argument('--branches', dest='branches', type=int, default=3,
+                        help='Branches per repo, main included (default 3)', metavar='M')
+    parser.add_argument('--commits', dest='commits', type=int, default=200,
+                        help='Commits on main per repo (default 200)', metavar='K')
+    parser.add_argument('--issues', dest='issues', type=int, default=50,
+                        help='Issues and pull requests per repo (default 50)', metavar='N')
+    parser.add_argument('--comments', dest='comments', type=int, default=2,
+                        help='Comments per issue (default 2)', metavar='N')
+    parser.add_argument('--tags', dest='tags', type=int, default=5,
+                        help='Tags per repo (default 5)', metavar='N')
+    parser.add_argument('--users', dest='users', type=int, default=50,
+                        help='Number of distinct contributors (default 50)', metavar='N')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.0,
+                        help='Milliseconds added to every response (default 0)',
+                        metavar='MS')
+    parser.add_argument('--rate-limit', dest='rate_limit', type=int, default=5000,
+                        help='Requests per hour before answering 403 (default 5000)',
+                        metavar='N')
+
+
+def create_server(args, host='127.0.0.1', port=0) -> FakeGitHub:
+    org = SyntheticOrg(name=args.org, repos=args.repos, branches=args.branches,
+                       commits=args.commits, issues=args.issues,
+                       comments=args.comments, tags=args.tags, users=args.users)
+    return FakeGitHub(org, latency=args.latency / 1000, rate_limit=args.rate_limit,
+                      host=host, port=port)
+
+
+def main():
+    parser = ArgumentParser(description='Serve a synthetic organization '
+                                        'through a fake GitHub REST API')
+    parser.add_argument('--port', dest='port', type=int, default=8000,
+                        help='Port to listen on (default 8000)', metavar='PORT')
+    add_org_args(parser)
+    args = parser.parse_args()
+
+    server = create_server(args, port=args.port)
+    print('Serving %s at %s, use --base-url %s' % (args.org, server.url, server.url))
+
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        print(' Interrupted')
+        print(json.dumps(server.stats(), indent=2))
+        server.server.server_close()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
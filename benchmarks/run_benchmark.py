@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+from datetime import datetime
+
+from tabulate import tabulate
+
+from fake_github import (
+    add_org_args,
+    create_server,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.connection import connect_to_db  # noqa: E402
+from utils.migrations import migrate  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+TABLES = ('contributors', 'repos', 'branches', 'commits', 'issues', 'comments', 'tags')
+
+# Metric: True if higher is better
+METRICS = {
+    'wall_time': False,
+    'objects_per_sec': True,
+    'api_calls': False,
+    'db_statements': False,
+    'peak_rss_mb': False,
+}
+
+
+def get_cli_args():
+    """Get command-line arguments."""
+    parser = ArgumentParser(description='Run the collector against a fake GitHub API '
+                                        'and a throwaway database, measure cold and '
+                                        'warm syncs')
+
+    parser.add_argument('-u', '--user', dest='user', required=True,
+                        help='Database user allowed to create databases',
+                        metavar='DBUSER')
+
+    parser.add_argument('-p', '--password', dest='password', required=True,
+                        help='Database password', metavar='DBPASS')
+
+    add_org_args(parser)
+
+    parser.add_argument('--collector-args', dest='collector_args', default='',
+                        help='Extra collector arguments, e.g. "--workers 4"',
+                        metavar='ARGS')
+
+    parser.add_argument('--advance', dest='advance', type=int, default=10,
+                        help='Commits and issues per repo added before the warm sync '
+                             '(default 10)', metavar='N')
+
+    parser.add_argument('--label', dest='label', default='',
+                        help='Label stored with the results', metavar='LABEL')
+
+    parser.add_argument('--results-dir', dest='results_dir', default=RESULTS_DIR,
+                        help='Where to save results (default benchmarks/results)',
+                        metavar='PATH')
+
+    parser.add_argument('--compare', dest='compare',
+                        help='Results file to compare with, "latest" for the most '
+                             'recent one in the results directory', metavar='PATH')
+
+    parser.add_argument('--threshold', dest='threshold', type=float, default=10,
+                        help='Percent a metric may get worse by before it is '
+                             'reported as a regression (default 10)', metavar='PCT')
+
+    parser.add_argument('--partition', dest='partition', action='store_true',
+                        help='Partition commits and comments by month, '
+                             'as migrate.py --partition does')
+
+    parser.add_argument('--keep-db', dest='keep_db', action='store_true',
+                        help='Do not drop the database afterwards')
+
+    return parser.parse_args()
+
+
+def get_git_rev() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=ROOT, stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_schema(conn, cursor, features=()):
+    """Create the tables of database.sql in the current database, migrate them."""
+    with open(os.path.join(ROOT, 'database.sql')) as f:
+        lines = [line for line in f
+                 if not line.startswith(('CREATE DATABASE', '\\'))]
+
+    cursor.execute(''.join(lines))
+    migrate(conn, features, verbose=False)
+
+
+class Database():
+    """A database created for a benchmark run and dropped after it."""
+
+    def __init__(self, user: str, password: str, features=()):
+        self.name = 'gh_stats_bench_%s' % os.getpid()
+        self.user = user
+        self.password = password
+
+        # Statistics are read through the maintenance database,
+        # so the reads are not counted for the benchmark one
+        self.admin_conn, self.admin = connect_to_db('postgres', user, password,
+                                                    autocommit=True)
+        self.admin.execute('DROP DATABASE IF EXISTS %s' % self.name)
+        self.admin.execute('CREATE DATABASE %s' % self.name)
+
+        self.conn, self.cursor = connect_to_db(self.name, user, password,
+                                               autocommit=True)
+        load_schema(self.conn, self.cursor, features)
+        self.has_statements = self.__enable_statements()
+
+    def __enable_statements(self) -> bool:
+        # Needs pg_stat_statements in shared_preload_libraries,
+        # otherwise statements are counted by the collector itself
+        try:
+            self.cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_stat_statements')
+            self.cursor.execute('SELECT count(*) FROM pg_stat_statements')
+            return True
+        except Exception:
+            return False
+
+    def statements(self) -> int:
+        """Number of statements run in the database so far.
+
+        Counted by pg_stat_statements, None if it is not available.
+        """
+        if not self.has_statements:
+            return None
+
+        # Statistics are flushed by backends with a delay
+        time.sleep(1)
+        self.admin.execute('SELECT pg_stat_clear_snapshot()')
+
+        self.admin.execute('SELECT oid FROM pg_database WHERE datname = %s',
+                           (self.name,))
+        oid = self.admin.fetchone()[0]
+        self.cursor.execute('SELECT coalesce(sum(calls), 0) FROM pg_stat_statements '
+                            'WHERE dbid = %s', (oid,))
+        return int(self.cursor.fetchone()[0])
+
+    def rows(self) -> dict:
+        rows = {}
+        for table in TABLES:
+            self.cursor.execute('SELECT count(*) FROM %s' % table)
+            rows[table] = self.cursor.fetchone()[0]
+        return rows
+
+    def drop(self):
+        self.conn.close()
+        self.admin.execute('DROP DATABASE IF EXISTS %s' % self.name)
+        self.admin_conn.close()
+
+
+def report_statements(path: str) -> int:
+    """Sum the statements counted in a collector report.
+
+    These are the statements run by the handlers and batch writers;
+    unlike pg_stat_statements it leaves out savepoints and transaction
+    control, which the collector runs around batch writes.
+    """
+    with open(path) as f:
+        report = json.load(f)
+
+    return sum(metric['value'] for metric in report['metrics']
+               if metric['name'] == 'db_statements_total')
+
+
+def run_collector(cli_args, db: Database, base_url: str, log_path: str) -> tuple:
+    """Run a full collector process.
+
+    Returns a tuple (wall time in seconds, peak RSS in MB,
+    statements counted by the collector).
+    """
+    report_path = '%s.%s.report.json' % (log_path, os.getpid())
+    cmd = [sys.executable, os.path.join(ROOT, 'gh_stats_collector.py'),
+           '-d', db.name, '-u', db.user, '-p', db.password,
+           '-o', cli_args.org, '-t', 'benchmark', '--base-url', base_url,
+           '--report', report_path]
+    cmd += shlex.split(cli_args.collector_args)
+
+    with open(log_path, 'a') as log:
+        log.write('$ %s\n' % ' '.join(cmd))
+        log.flush()
+
+        start = time.monotonic()
+        proc = subprocess.Popen(cmd, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        # Resource usage of this very process, not of all children
+        _, status, usage = os.wait4(proc.pid, 0)
+        took = time.monotonic() - start
+
+    returncode = os.waitstatus_to_exitcode(status)
+    if returncode != 0:
+        print('Collector exited with %s, see %s' % (returncode, log_path),
+              file=sys.stderr)
+        sys.exit(1)
+
+    statements = report_statements(report_path)
+    os.remove(report_path)
+
+    # ru_maxrss is in kilobytes on Linux
+    return took, usage.ru_maxrss / 1024, statements
+
+
+def run_phase(cli_args, db: Database, server, log_path: str) -> dict:
+    rows_before = db.rows()
+    statements_before = db.statements()
+    api_before = server.stats()
+
+    took, peak_rss, statements = run_collector(cli_args, db, server.url, log_path)
+
+    api_after = server.stats()
+    if db.has_statements:
+        statements = db.statements() - statements_before
+    rows_after = db.rows()
+
+    written = {t: rows_after[t] - rows_before[t] for t in TABLES}
+    objects = sum(written.values())
+
+    by_endpoint = {}
+    for endpoint, count in api_after['by_endpoint'].items():
+        diff = count - api_before['by_endpoint'].get(endpoint, 0)
+        if diff:
+            by_endpoint[endpoint] = diff
+
+    return {
+        'wall_time': round(took, 3),
+        'objects': objects,
+        'objects_per_sec': round(objects / took, 1) if took else 0.0,
+        'rows': written,
+        'api_calls': api_after['requests'] - api_before['requests'],
+        'api_calls_by_endpoint': by_endpoint,
+        'not_modified': api_after['not_modified'] - api_before['not_modified'],
+        'rate_limited': api_after['rate_limited'] - api_before['rate_limited'],
+        'db_statements': statements,
+        'peak_rss_mb': round(peak_rss, 1),
+    }
+
+
+def print_phase(name: str, phase: dict):
+    print('%s sync: %s objects in %.2fs (%.1f objects/s), %s API calls '
+          '(%s not modified, %s rate limited), %s DB statements, '
+          'peak RSS %.1f MB' % (name, phase['objects'], phase['wall_time'],
+                                phase['objects_per_sec'], phase['api_calls'],
+                                phase['not_modified'], phase['rate_limited'],
+                                phase['db_statements'], phase['peak_rss_mb']))
+
+
+def find_latest(results_dir: str) -> str:
+    names = sorted(n for n in os.listdir(results_dir) if n.endswith('.json'))
+    if not names:
+        print('No results in %s to compare with' % results_dir, file=sys.stderr)
+        sys.exit(1)
+
+    return os.path.join(results_dir, names[-1])
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """Print the metrics side by side.
+
+    Returns a list of regressions, metrics worse by more than threshold percent.
+    """
+    if old['params'] != new['params']:
+        print('Warning: the results were produced with different parameters, '
+              'the comparison may be meaningless')
+
+    if old.get('db_statements_source') != new['db_statements_source']:
+        print('Warning: DB statements were counted by %s before and by %s now, '
+              'they are not comparable' % (old.get('db_statements_source'),
+                                           new['db_statements_source']))
+
+    rows = []
+    regressions = []
+    for phase in new['phases']:
+        if phase not in old['phases']:
+            continue
+
+        for metric, higher_is_better in METRICS.items():
+            before = old['phases'][phase][metric]
+            after = new['phases'][phase][metric]
+            change = (after - before) / before * 100 if before else 0.0
+
+            worse = -change if higher_is_better else change
+            mark = ''
+            if worse > threshold:
+                mark = 'REGRESSION'
+                regressions.append('%s %s' % (phase, metric))
+
+            rows.append((phase, metric, before, after, '%+.1f%%' % change, mark))
+
+    print('Compared with %s (%s)' % (old['git_rev'], old['timestamp']))
+    print(tabulate(rows, headers=('Sync', 'Metric', 'Before', 'After', 'Change', '')))
+    return regressions
+
+
+def main():
+    cli_args = get_cli_args()
+
+    baseline = None
+    if cli_args.compare:
+        path = cli_args.compare
+        if path == 'latest':
+            path = find_latest(cli_args.results_dir)
+
+        with open(path) as f:
+            baseline = json.load(f)
+
+    os.makedirs(cli_args.results_dir, exist_ok=True)
+
+    rev = get_git_rev()
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    name = '%s-%s%s' % (stamp, rev, '-%s' % cli_args.label if cli_args.label else '')
+    log_path = os.path.join(cli_args.results_dir, '%s.log' % name)
+
+    server = create_server(cli_args)
+    server.start()
+    db = Database(cli_args.user, cli_args.password,
+                  features=('partition',) if cli_args.partition else ())
+
+    results = {
+        'git_rev': rev,
+        'timestamp': stamp,
+        'label': cli_args.label,
+        'params': {
+            'repos': cli_args.repos,
+            'branches': cli_args.branches,
+            'commits': cli_args.commits,
+            'issues': cli_args.issues,
+            'comments': cli_args.comments,
+            'tags': cli_args.tags,
+            'users': cli_args.users,
+            'latency_ms': cli_args.latency,
+            'rate_limit': cli_args.rate_limit,
+            'advance': cli_args.advance,
+            'partition': cli_args.partition,
+            'collector_args': cli_args.collector_args,
+        },
+        'db_statements_source': ('pg_stat_statements' if db.has_statements
+                                 else 'collector report'),
+        'phases': {},
+    }
+
+    try:
+        # Full sync into the empty database
+        results['phases']['cold'] = run_phase(cli_args, db, server, log_path)
+        print_phase('Cold', results['phases']['cold'])
+
+        # Incremental sync after some changes
+        server.org.advance(commits=cli_args.advance, issues=cli_args.advance,
+                           touched=cli_args.advance)
+        results['phases']['warm'] = run_phase(cli_args, db, server, log_path)
+        print_phase('Warm', results['phases']['warm'])
+
+    finally:
+        server.stop()
+        if cli_args.keep_db:
+            print('Database %s is kept' % db.name)
+        else:
+            db.drop()
+
+    path = os.path.join(cli_args.results_dir, '%s.json' % name)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to %s' % path)
+
+    if baseline is not None:
+        regressions = compare(baseline, results, cli_args.threshold)
+        if regressions:
+            print('Regressions: %s' % ', '.join(regressions))
+            sys.exit(1)
+
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
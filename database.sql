@@ -1,4 +1,7 @@
--- To create a PostgreSQL database with tables to store collected data in
+-- To create a PostgreSQL database with tables to store collected data in.
+-- It is the baseline schema: apply the migrations of migrations/ with
+-- migrate.py afterwards, they make the schema the collector needs.
+-- Schema changes go to new migrations, not to this file.
 
 CREATE DATABASE gh_stats;
 \c gh_stats
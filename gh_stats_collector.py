@@ -1,29 +1,404 @@
 #!/usr/bin/python3
 # Copyright: (c) 2021, Andrew Klychkov (@Andersson007) <aklychko@redhat.com>
 
+import os
+import socket
 import sys
 
+from argparse import Namespace
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
 from datetime import datetime
+from threading import local
 
 from github import Github
+from github import GithubException
+from github import Repository
+
+from psycopg2.extensions import cursor as PgCursor
 
 from handlers.branch_handler import BranchHandler
 from handlers.commit_handler import CommitHandler
+from handlers.contributor_handler import ContributorHandler
 from handlers.issue_handler import IssueHandler
+from handlers.job_handler import (
+    Heartbeat,
+    JobHandler,
+)
 from handlers.repo_handler import RepoHandler
+from handlers.sync_handler import (
+    RepoCheckpoints,
+    StageCheckpoint,
+    SyncRunHandler,
+)
 from handlers.tag_handler import TagHandler
 
-from utils.connection import connect_to_db
+from utils.async_fetch import (
+    AsyncGithub,
+    FetchError,
+    PER_PAGE,
+)
+from utils.connection import (
+    StatementError,
+    connect_to_db,
+    create_pool,
+    pooled_cursor,
+)
+from utils import gh_http
+from utils import id_cache
+from utils import metrics
+from utils.profiling import create_profiler
+from utils.http_cache import HttpCache
+from utils.payload import raw_payload
+from utils.rate_limit import RateLimitScheduler
+from utils.recording import (
+    RecordingGithub,
+    ReplayGithub,
+    clear_recording,
+    write_settings,
+)
+from utils.stopping import (
+    Stopped,
+    stopping,
+)
+from utils.write_pipeline import WritePipeline
 
 from utils.gh_stats_collector_functions import (
+    ProgressReporter,
     extract_repos,
+    extract_tokens,
     get_cli_args,
     parse_config,
 )
 
 
+# Profiles of deferred users are requested and written by this many
+USER_BATCH = 100
+
+# Share of the rate limit that profile requests leave untouched
+USER_RESERVE_SHARE = 0.25
+
+
+def get_github(cli_args: Namespace, scheduler: RateLimitScheduler,
+               cache: HttpCache = None):
+    """Create an object to access GitHub with.
+
+    Whatever token it is created with, every request
+    is sent with the token the scheduler picks.
+    """
+    if cli_args.replay:
+        return ReplayGithub(cli_args.replay)
+
+    token = scheduler.tokens[0].token
+
+    if cli_args.async_fetch:
+        gh = AsyncGithub(token, base_url=cli_args.base_url,
+                         concurrency=cli_args.fetch_concurrency,
+                         scheduler=scheduler, cache=cache)
+    else:
+        # Pages as large as GitHub allows, as --async-fetch requests them
+        gh = Github(token, base_url=cli_args.base_url, per_page=PER_PAGE)
+
+    if cli_args.record:
+        return RecordingGithub(gh, cli_args.record)
+
+    return gh
+
+
+def close_github(gh):
+    """Close what a Github object holds, e.g. the aiohttp session of --async-fetch."""
+    if not hasattr(gh, 'close'):
+        return
+
+    try:
+        gh.close()
+    except RuntimeError:
+        # Still used by a worker thread of an interrupted run
+        pass
+
+
+def repo_stages(cli_args: Namespace) -> tuple:
+    """Get names of the stages the options ask for, in the order they run."""
+    if cli_args.repos_only:
+        return ()
+
+    if cli_args.issues_only:
+        return ('issues',)
+
+    if cli_args.branches_only:
+        return ('issues', 'branches')
+
+    return ('issues', 'commits', 'tags')
+
+
+def collect_repo(repo: Repository, cursor: PgCursor, cli_args: Namespace,
+                 run_id: int, writer_cursor: PgCursor = None, stages=None):
+    """Collect a repo.
+
+    stages - names of the stages to run, all the options ask for
+             by default; only then the repo is marked done.
+    When writer_cursor is passed, batches are written through it in
+    a transaction per stage, committed at checkpoints, while fetching
+    goes on, see --write-queue.
+    """
+    whole_repo = stages is None
+    if whole_repo:
+        stages = repo_stages(cli_args)
+
+    if not stages:
+        return
+
+    pipeline = None
+    if writer_cursor is not None:
+        pipeline = WritePipeline(writer_cursor, size=cli_args.write_queue)
+
+    try:
+        repo_id = RepoHandler(cursor).get_id(repo.name)
+        checkpoints = RepoCheckpoints(cursor, run_id, repo_id)
+
+        # Stages completed by the run are skipped, see --resume
+        for stage in stages:
+            if not checkpoints.is_done(stage):
+                STAGES[stage](repo, repo_id, cursor, cli_args, checkpoints, pipeline)
+                # Nothing of a stage marked done is left uncommitted
+                if pipeline is not None:
+                    pipeline.wait()
+                checkpoints.done(stage)
+                # Cached dashboard results show the stage from now on
+                SyncRunHandler(cursor).mark_ingested()
+
+        if whole_repo:
+            checkpoints.done('repo')
+
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+
+
+def collect_issues(repo: Repository, repo_id: int, cursor: PgCursor,
+                   cli_args: Namespace, checkpoints: RepoCheckpoints,
+                   pipeline: WritePipeline = None):
+    with metrics.registry.stage('issues'):
+        issue_handler = IssueHandler(cursor, comment_sweep=cli_args.comment_sweep,
+                                     pipeline=pipeline,
+                                     defer_users=cli_args.defer_users,
+                                     full=bool(cli_args.record))
+        issue_handler.handle(repo, StageCheckpoint(checkpoints, 'issues'))
+
+
+def collect_branches(repo: Repository, repo_id: int, cursor: PgCursor,
+                     cli_args: Namespace, checkpoints: RepoCheckpoints,
+                     pipeline: WritePipeline = None) -> list:
+    """Add and remove branches as they are on GitHub.
+
+    Returns a list of branches with commits not collected yet.
+    """
+    with metrics.registry.stage('branches'):
+        branches = repo.get_branches()
+        # A recording holds everything, not what changed since the last run
+        moved = BranchHandler(cursor).sync(repo_id, branches,
+                                           full=bool(cli_args.record),
+                                           default_branch=repo.default_branch)
+        metrics.registry.inc('branches_unchanged_total', len(branches) - len(moved))
+
+    return moved
+
+
+def collect_commits(repo: Repository, repo_id: int, cursor: PgCursor,
+                    cli_args: Namespace, checkpoints: RepoCheckpoints,
+                    pipeline: WritePipeline = None):
+    # Commits need the branch list, get it again if they are not done
+    moved = collect_branches(repo, repo_id, cursor, cli_args, checkpoints)
+    checkpoints.done('branches')
+
+    # Handle commits of branches whose head moved,
+    # nothing is requested for the rest
+    with metrics.registry.stage('commits'):
+        commit_handler = CommitHandler(cursor, pipeline=pipeline,
+                                       defer_users=cli_args.defer_users,
+                                       full=bool(cli_args.record))
+        for branch in moved:
+            stage = 'commits/%s' % branch.name
+            if checkpoints.is_done(stage):
+                continue
+
+            commit_handler.handle(repo, branch.name,
+                                  checkpoint=StageCheckpoint(checkpoints, stage))
+            checkpoints.done(stage)
+
+
+def collect_tags(repo: Repository, repo_id: int, cursor: PgCursor,
+                 cli_args: Namespace, checkpoints: RepoCheckpoints,
+                 pipeline: WritePipeline = None):
+    with metrics.registry.stage('tags'):
+        tag_handler = TagHandler(cursor)
+        tag_handler.handle(repo)
+
+
+# Stages a repo is collected in, each can run as a job of its own
+STAGES = {
+    'issues': collect_issues,
+    'branches': collect_branches,
+    'commits': collect_commits,
+    'tags': collect_tags,
+}
+
+
+def enrich_users(gh, cursor: PgCursor, cli_args: Namespace,
+                 scheduler: RateLimitScheduler):
+    """Fetch profiles of users stored without them, see --defer-users.
+
+    At most --user-requests profiles are fetched, and none once
+    the rate limit left falls below USER_RESERVE_SHARE of it, so that
+    the next collection is not starved. The rest wait for later runs.
+    """
+    contributor = ContributorHandler(cursor)
+    fetched = 0
+
+    while fetched < cli_args.user_requests:
+        limit = min(USER_BATCH, cli_args.user_requests - fetched)
+        pending = contributor.get_pending(limit)
+        if not pending:
+            break
+
+        profiles = []
+        for contributor_id, login in pending:
+            budget = scheduler.budget()
+            if budget['limit'] and budget['remaining'] < budget['limit'] * USER_RESERVE_SHARE:
+                break
+
+            try:
+                payload = raw_payload(gh.get_user(login))
+            except (GithubException, FetchError) as e:
+                if e.status != 404:
+                    raise
+                # The account has been deleted
+                payload = {}
+
+            profiles.append((contributor_id, payload.get('name'), payload.get('email')))
+
+        # Written by batches, so that an interrupted run keeps them
+        if profiles:
+            contributor.set_profiles(profiles)
+            fetched += len(profiles)
+            metrics.registry.inc('users_enriched_total', len(profiles))
+
+        if len(profiles) < len(pending):
+            # Out of rate limit
+            break
+
+    pending = contributor.count_pending()
+    metrics.registry.set('users_pending', pending)
+    if fetched:
+        SyncRunHandler(cursor).mark_ingested()
+
+    if fetched or pending:
+        print('User profiles: %s fetched, %s left for later runs' % (fetched, pending))
+
+
+def enqueue_jobs(cursor: PgCursor, cli_args: Namespace, run_id: int,
+                 repo_names: list) -> int:
+    """Queue a job per repo and stage for workers, see --worker.
+
+    Returns the number of jobs queued, those the run already has are skipped.
+    """
+    stages = repo_stages(cli_args)
+
+    # Tags are queued after everything else, so that they are
+    # usually handled when the tagged commits are collected
+    jobs = [(name, stage) for stage in stages if stage != 'tags' for name in repo_names]
+    jobs += [(name, 'tags') for name in repo_names if 'tags' in stages]
+
+    return JobHandler(cursor).add(run_id, cli_args.org, jobs)
+
+
+def run_claimed_jobs(worker: str, gh, cursor: PgCursor, cli_args: Namespace,
+                     heartbeat: Heartbeat, profiler, progress: ProgressReporter,
+                     writer_cursor: PgCursor = None):
+    """Claim jobs of the org and run them until none is left.
+
+    A failed job is queued again for any worker, up to MAX_ATTEMPTS times.
+    """
+    jobs = JobHandler(cursor)
+
+    while True:
+        job = jobs.claim(cli_args.org, worker)
+        if job is None:
+            return
+
+        job_id, run_id, repo_name, stage = job
+        heartbeat.add(job_id, worker)
+        start_time = datetime.now()
+
+        try:
+            repo = gh.get_repo('%s/%s' % (cli_args.org, repo_name))
+
+            with profiler.profile('%s-%s' % (repo_name, stage)), \
+                    metrics.registry.scope(repo=repo_name), \
+                    metrics.registry.timer('repo_seconds'):
+                collect_repo(repo, cursor, cli_args, run_id, writer_cursor,
+                             stages=(stage,))
+
+        except Stopped:
+            # Not a failure, the job is taken over when its lease expires
+            heartbeat.remove(job_id)
+            raise
+
+        except Exception as e:
+            heartbeat.remove(job_id)
+            print('Job %s, %s of %s, failed: %s' % (job_id, stage, repo_name, e),
+                  file=sys.stderr)
+            jobs.fail(job_id, worker, str(e))
+            continue
+
+        heartbeat.remove(job_id)
+
+        if not jobs.complete(job_id, worker):
+            print('Job %s, %s of %s, has been taken over by another worker'
+                  % (job_id, stage, repo_name), file=sys.stderr)
+        elif jobs.finish_run(run_id):
+            print('Run %s finished' % run_id)
+
+        progress.report('%s %s' % (repo_name, stage), datetime.now() - start_time)
+
+
+def export_metrics(cli_args: Namespace, scheduler: RateLimitScheduler,
+                   http_cache: HttpCache = None):
+    """Record the state of caches and of the rate limit, write the metrics."""
+    registry = metrics.registry
+
+    for cache in id_cache.ALL_CACHES:
+        stats = cache.stats()
+        for field in ('hits', 'misses', 'evictions', 'hit_rate'):
+            registry.set('id_cache_%s' % field, stats[field], cache=stats['name'])
+
+    if http_cache is not None:
+        for field, value in http_cache.stats().items():
+            registry.set('http_cache_%s' % field, value)
+
+    budget = scheduler.budget()
+    registry.set('rate_limit_remaining', budget['remaining'])
+    registry.set('rate_limit_limit', budget['limit'])
+    registry.set('rate_limit_reset', budget['reset'])
+    registry.set('rate_limit_throttled', budget['throttled'])
+
+    if cli_args.report:
+        registry.write_report(cli_args.report, {'org': cli_args.org})
+
+    if cli_args.prom_file:
+        registry.write_prom(cli_args.prom_file)
+
+
 def main():
 
+    executor = None
+    run_id = None
+    heartbeat = None
+    # Github objects of the process, closed at exit
+    github_objects = []
+
     try:
         # Get command-line arguments
         cli_args = get_cli_args()
@@ -32,18 +407,71 @@ def main():
         if cli_args.config:
             cli_args = parse_config(cli_args)
 
+        if cli_args.record and cli_args.overwrite:
+            clear_recording(cli_args.record)
+
+        if cli_args.record:
+            write_settings(cli_args.record, {'comment_sweep': cli_args.comment_sweep})
+
         # Connect to database
         conn, cursor = connect_to_db(database=cli_args.database,
                                      user=cli_args.user,
                                      password=cli_args.password,
                                      autocommit=True)
 
+        # Load known IDs at once instead of looking them up one by one
+        id_cache.warm_up(cursor)
+
+        # Batches are written through a connection of their own, in transactions;
+        # lookups, IDs and checkpoints are committed right away
+        writer_cursor = None
+        if cli_args.workers == 1:
+            writer_conn, writer_cursor = connect_to_db(database=cli_args.database,
+                                                       user=cli_args.user,
+                                                       password=cli_args.password)
+
         repo_handler = RepoHandler(cursor)
 
         repos_in_db = repo_handler.get_repo_list()
 
+        # Progress of the run is saved in the database, so that
+        # an interrupted run can be continued with --resume.
+        # Workers run jobs of the run they were queued by
+        sync_run = SyncRunHandler(cursor)
+        lists_repos = cli_args.enqueue or not cli_args.worker
+
+        if lists_repos and cli_args.resume:
+            run_id = sync_run.get_id(cli_args.org)
+            if run_id is None:
+                print('No unfinished run to resume, starting a new one')
+            else:
+                print('Resuming run %s' % run_id)
+                sync_run.set_status(run_id, 'running')
+
+        if lists_repos and run_id is None:
+            run_id = sync_run.add(cli_args.org)
+
+        done_repos = set()
+        if run_id is not None:
+            done_repos = sync_run.get_done_repos(run_id)
+
+        # Requests are spread over the tokens and kept within their budgets
+        max_concurrency = cli_args.workers
+        if cli_args.async_fetch:
+            max_concurrency *= cli_args.fetch_concurrency
+
+        scheduler = RateLimitScheduler(extract_tokens(cli_args.token or ''),
+                                       max_concurrency=max_concurrency)
+        http_cache = None
+        if cli_args.http_cache:
+            http_cache = HttpCache(cli_args.http_cache,
+                                   max_bytes=cli_args.http_cache_size * 2 ** 20)
+
+        gh_http.install(scheduler, http_cache)
+
         # Create github object and set access token
-        gh = Github(cli_args.token)
+        gh = get_github(cli_args, scheduler, http_cache)
+        github_objects.append(gh)
 
         # Handle repos
         repos_needed = None
@@ -54,78 +482,189 @@ def main():
         if cli_args.skip_repo:
             repos_to_skip = extract_repos(cli_args.skip_repo)
 
-        # Get orgs
-        gh_org = gh.get_organization(cli_args.org)
-
-        # Init handlers
-        tag_handler = TagHandler(cursor)
-        commit_handler = CommitHandler(cursor)
-        issue_handler = IssueHandler(cursor)
-
-        repos = gh_org.get_repos()
-
-        # Get repos from GH and do main job
-        for repo in repos:
-            # Skip what we don't need
-            if repos_needed and repo.name not in repos_needed:
-                continue
+        progress = ProgressReporter()
 
-            if repos_to_skip and repo.name in repos_to_skip:
-                continue
+        profiler = create_profiler(cli_args.profile, threads=cli_args.workers)
 
-            # If we don't have it now, add repo to DB
-            if repo.name not in repos_in_db:
-                repo_handler.add(repo.name)
+        if cli_args.workers > 1 and not cli_args.repos_only:
+            # Every worker thread takes its own connection from the pool
+            # and uses its own Github object, PyGithub objects are not
+            # meant to be shared between threads
+            # Two connections per worker, one for writing batches
+            pool = create_pool(database=cli_args.database,
+                               user=cli_args.user,
+                               password=cli_args.password,
+                               size=cli_args.workers * 2)
+            executor = ThreadPoolExecutor(max_workers=cli_args.workers)
+            worker_state = local()
 
-            print(repo.name, end=' ')
+        def work(repo: Repository):
             start_time = datetime.now()
 
-            if cli_args.repos_only:
-                end_time = datetime.now()
-                print('done, took %s' % str(end_time - start_time))
-                continue
+            with profiler.profile(repo.name), \
+                    metrics.registry.scope(repo=repo.name), \
+                    metrics.registry.timer('repo_seconds'):
+
+                if executor is None:
+                    collect_repo(repo, cursor, cli_args, run_id, writer_cursor)
+
+                else:
+                    if not hasattr(worker_state, 'gh'):
+                        worker_state.gh = get_github(cli_args, scheduler, http_cache)
+                        github_objects.append(worker_state.gh)
+
+                    repo = worker_state.gh.get_repo(repo.full_name)
+
+                    with pooled_cursor(pool, autocommit=True) as worker_cursor, \
+                            pooled_cursor(pool) as worker_writer_cursor:
+                        collect_repo(repo, worker_cursor, cli_args, run_id,
+                                     worker_writer_cursor)
+
+            progress.report(repo.name, datetime.now() - start_time)
+
+        def run_jobs(worker: str):
+            """Claim and run jobs of the queue until none is left."""
+            if executor is None:
+                run_claimed_jobs(worker, gh, cursor, cli_args, heartbeat,
+                                 profiler, progress, writer_cursor)
+                return
+
+            worker_gh = get_github(cli_args, scheduler, http_cache)
+            github_objects.append(worker_gh)
+
+            with pooled_cursor(pool, autocommit=True) as worker_cursor, \
+                    pooled_cursor(pool) as worker_writer_cursor:
+                run_claimed_jobs(worker, worker_gh, worker_cursor, cli_args,
+                                 heartbeat, profiler, progress, worker_writer_cursor)
+
+        futures = []
+
+        if lists_repos:
+            # Get orgs
+            gh_org = gh.get_organization(cli_args.org)
+
+            repos = gh_org.get_repos()
+
+            to_queue = []
+            repos_added = False
+
+            # Get repos from GH and do main job
+            for repo in repos:
+                # Skip what we don't need
+                if repos_needed and repo.name not in repos_needed:
+                    continue
+
+                if repos_to_skip and repo.name in repos_to_skip:
+                    continue
+
+                # If we don't have it now, add repo to DB
+                if repo.name not in repos_in_db:
+                    repo_handler.add(repo.name)
+                    repos_added = True
+
+                # Completed before the run was interrupted
+                if repo_handler.get_id(repo.name) in done_repos:
+                    continue
+
+                if cli_args.enqueue:
+                    to_queue.append(repo.name)
+                elif executor is None:
+                    work(repo)
+                else:
+                    futures.append(executor.submit(work, repo))
+
+            # No stage runs to move the marker
+            if cli_args.repos_only and repos_added:
+                sync_run.mark_ingested()
+
+            if cli_args.enqueue:
+                queued = enqueue_jobs(cursor, cli_args, run_id, to_queue)
+                print('%s jobs of %s repos queued for run %s'
+                      % (queued, len(to_queue), run_id))
+
+        if cli_args.worker:
+            # Leases are extended through a connection of their own
+            heartbeat_conn, heartbeat_cursor = connect_to_db(database=cli_args.database,
+                                                             user=cli_args.user,
+                                                             password=cli_args.password,
+                                                             autocommit=True)
+            heartbeat = Heartbeat(heartbeat_cursor)
+            heartbeat.start()
+
+            worker = '%s:%s' % (socket.gethostname(), os.getpid())
+            if executor is None:
+                run_jobs(worker)
+            else:
+                futures += [executor.submit(run_jobs, '%s/%s' % (worker, n))
+                            for n in range(cli_args.workers)]
+
+        # Re-raise errors of workers, if any
+        for future in as_completed(futures):
+            future.result()
+
+        # Replay has no access to GitHub, a process
+        # that only queues jobs collects nothing
+        if cli_args.user_requests and not cli_args.replay and \
+                (cli_args.worker or not cli_args.enqueue):
+            with profiler.profile('users'), metrics.registry.stage('users'):
+                enrich_users(gh, cursor, cli_args, scheduler)
+
+    except StatementError as e:
+        print(e, file=sys.stderr)
+        if run_id is not None and not cli_args.enqueue:
+            print('Run %s can be continued with --resume' % run_id, file=sys.stderr)
+        sys.exit(1)
 
-            # Handle issues
-            issue_handler.handle(repo)
+    except KeyboardInterrupt:
+        print(' Interrupted')
+        if executor is not None:
+            # Workers stop between pages, they use pooled
+            # connections and Github objects until then
+            print('Waiting for workers to stop')
+            stopping.set()
+            scheduler.wake()
+            executor.shutdown(cancel_futures=True)
+            pool.closeall()
+        if heartbeat is not None:
+            # Other workers take the jobs over
+            heartbeat.stop()
+        elif run_id is not None and not cli_args.enqueue:
+            sync_run.set_status(run_id, 'interrupted')
+            print('Run %s can be continued with --resume' % run_id)
+        sys.exit(0)
 
-            if cli_args.issues_only:
-                end_time = datetime.now()
-                print('done, took %s' % str(end_time - start_time))
-                continue
+    finally:
+        for gh in github_objects:
+            close_github(gh)
 
-            # Get branches from GitHub
-            branches = repo.get_branches()
+    if executor is not None:
+        executor.shutdown()
+        pool.closeall()
 
-            # Get branches from DB
-            branch_handler = BranchHandler(cursor)
-            branches_in_db = branch_handler.get_repo_branches(repo.name)
+    if heartbeat is not None:
+        heartbeat.stop()
+        heartbeat_conn.close()
 
-            # Remove irrelevant branches from DB
-            if branches_in_db:
-                for b_name, b_id in branches_in_db.items():
-                    if b_name not in branches:
-                        branch_handler.remove(b_id)
+    # Runs of queued jobs are finished by the worker completing the last job
+    if not cli_args.enqueue and not cli_args.worker:
+        sync_run.finish(run_id)
 
-            # Handle branches
-            for branch in branches:
-                # Handle commits
-                commit_handler.handle(repo, branch.name,
-                                      branches_only=cli_args.branches_only)
+    profiler.close()
 
-            if cli_args.branches_only:
-                continue
+    id_cache.print_stats()
+    scheduler.print_budget()
 
-            # Handle tags
-            tag_handler.handle(repo)
+    if http_cache is not None:
+        http_cache.print_stats()
 
-            end_time = datetime.now()
-            print('done, took %s' % str(end_time - start_time))
+    export_metrics(cli_args, scheduler, http_cache)
 
-    except KeyboardInterrupt:
-        print(' Interrupted')
-        sys.exit(0)
+    if http_cache is not None:
+        http_cache.close()
 
     # DB close connection
+    if writer_cursor is not None:
+        writer_conn.close()
     conn.close()
     sys.exit(0)
 
@@ -86,6 +86,29 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# 'gstats' keeps query results of the views for TIMEOUT seconds at most,
+# less when the collector stores new data, see gstats/cache.py.
+# It is per process in memory; to share it between processes, use
+# 'django.core.cache.backends.filebased.FileBasedCache' with a directory
+# as LOCATION.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'gstats': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'gstats',
+        'TIMEOUT': 300,
+    },
+}
+
+# Seconds the collector's last ingestion time is reused before it is read again
+GSTATS_MARKER_SECONDS = 10
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
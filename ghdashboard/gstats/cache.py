@@ -0,0 +1,85 @@
+"""Cache of view query results, invalidated when the collector stores data.
+
+Results are kept in the 'gstats' cache of settings.CACHES for its TIMEOUT
+at most. Their keys include the last ingestion time the collector writes
+to ingestion_marker, so once it moves, results computed before are not
+used again. The same time gives responses their ETag and Last-Modified.
+"""
+
+import hashlib
+import time
+
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import (
+    DatabaseError,
+    connection,
+)
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+# Seconds the last ingestion time is used before it is read again,
+# so that requests served from the cache do not touch the database
+MARKER_SECONDS = getattr(settings, 'GSTATS_MARKER_SECONDS', 10)
+
+_marker = {'value': None, 'read_at': None}
+_marker_lock = Lock()
+
+# Told apart from results that are None
+_MISSING = object()
+
+
+def last_ingestion():
+    """Get the time the collector last stored data, None if unknown."""
+    with _marker_lock:
+        now = time.monotonic()
+        if _marker['read_at'] is not None and now - _marker['read_at'] < MARKER_SECONDS:
+            return _marker['value']
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT updated_at FROM ingestion_marker')
+                row = cursor.fetchone()
+        except DatabaseError:
+            # migrate.py has not been run, results live for TIMEOUT
+            row = None
+
+        _marker['value'] = row[0] if row else None
+        _marker['read_at'] = now
+        return _marker['value']
+
+
+def cached(name: str, compute, *args):
+    """Get the result of compute(*args) from the cache, compute and store it if needed."""
+    key = 'gstats:%s' % hashlib.md5(repr((name, args, last_ingestion())).encode()).hexdigest()
+
+    cache = caches['gstats']
+    result = cache.get(key, _MISSING)
+    if result is _MISSING:
+        result = compute(*args)
+        cache.set(key, result)
+
+    return result
+
+
+def etag(request, *args, **kwargs):
+    marker = last_ingestion()
+    if marker is None:
+        return None
+    return hashlib.md5(repr((request.path, marker)).encode()).hexdigest()
+
+
+def last_modified(request, *args, **kwargs):
+    return last_ingestion()
+
+
+def revalidated(view):
+    """Send ETag and Last-Modified of the last ingestion with the view's responses.
+
+    Clients are asked to revalidate every time, which
+    is answered with 304 until the collector stores data.
+    """
+    view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+    return cache_control(no_cache=True)(view)
@@ -12,10 +12,13 @@ class Branches(models.Model):
     id = models.BigAutoField(primary_key=True)
     name = models.TextField(blank=True, null=True)
     repo = models.ForeignKey('Repos', models.DO_NOTHING, blank=True, null=True)
+    head_sha = models.TextField(blank=True, null=True)
+    head_ts = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         managed = False
         db_table = 'branches'
+        unique_together = (('repo', 'name'),)
 
 
 class Comments(models.Model):
@@ -48,6 +51,7 @@ class Contributors(models.Model):
     login = models.TextField()
     name = models.TextField(blank=True, null=True)
     email = models.TextField(blank=True, null=True)
+    profile_pending = models.BooleanField(default=False)
 
     class Meta:
         managed = False
@@ -75,6 +79,8 @@ class Issues(models.Model):
 class Repos(models.Model):
     name = models.TextField(unique=True, blank=True, null=True)
     full_name = models.TextField(blank=True, null=True)
+    issues_synced_at = models.DateTimeField(blank=True, null=True)
+    comments_synced_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         managed = False
@@ -86,7 +92,9 @@ class Tags(models.Model):
     repo = models.ForeignKey(Repos, models.DO_NOTHING, blank=True, null=True)
     tarball = models.BooleanField(blank=True, null=True)
     commit = models.ForeignKey(Commits, models.DO_NOTHING, blank=True, null=True)
+    commit_sha = models.TextField(blank=True, null=True)
 
     class Meta:
         managed = False
         db_table = 'tags'
+        unique_together = (('repo', 'name'),)
@@ -1,3 +1,63 @@
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from . import cache
+from .views import get_repos_and_branches
+
+
+class ReposAndBranchesTests(TestCase):
+    """The page takes a single query however many repos there are."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # The models are not managed, the test database has no tables of the collector
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE repos (id SERIAL PRIMARY KEY, name TEXT)')
+            cursor.execute('CREATE TABLE branches (id BIGSERIAL PRIMARY KEY, '
+                           'name TEXT, repo_id INT)')
+            cursor.execute('CREATE TABLE ingestion_marker (id BOOLEAN PRIMARY KEY, '
+                           'updated_at TIMESTAMP NOT NULL)')
+            cursor.execute('INSERT INTO ingestion_marker VALUES (true, now())')
+
+            for n in range(20):
+                cursor.execute('INSERT INTO repos (name) VALUES (%s) RETURNING id',
+                               ('repo%02d' % n,))
+                repo_id = cursor.fetchone()[0]
+                for branch in ('main', 'devel'):
+                    cursor.execute('INSERT INTO branches (name, repo_id) VALUES (%s, %s)',
+                                   (branch, repo_id))
+
+            cursor.execute("INSERT INTO repos (name) VALUES ('empty')")
+
+    def setUp(self):
+        caches['gstats'].clear()
+        cache._marker['read_at'] = None
+
+    def test_get_repos_and_branches(self):
+        with self.assertNumQueries(1):
+            result = get_repos_and_branches()
+
+        self.assertEqual(len(result), 21)
+        self.assertEqual(result[0], ('empty', []))
+        self.assertEqual(result[1], ('repo00', ['devel', 'main']))
+
+    def test_view(self):
+        # The last ingestion time and the repos with their branches
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('repos-branches'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['repo_num'], 21)
+
+        # Served from the cache
+        with self.assertNumQueries(0):
+            self.client.get(reverse('repos-branches'))
+
+    def test_revalidation(self):
+        response = self.client.get(reverse('repos-branches'))
+
+        response = self.client.get(reverse('repos-branches'),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
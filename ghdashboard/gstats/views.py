@@ -1,10 +1,10 @@
 from csv import writer as csv_writer
 
-from operator import itemgetter
-
+from django.db import connection
 from django.http import HttpResponse
 from django.shortcuts import render
 
+from .cache import cached, revalidated
 from .models import Branches, Contributors, Repos
 
 
@@ -27,25 +27,27 @@ def repos(request):
     return render(request, 'gstats/repos.html', context)
 
 
-def repos_and_branches(request):
-    """Repos and their branches."""
-    repos = Repos.objects.raw('SELECT id, name FROM repos')
+def get_repos_and_branches():
+    # Repos with their branch names, one row per repo; the "C" collation
+    # sorts names the way Python does
+    query = ('SELECT r.name, '
+             'array_remove(array_agg(b.name ORDER BY b.name COLLATE "C"), NULL) '
+             'FROM repos AS r LEFT JOIN branches AS b ON b.repo_id = r.id '
+             'GROUP BY r.id, r.name ORDER BY r.name COLLATE "C"')
 
-    query = ('SELECT b.id, b.name FROM branches AS b '
-             'LEFT JOIN repos AS r ON r.id = b.repo_id '
-             'WHERE r.name = %s ORDER BY b.name')
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        return [(row[0], list(row[1])) for row in cursor.fetchall()]
 
-    repos_and_branches = []
-    for repo in repos:
-        branches = Branches.objects.raw(query, (repo.name,))
-        repos_and_branches.append([repo.name, [b.name for b in branches]])
 
-    repos_and_branches.sort()
-    repo_num = len(repos)
+@revalidated
+def repos_and_branches(request):
+    """Repos and their branches."""
+    repos_and_branches = cached('repos_and_branches', get_repos_and_branches)
 
     context = {
         'repos_and_branches': repos_and_branches,
-        'repo_num': repo_num,
+        'repo_num': len(repos_and_branches),
     }
 
     return render(request, 'gstats/repos-branches.html', context)
@@ -53,42 +55,27 @@ def repos_and_branches(request):
 
 def get_latest_releases():
     # TODO: move to a library
-    query = ('SELECT r.id, r.name, max(c.ts) AS latest_tag '
-             'FROM tags AS t LEFT JOIN commits AS c ON c.id = t.commit_id '
-             'LEFT JOIN repos AS r ON r.id = t.repo_id '
-             'GROUP BY r.id, r.name')
-
-    repos = Repos.objects.raw(query)
-
-    tmp_dict = {}
-
-    for repo in repos:
-        tmp_dict[repo.name] = {}
-        tmp_dict[repo.name]['tag'] = repo.latest_tag
-
-    query = ('SELECT r.id, r.name, max(c.ts) AS latest_commit '
-             'FROM commits AS c LEFT JOIN repos AS r ON r.id = c.repo_id '
-             'GROUP BY r.id, r.name')
+    # Read from the rollup kept up to date by the collector.
+    # Repos whose tags have no collected commit yet are listed without a date
+    query = ('SELECT r.id, r.name, s.latest_tag_ts AS latest_tag, '
+             's.latest_commit_ts AS latest_commit '
+             'FROM repos AS r LEFT JOIN repo_stats AS s ON s.repo_id = r.id '
+             'WHERE EXISTS (SELECT 1 FROM tags AS t WHERE t.repo_id = r.id) '
+             'ORDER BY s.latest_tag_ts DESC NULLS LAST')
 
     repos = Repos.objects.raw(query)
 
-    for repo in repos:
-        if repo.name not in tmp_dict:
-            continue
-        tmp_dict[repo.name]['commit'] = repo.latest_commit
-
     repo_tag_commit = []
-    for key, val in tmp_dict.items():
-        repo_tag_commit.append([key, val['tag'], val['commit']])
-
-    repo_tag_commit.sort(key=itemgetter(1), reverse=True)
+    for repo in repos:
+        repo_tag_commit.append([repo.name, repo.latest_tag, repo.latest_commit])
 
     return repo_tag_commit
 
 
+@revalidated
 def latest_releases(request):
     """Global releases info: latest release, latest commit."""
-    repo_tag_commit = get_latest_releases()
+    repo_tag_commit = cached('latest_releases', get_latest_releases)
 
     context = {
         'latest_releases': repo_tag_commit,
@@ -97,13 +84,14 @@ def latest_releases(request):
     return render(request, 'gstats/latest-releases.html', context)
 
 
+@revalidated
 def export_releases_csv(request):
     response = HttpResponse(content_type='text/csv')
 
     writer = csv_writer(response)
     writer.writerow(['Repo name', 'Latest release', 'Latest commit'])
 
-    repo_tag_commit = get_latest_releases()
+    repo_tag_commit = cached('latest_releases', get_latest_releases)
 
     for repo in repo_tag_commit:
         writer.writerow([repo[0], repo[1], repo[1]])
@@ -113,7 +101,7 @@ def export_releases_csv(request):
     return response
 
 
-def repo_display(request, repo_name):
+def get_repo_display(repo_name: str) -> dict:
     # TODO: move out to a separate function
     # Get release info
     query = ('SELECT t.id, t.name, c.ts, '
@@ -139,25 +127,29 @@ def repo_display(request, repo_name):
              'LEFT JOIN repos AS r ON r.id = b.repo_id '
              'WHERE r.name = %s ORDER BY b.name')
 
-    branches = Branches.objects.raw(query, (repo_name,))
+    branches = list(Branches.objects.raw(query, (repo_name,)))
 
     # TODO: move out to a separate function
     # Get contributors info
-    query = ('SELECT a.id, a.login, a.email, count(c.id) AS commit_num, '
-             'max(c.ts) AS "last_commit_ts" '
-             'FROM commits AS c LEFT JOIN contributors AS a '
-             'ON a.id = c.author_id LEFT JOIN repos AS r '
-             'ON c.repo_id = r.id WHERE r.name = %s '
-             'GROUP BY a.id, c.author_id, a.login, a.email '
+    query = ('SELECT a.id, a.login, a.email, s.commit_cnt AS commit_num, '
+             's.last_commit_ts AS "last_commit_ts" '
+             'FROM repo_contributor_stats AS s JOIN contributors AS a '
+             'ON a.id = s.author_id JOIN repos AS r '
+             'ON s.repo_id = r.id WHERE r.name = %s '
              'ORDER BY commit_num DESC')
 
-    contributors = Contributors.objects.raw(query, (repo_name,))
+    contributors = list(Contributors.objects.raw(query, (repo_name,)))
 
-    context = {
+    return {
         'branches': branches,
         'contributors': contributors,
         'repo_name': repo_name,
         'tag_list': ret_list,
     }
 
+
+@revalidated
+def repo_display(request, repo_name):
+    context = cached('repo_display', get_repo_display, repo_name)
+
     return render(request, 'gstats/repo-display.html', context)
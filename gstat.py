@@ -11,9 +11,13 @@ from configparser import ConfigParser
 
 from psycopg2.extensions import connection
 
-from utils.connection import connect_to_db
+from utils.connection import (
+    StatementError,
+    connect_to_db,
+)
 from utils.ghstat_db import GhStatDb
 from utils.gstat_cli import GStatCli
+from utils.profiling import create_profiler
 
 
 def get_cli_args():
@@ -34,6 +38,11 @@ def get_cli_args():
     parser.add_argument('-p', '--password', dest='password',
                         help='Database password', metavar='DBPASS')
 
+    profile_msg = ('Profile every command, write pstats and collapsed stack '
+                   'files to DIR and list the hottest functions on exit')
+    parser.add_argument('--profile', dest='profile',
+                        help=profile_msg, metavar='DIR')
+
     args = parser.parse_args()
 
     if not args.config:
@@ -155,14 +164,23 @@ class InputHandler():
 
 
 def main():
+    # Get command-line arguments
+    cli_args = get_cli_args()
+
+    # Get not passed arguments from config
+    if cli_args.config:
+        cli_args = parse_config(cli_args)
+
+    profiler = create_profiler(cli_args.profile)
+
     try:
-        # Get command-line arguments
-        cli_args = get_cli_args()
+        main_loop(cli_args, profiler)
+    finally:
+        profiler.close()
 
-        # Get not passed arguments from config
-        if cli_args.config:
-            cli_args = parse_config(cli_args)
 
+def main_loop(cli_args: Namespace, profiler):
+    try:
         # Connect to database
         conn, cursor = connect_to_db(database=cli_args.database,
                                      user=cli_args.user,
@@ -175,10 +193,22 @@ def main():
 
         handler = InputHandler(gcli, conn)
 
+        cmd_cnt = 0
         while True:
-            user_input = input('%s> ' % gcli.current_repo)
-
-            handler.handle_input(user_input.strip())
+            user_input = input('%s> ' % gcli.current_repo).strip()
+            if not user_input:
+                continue
+
+            # Every command is profiled to a file of its own
+            cmd_cnt += 1
+            command = user_input.split(' ', 1)[0]
+            with profiler.profile('%03d-%s' % (cmd_cnt, command)):
+                try:
+                    handler.handle_input(user_input)
+                except StatementError as e:
+                    print(e)
+                    # The transaction cannot go on after an error
+                    conn.rollback()
 
     except KeyboardInterrupt:
         _exit(conn)
@@ -5,13 +5,18 @@ from psycopg2.extensions import cursor as PgCursor
 from .abc_handler import Handler
 from .repo_handler import RepoHandler
 
-from utils.connection import exec_in_db
+from utils.connection import (
+    exec_in_db,
+    exec_values_in_db,
+)
+from utils.id_cache import branch_ids
 
 
 class BranchHandler(Handler):
     def __init__(self, cursor: PgCursor):
         self.cursor = cursor
         self.exec_in_db = exec_in_db
+        self.exec_values_in_db = exec_values_in_db
         self.repo = RepoHandler(cursor)
 
     def get_repo_branches(self, repo_name: str) -> dict:
@@ -29,19 +34,105 @@ class BranchHandler(Handler):
 
         return name_id_dict
 
+    def get_repo_heads(self, repo_id: int) -> dict:
+        """Get a dict {branch name: (branch ID, head SHA)} of the repo's branches."""
+        query = 'SELECT name, id, head_sha FROM branches WHERE repo_id = %s'
+        res = self.exec_in_db(self.cursor, query, (repo_id,))
+        return {row[0]: (row[1], row[2]) for row in res}
+
     def remove(self, branch_id: int):
-        query = ('DELETE FROM branches WHERE id = %s')
-        self.exec_in_db(self.cursor, query, (branch_id,), ret_all=False)
+        self.remove_many([branch_id])
+
+    def remove_many(self, branch_id_list: list, default_branch=None):
+        """Remove branches, moving their commits to a branch the repo keeps.
+
+        A commit is stored once, under the first branch it is collected
+        from, and is not collected again from branches it is merged into;
+        it would be lost with its branch (commits.branch_id cascades).
+        Commits go to the default branch or else to another remaining one.
+        """
+        query = ('UPDATE commits AS c SET branch_id = (SELECT k.id FROM branches AS k '
+                 'WHERE k.repo_id = b.repo_id AND k.id <> ALL(%s) '
+                 'ORDER BY (k.name = %s) IS TRUE DESC, k.id LIMIT 1) '
+                 'FROM branches AS b WHERE c.branch_id = b.id AND b.id = ANY(%s)')
+        self.exec_in_db(self.cursor, query,
+                        (branch_id_list, default_branch, branch_id_list), ret_all=False)
+
+        query = ('DELETE FROM branches WHERE id = ANY(%s) RETURNING repo_id, name')
+        for repo_id, name in self.exec_in_db(self.cursor, query, (branch_id_list,)):
+            branch_ids.remove((repo_id, name))
+
+    def add_many(self, name_list: list, repo_id: int):
+        """Add branches to the database with one statement."""
+        query = ('INSERT INTO branches (name, repo_id) VALUES %s '
+                 'ON CONFLICT (repo_id, name) DO NOTHING RETURNING id, name')
+        res = self.exec_values_in_db(self.cursor, query,
+                                     [(name, repo_id) for name in name_list],
+                                     fetch=True)
+        for id_, name in res:
+            branch_ids.put((repo_id, name), id_)
+
+    def sync(self, repo_id: int, branches: list, full=False,
+             default_branch=None) -> list:
+        """Make the repo's stored branches match its branch list on GitHub.
+
+        Branches gone from GitHub are removed, their commits kept under
+        default_branch, new ones are added, each with a single statement.
+        Returns the branches whose head differs from the one their commits
+        were collected up to, i.e. new branches and those with new commits,
+        or all with full.
+        """
+        stored = self.get_repo_heads(repo_id)
+        names = {branch.name for branch in branches}
+
+        removed = [id_ for name, (id_, _) in stored.items() if name not in names]
+        if removed:
+            self.remove_many(removed, default_branch)
+
+        added = [branch.name for branch in branches if branch.name not in stored]
+        if added:
+            self.add_many(added, repo_id)
+
+        if full:
+            return list(branches)
+
+        return [branch for branch in branches
+                if branch.name not in stored
+                or stored[branch.name][1] != branch.commit.sha]
 
     def get_id(self, branch_name: str, repo_id: int) -> int:
-        """Get a branch ID from the database."""
+        """Get a branch ID from the cache or the database."""
+        branch_id = branch_ids.get((repo_id, branch_name))
+        if branch_id is not None:
+            return branch_id
+
         query = 'SELECT id FROM branches WHERE name = %s AND repo_id = %s'
         res = self.exec_in_db(self.cursor, query, (branch_name, repo_id,))
         if res:
+            branch_ids.put((repo_id, branch_name), res[0][0])
             return res[0][0]
         return None
 
-    def add(self, name: str, repo_id: int):
-        query = ('INSERT INTO branches (name, repo_id) '
-                 'VALUES (%s, %s)')
-        self.exec_in_db(self.cursor, query, (name, repo_id), ret_all=False)
+    def add(self, name: str, repo_id: int) -> int:
+        """Add a branch to the database if needed and return its ID."""
+        branch_id = branch_ids.get((repo_id, name))
+        if branch_id is not None:
+            return branch_id
+
+        query = ('WITH ins AS (INSERT INTO branches (name, repo_id) '
+                 'VALUES (%s, %s) ON CONFLICT (repo_id, name) DO NOTHING RETURNING id) '
+                 'SELECT id FROM ins UNION ALL '
+                 'SELECT id FROM branches WHERE repo_id = %s AND name = %s LIMIT 1')
+        res = self.exec_in_db(self.cursor, query, (name, repo_id, repo_id, name))
+        if res:
+            branch_ids.put((repo_id, name), res[0][0])
+            return res[0][0]
+
+        # The row has been committed by another session
+        # after this statement had taken its snapshot
+        return self.get_id(name, repo_id)
+
+    def set_watermark(self, branch_id: int, head_sha: str, head_ts: str):
+        query = 'UPDATE branches SET head_sha = %s, head_ts = %s WHERE id = %s'
+        self.exec_in_db(self.cursor, query, (head_sha, head_ts, branch_id),
+                        ret_all=False)
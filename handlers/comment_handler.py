@@ -1,26 +1,49 @@
 #!/usr/bin/python3
 
+from github import Repository
 from github.PaginatedList import PaginatedList
 from psycopg2.extensions import cursor as PgCursor
 
 from .abc_handler import Handler
 from .contributor_handler import ContributorHandler
+from .repo_handler import (
+    RepoHandler,
+    SYNC_OVERLAP,
+)
 
+from utils import metrics
+from utils.batch_writer import BatchWriter
 from utils.connection import exec_in_db
+from utils.timestamps import utc_now
+from utils.write_pipeline import WritePipeline
 
 
 class CommentHandler(Handler):
-    def __init__(self, cursor: PgCursor):
+    def __init__(self, cursor: PgCursor, issue_writer: BatchWriter = None,
+                 pipeline: WritePipeline = None, defer_users=False, full=False):
         self.cursor = cursor
         self.exec_in_db = exec_in_db
-        self.contributor = ContributorHandler(cursor)
+        self.contributor = ContributorHandler(cursor, defer_users=defer_users)
+        self.repo = RepoHandler(cursor)
+        # Comments reference issues, so pending issues are written first
+        parents = (issue_writer,) if issue_writer else ()
+        self.writer = BatchWriter(cursor, 'comments',
+                                  ('id', 'repo_id', 'issue_id', 'author_id', 'ts_created'),
+                                  on_conflict='ON CONFLICT DO NOTHING',
+                                  key=0, parents=parents, pipeline=pipeline)
+        # Sweep all comments, not only those updated since the last sweep
+        self.full = full
 
     def add(self, id_: int, repo_id: int, issue_id: int, author_id: int, ts_created: str):
-        """Add a repo to our database."""
-        query = ('INSERT INTO comments (id, repo_id, issue_id, author_id, ts_created) '
-                 'VALUES (%s, %s, %s, %s, %s)')
-        args = (id_, repo_id, issue_id, author_id, ts_created)
-        self.exec_in_db(self.cursor, query, args, ret_all=False)
+        """Add a comment to our database.
+
+        The comment is written when the batch is flushed.
+        """
+        self.writer.add((id_, repo_id, issue_id, author_id, ts_created))
+
+    def flush(self):
+        """Write pending comments, and issues they reference, and wait for it."""
+        self.writer.sync()
 
     def get_id(self, id_: int) -> int:
         """Check if a comment ID exists in the database."""
@@ -30,21 +53,72 @@ class CommentHandler(Handler):
             return res[0][0]
         return None
 
+    def get_issue_comment_ids(self, issue_id: int) -> set:
+        """Get IDs of the issue's stored comments."""
+        query = 'SELECT id FROM comments WHERE issue_id = %s'
+        return {row[0] for row in self.exec_in_db(self.cursor, query, (issue_id,))}
+
     def handle(self, repo_id: int, issue_id: int, comments: PaginatedList):
         """Handle comments."""
+        # One query for the issue instead of one per comment
+        stored = self.get_issue_comment_ids(issue_id)
+
         for comment in comments:
 
-            comment_id = self.get_id(comment.id)
-            if comment_id is not None:
+            if comment.id in stored:
                 # When the comment already
                 # exists in the database
                 continue
 
-            author_id = self.contributor.get_id(comment.user.login)
-            if author_id is None:
-                self.contributor.add(comment.user.login,
-                                     comment.user.name,
-                                     comment.user.raw_data['email'])
-                author_id = self.contributor.get_id(comment.user.login)
+            author_id = self.contributor.get_user_id(comment.user)
 
             self.add(comment.id, repo_id, issue_id, author_id, comment.created_at)
+
+    def get_issue_ids(self, repo_id: int) -> dict:
+        """Get a dict {issue number: issue ID} of the repo's stored issues."""
+        query = 'SELECT number, id FROM issues WHERE repo_id = %s'
+        res = self.exec_in_db(self.cursor, query, (repo_id,))
+        return {row[0]: row[1] for row in res}
+
+    def sweep(self, repo: Repository, repo_id: int):
+        """Handle comments of all the repo's issues using one listing.
+
+        Only comments updated since the last sweep are requested.
+        Issues must be stored before. Comments of issues that are not
+        stored, e.g. transferred ones, are skipped and counted.
+        """
+        sync_started = utc_now()
+
+        synced_at = None
+        if not self.full:
+            synced_at = self.repo.get_synced_at(repo_id, 'comments')
+
+        if synced_at is not None:
+            comments = repo.get_issues_comments(since=synced_at - SYNC_OVERLAP)
+        else:
+            comments = repo.get_issues_comments()
+
+        issue_ids = self.get_issue_ids(repo_id)
+        skipped = 0
+
+        for comment in comments:
+            # The payload refers to the issue as .../issues/NUMBER
+            issue_number = int(comment.issue_url.rsplit('/', 1)[1])
+
+            issue_id = issue_ids.get(issue_number)
+            if issue_id is None:
+                # Waiting for the issue would keep the sync time from
+                # moving, every later sweep would list comments again
+                # from the same time
+                skipped += 1
+                continue
+
+            author_id = self.contributor.get_user_id(comment.user)
+
+            # Known comments are skipped by ON CONFLICT DO NOTHING
+            self.add(comment.id, repo_id, issue_id, author_id, comment.created_at)
+
+        self.flush()
+
+        metrics.registry.inc('comments_skipped_total', skipped)
+        self.repo.set_synced_at(repo_id, 'comments', sync_started)
@@ -8,17 +8,99 @@ from .abc_handler import Handler
 from .branch_handler import BranchHandler
 from .contributor_handler import ContributorHandler
 from .repo_handler import RepoHandler
+from .stats_handler import add_commits
+from .sync_handler import (
+    CHECKPOINT_PAGES,
+    StageCheckpoint,
+)
 
+from utils.batch_writer import BatchWriter
 from utils.connection import exec_in_db
+from utils.pages import iter_pages
+from utils.payload import raw_payload
+from utils.write_pipeline import WritePipeline
+
+
+class Frontier():
+    """Ancestors of a branch head its listing has yet to reach.
+
+    Boundaries are branch heads stored by complete runs: their history
+    is collected. Once every ancestor of the head is either listed or
+    behind a boundary, the listing can stop, however the commits are
+    dated; a merge can bring in commits dated long before the head.
+    Parents of the listed commits are kept, whatever order the listing
+    has the frontier then only errs on the side of listing more.
+    """
+
+    def __init__(self, boundaries: set, pending=()):
+        self.behind = set(boundaries)
+        self.pending = set(pending)
+        self.needed = set()
+        self.parents = {}  # {SHA: parent SHAs} of the listed commits
+        self.started = bool(self.pending)
+
+    def visit(self, sha: str, parent_shas: list):
+        if not self.started:
+            # The head
+            self.started = True
+            self.pending.add(sha)
+
+        self.parents[sha] = parent_shas
+
+        if sha in self.behind:
+            self.pending.discard(sha)
+            self.__mark_behind(parent_shas)
+        elif sha in self.pending:
+            self.pending.remove(sha)
+            self.needed.add(sha)
+            self.__expand(parent_shas)
+
+    def reached(self) -> bool:
+        return self.started and not self.pending
+
+    def __mark_behind(self, shas: list):
+        stack = list(shas)
+        while stack:
+            sha = stack.pop()
+            if sha in self.behind:
+                continue
+
+            self.behind.add(sha)
+            self.pending.discard(sha)
+            stack.extend(self.parents.get(sha, ()))
+
+    def __expand(self, shas: list):
+        stack = list(shas)
+        while stack:
+            sha = stack.pop()
+            if sha in self.behind or sha in self.pending or sha in self.needed:
+                continue
+
+            if sha in self.parents:
+                # Listed before a child of it
+                self.needed.add(sha)
+                stack.extend(self.parents[sha])
+            else:
+                self.pending.add(sha)
 
 
 class CommitHandler(Handler):
-    def __init__(self, cursor: PgCursor):
+    def __init__(self, cursor: PgCursor, pipeline: WritePipeline = None,
+                 defer_users=False, full=False):
         self.cursor = cursor
         self.exec_in_db = exec_in_db
         self.branch = BranchHandler(cursor)
-        self.contributor = ContributorHandler(cursor)
+        self.contributor = ContributorHandler(cursor, defer_users=defer_users)
         self.repo = RepoHandler(cursor)
+        # Walk whole branches, ignoring watermarks and known history
+        self.full = full
+        self.writer = BatchWriter(cursor, 'commits',
+                                  ('sha', 'author_id', 'repo_id', 'ts', 'branch_id'),
+                                  on_conflict='ON CONFLICT DO NOTHING',
+                                  pipeline=pipeline,
+                                  # Only commits actually inserted are counted
+                                  returning='RETURNING repo_id, author_id, ts',
+                                  on_written=add_commits)
 
     def get_id(self, sha: str) -> int:
         """Get a commit ID from the database."""
@@ -28,45 +110,108 @@ class CommitHandler(Handler):
             return res[0][0]
         return None
 
+    def get_ids(self, sha_list: list) -> dict:
+        """Get a dict {SHA: commit ID} of the stored commits among sha_list."""
+        query = 'SELECT sha, id FROM commits WHERE sha = ANY(%s)'
+        res = self.exec_in_db(self.cursor, query, (list(sha_list),))
+        return {row[0]: row[1] for row in res}
+
     def add(self, sha: str, contributor_id: int,
             repo_id: int, commit_ts: str, branch_id: int):
-        """Add a commit to the database."""
-        query = ('INSERT INTO commits (sha, author_id, repo_id, ts, branch_id) '
-                 'VALUES (%s, %s, %s, %s, %s)')
-        args = (sha, contributor_id, repo_id, commit_ts, branch_id)
-
-        self.exec_in_db(self.cursor, query, args, ret_all=False)
-
-    def handle(self, repo: Repository, branch_name: str, branches_only=False):
+        """Add a commit to the database.
+
+        The commit is written when the batch is flushed.
+        """
+        self.writer.add((sha, contributor_id, repo_id, commit_ts, branch_id))
+
+    def get_stored(self, sha_list: list) -> dict:
+        """Get a dict {SHA: (commit ID, ID of the branch it was stored with)}
+        of the stored commits among sha_list."""
+        query = 'SELECT sha, id, branch_id FROM commits WHERE sha = ANY(%s)'
+        res = self.exec_in_db(self.cursor, query, (list(sha_list),))
+        return {row[0]: (row[1], row[2]) for row in res}
+
+    def handle(self, repo: Repository, branch_name: str, branches_only=False,
+               checkpoint: StageCheckpoint = None):
+        """Handle commits of a branch.
+
+        With a checkpoint, progress is saved every CHECKPOINT_PAGES pages
+        and an interrupted run continues from the saved page.
+        """
         repo_id = self.repo.get_id(repo.name)
 
-        branch_id = self.branch.get_id(branch_name, repo_id)
-        if branch_id is None:
-            self.branch.add(branch_name, repo_id)
-            branch_id = self.branch.get_id(branch_name, repo_id)
+        branch_id = self.branch.add(branch_name, repo_id)
 
         if branches_only:
             return
 
+        # Heads stored by complete runs, of this branch and of the others:
+        # their history is collected. The listing stops on ancestry, not on
+        # dates, a merge can bring in commits dated long before the head
+        boundaries = set()
+        if not self.full:
+            boundaries = {sha for _, sha in self.branch.get_repo_heads(repo_id).values()
+                          if sha}
+
         commits = repo.get_commits(sha=branch_name)
 
-        for commit in commits:
+        # The head seen by the interrupted run, the walk continues from its pages
+        state = checkpoint.state if checkpoint is not None else {}
+        new_head = tuple(state['head']) if state.get('head') else None
+        start_page = checkpoint.resume_page() if checkpoint is not None else 0
 
-            if commit and commit.author:
-                contributor_id = self.contributor.get_id(commit.author.login)
-            else:
-                continue
+        frontier = None
+        if not new_head:
+            frontier = Frontier(boundaries)
+        elif state.get('pending'):
+            frontier = Frontier(boundaries, state['pending'])
+
+        for page, page_commits in iter_pages(commits, start_page):
+            page_commits = [commit for commit in page_commits if commit]
+
+            # One query for the whole page
+            stored = self.get_stored([commit.sha for commit in page_commits])
+
+            for commit in page_commits:
+                # Read from the listing, raw_data would request every commit
+                payload = raw_payload(commit)
+                commit_ts = payload['commit']['committer']['date']
 
-            if contributor_id is None and commit.author:
-                self.contributor.add(commit.author.login,
-                                     commit.author.name,
-                                     commit.raw_data['commit']['author']['email'])
+                if new_head is None:
+                    new_head = (commit.sha, commit_ts)
 
-            commit_id = self.get_id(commit.sha)
+                if payload.get('parents') is None:
+                    # Ancestry unknown, walk the whole branch
+                    frontier = None
+                elif frontier is not None:
+                    frontier.visit(commit.sha, [parent['sha'] for parent
+                                                in payload['parents']])
 
-            if commit_id is None:
-                contributor_id = self.contributor.get_id(commit.author.login)
+                if commit.sha in stored:
+                    # Came from another branch via a merge
+                    # or from an interrupted run
+                    continue
 
-                commit_ts = commit.raw_data['commit']['committer']['date']
+                if not payload['author']:
+                    continue
+
+                contributor_id = self.contributor.get_user_id(
+                    commit.author, payload['commit']['author']['email'])
 
                 self.add(commit.sha, contributor_id, repo_id, commit_ts, branch_id)
+
+            if frontier is not None and frontier.reached():
+                break
+
+            if checkpoint is not None and (page + 1) % CHECKPOINT_PAGES == 0:
+                self.writer.sync()
+                checkpoint.save({'page': page + 1, 'head': new_head,
+                                 'pending': sorted(frontier.pending)
+                                 if frontier is not None else None})
+
+        self.writer.sync()
+
+        # Move the watermark only when the walk has completed,
+        # otherwise an interrupted run would hide unfetched commits
+        if new_head is not None:
+            self.branch.set_watermark(branch_id, *new_head)
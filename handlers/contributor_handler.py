@@ -4,24 +4,98 @@ from psycopg2.extensions import cursor as PgCursor
 
 from .abc_handler import Handler
 
-from utils.connection import exec_in_db
+from utils.connection import (
+    exec_in_db,
+    exec_values_in_db,
+)
+from utils.id_cache import contributor_ids
+from utils.payload import (
+    RawObject,
+    raw_payload,
+)
 
 
 class ContributorHandler(Handler):
-    def __init__(self, cursor: PgCursor):
+    def __init__(self, cursor: PgCursor, defer_users=False):
         self.cursor = cursor
         self.exec_in_db = exec_in_db
+        self.exec_values_in_db = exec_values_in_db
+        # Store new users with what listings give and
+        # leave their profiles for enrichment, see get_pending()
+        self.defer_users = defer_users
 
     def get_id(self, login: str) -> int:
-        """Get a contributor ID from the database."""
+        """Get a contributor ID from the cache or the database."""
+        contributor_id = contributor_ids.get(login)
+        if contributor_id is not None:
+            return contributor_id
+
         query = 'SELECT id FROM contributors WHERE login = %s'
         res = self.exec_in_db(self.cursor, query, (login,))
         if res:
+            contributor_ids.put(login, res[0][0])
             return res[0][0]
         return None
 
-    def add(self, login: str, name: str, email: str):
-        query = ('INSERT INTO contributors (login, name, email) '
-                 'VALUES (%s, %s, %s)')
-        self.exec_in_db(self.cursor, query, (login, name, email),
-                        ret_all=False)
+    def get_user_id(self, user, email: str = None) -> int:
+        """Get the ID of a GitHub user from a listing, add the user if needed.
+
+        The login is read from the payload the user came with. Unless
+        users are deferred, the name and, if email is not passed, the email
+        are read from the profile, which PyGithub requests for every user.
+        Users given as plain payloads, e.g. with --async-fetch or --replay,
+        have no profile to read, theirs are left for enrichment too.
+        """
+        payload = raw_payload(user)
+        login = payload['login']
+
+        contributor_id = self.get_id(login)
+        if contributor_id is not None:
+            return contributor_id
+
+        if self.defer_users or (isinstance(user, RawObject) and 'name' not in payload):
+            return self.add(login, None, email, pending=True)
+
+        if email is None:
+            email = user.raw_data.get('email')
+
+        return self.add(login, user.name, email)
+
+    def add(self, login: str, name: str, email: str, pending=False) -> int:
+        """Add a contributor to the database and return its ID.
+
+        pending marks the profile to be fetched later.
+        If the login has been added concurrently, the existing ID is returned.
+        """
+        query = ('WITH ins AS (INSERT INTO contributors (login, name, email, profile_pending) '
+                 'VALUES (%s, %s, %s, %s) ON CONFLICT (login) DO NOTHING RETURNING id) '
+                 'SELECT id FROM ins UNION ALL '
+                 'SELECT id FROM contributors WHERE login = %s LIMIT 1')
+        res = self.exec_in_db(self.cursor, query, (login, name, email, pending, login))
+        if res:
+            contributor_ids.put(login, res[0][0])
+            return res[0][0]
+
+        # The row has been committed by another session
+        # after this statement had taken its snapshot
+        return self.get_id(login)
+
+    def count_pending(self) -> int:
+        query = 'SELECT count(*) FROM contributors WHERE profile_pending'
+        return self.exec_in_db(self.cursor, query)[0][0]
+
+    def get_pending(self, limit: int) -> list:
+        """Get a list of (ID, login) of contributors whose profiles are not fetched."""
+        query = ('SELECT id, login FROM contributors WHERE profile_pending '
+                 'ORDER BY id LIMIT %s')
+        return self.exec_in_db(self.cursor, query, (limit,))
+
+    def set_profiles(self, profiles: list):
+        """Store fetched profiles, a list of (ID, name, email).
+
+        Emails already known, e.g. from commits, are kept.
+        """
+        query = ('UPDATE contributors AS c SET name = p.name, '
+                 'email = coalesce(c.email, p.email), profile_pending = false '
+                 'FROM (VALUES %s) AS p (id, name, email) WHERE c.id = p.id')
+        self.exec_values_in_db(self.cursor, query, profiles)
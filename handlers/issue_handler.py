@@ -8,19 +8,54 @@ from psycopg2.extensions import cursor as PgCursor
 from .abc_handler import Handler
 from .comment_handler import CommentHandler
 from .contributor_handler import ContributorHandler
-from .repo_handler import RepoHandler
-
+from .repo_handler import (
+    RepoHandler,
+    SYNC_OVERLAP,
+)
+from .sync_handler import (
+    CHECKPOINT_PAGES,
+    StageCheckpoint,
+)
+
+from utils.batch_writer import BatchWriter
 from utils.connection import exec_in_db
+from utils.pages import iter_pages
+from utils.payload import raw_payload
+from utils.timestamps import (
+    format_ts,
+    parse_ts,
+    to_naive_utc,
+    utc_now,
+)
+from utils.write_pipeline import WritePipeline
 
 
 class IssueHandler(Handler):
-    def __init__(self, cursor: PgCursor):
+    def __init__(self, cursor: PgCursor, comment_sweep=False,
+                 pipeline: WritePipeline = None, defer_users=False, full=False):
         self.cursor = cursor
         self.exec_in_db = exec_in_db
-        self.contributor = ContributorHandler(cursor)
+        self.contributor = ContributorHandler(cursor, defer_users=defer_users)
         self.repo = RepoHandler(cursor)
-        self.contributor = ContributorHandler(cursor)
-        self.comments = CommentHandler(cursor)
+        # New issues are inserted, known ones get their mutable columns updated
+        self.writer = BatchWriter(cursor, 'issues',
+                                  ('id', 'repo_id', 'number', 'is_issue', 'state',
+                                   'author_id', 'title', 'ts_created', 'ts_updated',
+                                   'ts_closed', 'comment_cnt'),
+                                  on_conflict=('ON CONFLICT (id) DO UPDATE SET '
+                                               'state = EXCLUDED.state, '
+                                               'title = EXCLUDED.title, '
+                                               'ts_updated = EXCLUDED.ts_updated, '
+                                               'ts_closed = EXCLUDED.ts_closed, '
+                                               'comment_cnt = EXCLUDED.comment_cnt'),
+                                  key=0, pipeline=pipeline)
+        self.comments = CommentHandler(cursor, issue_writer=self.writer,
+                                       pipeline=pipeline, defer_users=defer_users,
+                                       full=full)
+        # Get comments from the repo-wide listing instead of per issue
+        self.comment_sweep = comment_sweep
+        # Request everything, not only what changed since the last sync
+        self.full = full
 
     def get_id(self, issue_id: int) -> int:
         """Get an issue ID from the database."""
@@ -32,71 +67,109 @@ class IssueHandler(Handler):
 
     def add(self, issue_id, repo_id, number, is_issue, state, author_id,
             title, ts_created, ts_updated, ts_closed, comment_cnt):
-        """Add an issue to the database."""
-        query = ('INSERT INTO issues (id, repo_id, number, is_issue, '
-                 'state, author_id, title, ts_created, ts_updated, ts_closed, '
-                 'comment_cnt) '
-                 'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)')
-        args = (issue_id, repo_id, number, is_issue, state, author_id,
-                title, ts_created, ts_updated, ts_closed, comment_cnt)
+        """Add an issue to the database or update the existing one.
+
+        The issue is written when the batch is flushed.
+        """
+        self.writer.add((issue_id, repo_id, number, is_issue, state, author_id,
+                         title, ts_created, ts_updated, ts_closed, comment_cnt))
+
+    def get_repo_issues(self, repo_id: int) -> dict:
+        """Get mutable columns of the repo's issues stored in the database.
+
+        Returns a dict {issue ID: (state, title, ts_updated, ts_closed, comment_cnt)}.
+        """
+        query = ('SELECT id, state, title, ts_updated, ts_closed, comment_cnt '
+                 'FROM issues WHERE repo_id = %s')
+        res = self.exec_in_db(self.cursor, query, (repo_id,))
+        return {row[0]: tuple(row[1:]) for row in res}
+
+    @staticmethod
+    def get_mutable_cols(issue: Issue) -> tuple:
+        return (issue.state, issue.title, to_naive_utc(issue.updated_at),
+                to_naive_utc(issue.closed_at), issue.comments)
+
+    def handle(self, repo: Repository, checkpoint: StageCheckpoint = None):
+        """Handle issues and their comments.
+
+        With a checkpoint, progress is saved every CHECKPOINT_PAGES pages
+        and an interrupted run continues from the saved page.
+        """
+        repo_id = self.repo.get_id(repo.name)
 
-        self.exec_in_db(self.cursor, query, args, ret_all=False)
+        state = checkpoint.state if checkpoint is not None else {}
 
-    def update(self, issue):
-        """Update an issue if needed."""
-        cur_vals = self.__issue_get_mutable_cols(issue)
+        # Taken before fetching, so changes made while
+        # the run goes are requested by the next run.
+        # A resumed run keeps the time of the interrupted one
+        if state.get('sync_started'):
+            sync_started = to_naive_utc(parse_ts(state['sync_started']))
+        else:
+            sync_started = utc_now()
 
-        cur_vals_set = set(list(cur_vals.values()))
+        synced_at = None
+        if not self.full:
+            synced_at = self.repo.get_synced_at(repo_id, 'issues')
 
-        args = [issue.state, issue.title, issue.updated_at,
-                issue.closed_at, issue.comments]
+        if synced_at is not None:
+            issues = repo.get_issues(state='all', since=synced_at - SYNC_OVERLAP)
+        else:
+            issues = repo.get_issues(state='all')
 
-        new_vals_set = set(args)
+        if issues is None:
+            return
 
-        if cur_vals_set != new_vals_set:
-            query = ('UPDATE issues SET state = %s, title = %s, '
-                     'ts_updated = %s, ts_closed = %s, comment_cnt = %s '
-                     'WHERE id = %s')
-            args.append(issue.id)
-            self.exec_in_db(self.cursor, query, args, ret_all=False)
+        # With nothing stored, comments of every issue are requested
+        stored_issues = {} if self.full else self.get_repo_issues(repo_id)
 
-    def __issue_get_mutable_cols(self, issue: Issue):
-        query = ('SELECT state, title, ts_updated, ts_closed, comment_cnt '
-                 'FROM issues WHERE id = %s')
-        res = self.exec_in_db(self.cursor, query, (issue.id,))
-        res = [dict(row) for row in res]
-        return res[0]
+        start_page = checkpoint.resume_page() if checkpoint is not None else 0
 
-    def handle(self, repo: Repository):
+        for page, page_issues in iter_pages(issues, start_page):
+            for issue in page_issues:
+                self.handle_issue(repo_id, issue, stored_issues.get(issue.id))
 
-        issues = repo.get_issues(state='all')
-        if issues is None:
-            return
+            if checkpoint is not None and (page + 1) % CHECKPOINT_PAGES == 0:
+                # Comments are flushed after the issues they reference
+                self.comments.flush()
+                checkpoint.save({'page': page + 1,
+                                 'sync_started': format_ts(sync_started)})
 
-        repo_id = self.repo.get_id(repo.name)
+        if self.comment_sweep:
+            self.writer.sync()
+            self.comments.sweep(repo, repo_id)
 
-        for issue in issues:
+        # Comments are flushed after the issues they reference
+        self.comments.flush()
 
-            author_id = self.contributor.get_id(issue.user.login)
-            if author_id is None:
-                self.contributor.add(issue.user.login,
-                                     issue.user.name,
-                                     issue.user.raw_data['email'])
-                author_id = self.contributor.get_id(issue.user.login)
+        self.repo.set_synced_at(repo_id, 'issues', sync_started)
 
-            issue_id = self.get_id(issue.id)
-            if issue_id is not None:
-                # When issue is already in the table, update it if needed
-                self.update(issue)
+    def handle_issue(self, repo_id: int, issue: Issue, stored: tuple):
+        """Handle an issue and, unless sweeping, its comments.
 
-            else:
-                if 'issue' in issue.raw_data['html_url']:
-                    is_issue = True
-                else:
-                    is_issue = False
+        stored is the tuple of the issue's mutable columns
+        in the database or None if it is not stored.
+        """
+        mutable_cols = self.get_mutable_cols(issue)
 
-                self.add(issue.id, repo_id, issue.number, is_issue, issue.state,
-                         author_id, issue.title, issue.created_at, issue.updated_at,
-                         issue.closed_at, issue.comments)
+        if stored == mutable_cols:
+            # Requested again because of the overlap
+            return
+
+        author_id = self.contributor.get_user_id(issue.user)
+
+        if 'issue' in raw_payload(issue)['html_url']:
+            is_issue = True
+        else:
+            is_issue = False
+
+        self.add(issue.id, repo_id, issue.number, is_issue, issue.state,
+                 author_id, issue.title, issue.created_at, issue.updated_at,
+                 issue.closed_at, issue.comments)
+
+        if self.comment_sweep:
+            return
 
+        # Fetch comments only when there may be new ones
+        if issue.comments and (stored is None or stored[4] != issue.comments
+                               or stored[2] != mutable_cols[2]):
             self.comments.handle(repo_id, issue.id, issue.get_comments())
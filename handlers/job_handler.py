@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+import sys
+
+from threading import (
+    Event,
+    Lock,
+    Thread,
+)
+
+from psycopg2.extensions import cursor as PgCursor
+
+from utils.connection import (
+    exec_in_db,
+    exec_values_in_db,
+)
+
+# Seconds a claimed job belongs to its worker without a heartbeat
+LEASE_SECONDS = 300
+
+# Seconds between lease extensions
+HEARTBEAT_SECONDS = 60
+
+# A job is given up after this many claims
+MAX_ATTEMPTS = 3
+
+
+class JobHandler():
+    """Jobs of distributed runs, see the sync_jobs table.
+
+    Workers claim jobs with FOR UPDATE SKIP LOCKED, so any number of
+    them, on any hosts, can share a queue without claiming a job twice.
+    A claimed job is leased: when its worker stops extending the lease,
+    e.g. because it died, another worker claims the job again.
+    """
+
+    def __init__(self, cursor: PgCursor):
+        self.cursor = cursor
+        self.exec_in_db = exec_in_db
+        self.exec_values_in_db = exec_values_in_db
+
+    def add(self, run_id: int, org: str, jobs: list) -> int:
+        """Queue jobs, a list of (repo name, stage), jobs the run has are skipped.
+
+        Returns the number of jobs queued.
+        """
+        if not jobs:
+            return 0
+
+        query = ('INSERT INTO sync_jobs (run_id, org, repo, stage) VALUES %s '
+                 'ON CONFLICT (run_id, repo, stage) DO NOTHING RETURNING id')
+        rows = [(run_id, org, repo, stage) for repo, stage in jobs]
+        return len(self.exec_values_in_db(self.cursor, query, rows, fetch=True))
+
+    def claim(self, org: str, worker: str) -> tuple:
+        """Claim the next job of the org.
+
+        Returns a tuple (job ID, run ID, repo name, stage)
+        or None when there is nothing to do.
+        """
+        # Jobs whose workers kept dying are given up
+        query = ("UPDATE sync_jobs SET status = 'failed', worker = NULL, error = %s "
+                 "WHERE org IS NOT DISTINCT FROM %s AND status = 'running' "
+                 "AND leased_until < now() AT TIME ZONE 'UTC' AND attempts >= %s")
+        self.exec_in_db(self.cursor, query,
+                        ('lease expired %s times' % MAX_ATTEMPTS, org, MAX_ATTEMPTS),
+                        ret_all=False)
+
+        query = ("UPDATE sync_jobs SET status = 'running', worker = %s, "
+                 "attempts = attempts + 1, "
+                 "leased_until = now() AT TIME ZONE 'UTC' + %s * interval '1 second' "
+                 "WHERE id = (SELECT id FROM sync_jobs "
+                 "WHERE org IS NOT DISTINCT FROM %s AND (status = 'queued' "
+                 "OR (status = 'running' AND leased_until < now() AT TIME ZONE 'UTC')) "
+                 "ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED) "
+                 "RETURNING id, run_id, repo, stage")
+        res = self.exec_in_db(self.cursor, query, (worker, LEASE_SECONDS, org))
+        if res:
+            return tuple(res[0])
+        return None
+
+    def extend(self, jobs: dict) -> set:
+        """Extend leases of jobs, a dict {job ID: worker}.
+
+        Returns IDs of the jobs whose leases are extended,
+        the rest have been claimed by other workers.
+        """
+        query = ("UPDATE sync_jobs AS j "
+                 "SET leased_until = now() AT TIME ZONE 'UTC' + %s * interval '1 second' "
+                 "FROM (VALUES %%s) AS h (id, worker) "
+                 "WHERE j.id = h.id AND j.worker = h.worker "
+                 "AND j.status = 'running' RETURNING j.id" % LEASE_SECONDS)
+        res = self.exec_values_in_db(self.cursor, query, list(jobs.items()), fetch=True)
+        return {row[0] for row in res}
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        """Mark a job done.
+
+        Returns False if the job has been claimed by another worker meanwhile.
+        """
+        query = ("UPDATE sync_jobs SET status = 'done', leased_until = NULL, error = NULL "
+                 "WHERE id = %s AND worker = %s AND status = 'running' RETURNING id")
+        return bool(self.exec_in_db(self.cursor, query, (job_id, worker)))
+
+    def fail(self, job_id: int, worker: str, error: str):
+        """Queue a failed job again or, after MAX_ATTEMPTS, give it up."""
+        query = ("UPDATE sync_jobs SET status = CASE WHEN attempts < %s "
+                 "THEN 'queued' ELSE 'failed' END, "
+                 "worker = NULL, leased_until = NULL, error = %s "
+                 "WHERE id = %s AND worker = %s AND status = 'running'")
+        self.exec_in_db(self.cursor, query, (MAX_ATTEMPTS, error, job_id, worker),
+                        ret_all=False)
+
+    def release(self, jobs: dict):
+        """Queue jobs a stopping worker holds, a dict {job ID: worker}, again."""
+        if not jobs:
+            return
+
+        query = ("UPDATE sync_jobs AS j SET status = 'queued', worker = NULL, "
+                 "leased_until = NULL, attempts = j.attempts - 1 "
+                 "FROM (VALUES %s) AS h (id, worker) "
+                 "WHERE j.id = h.id AND j.worker = h.worker AND j.status = 'running'")
+        self.exec_values_in_db(self.cursor, query, list(jobs.items()))
+
+    def finish_run(self, run_id: int) -> bool:
+        """Mark the run finished if all its jobs are done.
+
+        Every worker checks it after completing a job, the last
+        one to complete sees them all done.
+        """
+        query = ("UPDATE sync_runs SET status = 'finished', "
+                 "finished_at = now() AT TIME ZONE 'UTC' "
+                 "WHERE id = %s AND status = 'running' AND NOT EXISTS "
+                 "(SELECT 1 FROM sync_jobs WHERE run_id = %s AND status <> 'done') "
+                 "RETURNING id")
+        if not self.exec_in_db(self.cursor, query, (run_id, run_id)):
+            return False
+
+        query = 'DELETE FROM sync_checkpoints WHERE run_id = %s'
+        self.exec_in_db(self.cursor, query, (run_id,), ret_all=False)
+        return True
+
+    def count(self, org: str) -> dict:
+        """Get a dict {status: number of jobs} of the org's latest run."""
+        query = ('SELECT status, count(*) FROM sync_jobs WHERE run_id = '
+                 '(SELECT max(run_id) FROM sync_jobs WHERE org IS NOT DISTINCT FROM %s) '
+                 'GROUP BY status')
+        return {row[0]: row[1] for row in self.exec_in_db(self.cursor, query, (org,))}
+
+
+class Heartbeat(Thread):
+    """Extend leases of the jobs a process works on.
+
+    The cursor must belong to a connection used by the heartbeat only,
+    the jobs are worked on for longer than a statement takes.
+    """
+
+    def __init__(self, cursor: PgCursor, interval=HEARTBEAT_SECONDS):
+        super().__init__(daemon=True)
+        self.jobs = JobHandler(cursor)
+        self.interval = interval
+        self.held = {}  # {job ID: worker}
+        self.__lock = Lock()
+        self.__stopped = Event()
+
+    def add(self, job_id: int, worker: str):
+        with self.__lock:
+            self.held[job_id] = worker
+
+    def remove(self, job_id: int):
+        with self.__lock:
+            self.held.pop(job_id, None)
+
+    def run(self):
+        while not self.__stopped.wait(self.interval):
+            with self.__lock:
+                held = dict(self.held)
+
+            if not held:
+                continue
+
+            for job_id in held.keys() - self.jobs.extend(held):
+                print('Lease of job %s has expired, it may be run twice' % job_id,
+                      file=sys.stderr)
+
+    def stop(self):
+        """Stop extending leases, queue the jobs still held again."""
+        self.__stopped.set()
+        self.join()
+
+        with self.__lock:
+            self.jobs.release(self.held)
+            self.held.clear()
@@ -1,10 +1,21 @@
 #!/usr/bin/python3
 
+from datetime import timedelta
+
 from psycopg2.extensions import cursor as PgCursor
 
 from .abc_handler import Handler
 
 from utils.connection import exec_in_db
+from utils.id_cache import repo_ids
+
+
+# Stages whose last successful sync time is stored in repos.<stage>_synced_at
+SYNC_STAGES = ('issues', 'comments')
+
+# Objects updated this long before the last sync started are requested
+# again, it covers the clock difference between us and GitHub
+SYNC_OVERLAP = timedelta(minutes=5)
 
 
 class RepoHandler(Handler):
@@ -19,15 +30,48 @@ class RepoHandler(Handler):
             return [elem[0] for elem in res]
         return []
 
-    def add(self, repo_name: str):
-        """Add a repo to our database."""
-        query = 'INSERT INTO repos (name) VALUES (%s)'
-        self.exec_in_db(self.cursor, query, (repo_name,), ret_all=False)
+    def add(self, repo_name: str) -> int:
+        """Add a repo to our database if needed and return its ID."""
+        query = ('WITH ins AS (INSERT INTO repos (name) VALUES (%s) '
+                 'ON CONFLICT (name) DO NOTHING RETURNING id) '
+                 'SELECT id FROM ins UNION ALL '
+                 'SELECT id FROM repos WHERE name = %s LIMIT 1')
+        res = self.exec_in_db(self.cursor, query, (repo_name, repo_name))
+        if res:
+            repo_ids.put(repo_name, res[0][0])
+            return res[0][0]
+
+        # The row has been committed by another session
+        # after this statement had taken its snapshot
+        return self.get_id(repo_name)
 
     def get_id(self, repo_name: str) -> int:
-        """Get a repo ID from the database."""
+        """Get a repo ID from the cache or the database."""
+        repo_id = repo_ids.get(repo_name)
+        if repo_id is not None:
+            return repo_id
+
         query = 'SELECT id FROM repos WHERE name = %s'
         res = self.exec_in_db(self.cursor, query, (repo_name,))
         if res:
+            repo_ids.put(repo_name, res[0][0])
             return res[0][0]
         return None
+
+    def get_synced_at(self, repo_id: int, stage: str):
+        """Get the time the last successful sync of the stage started at."""
+        if stage not in SYNC_STAGES:
+            raise ValueError('unknown sync stage "%s"' % stage)
+
+        query = 'SELECT %s_synced_at FROM repos WHERE id = %%s' % stage
+        res = self.exec_in_db(self.cursor, query, (repo_id,))
+        if res:
+            return res[0][0]
+        return None
+
+    def set_synced_at(self, repo_id: int, stage: str, ts):
+        if stage not in SYNC_STAGES:
+            raise ValueError('unknown sync stage "%s"' % stage)
+
+        query = 'UPDATE repos SET %s_synced_at = %%s WHERE id = %%s' % stage
+        self.exec_in_db(self.cursor, query, (ts, repo_id), ret_all=False)
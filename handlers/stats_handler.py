@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+from psycopg2.extensions import cursor as PgCursor
+
+from utils.connection import (
+    exec_in_db,
+    exec_values_in_db,
+)
+
+
+def add_commits(cursor: PgCursor, rows: list):
+    """Add commits just written, a list of (repo ID, author ID, ts), to the rollups.
+
+    Called with the cursor that has written the commits, so that
+    with a write pipeline the rollups change in the same transaction.
+    """
+    repos = {}  # {repo ID: [commit number, latest ts]}
+    authors = {}  # {(repo ID, author ID): [commit number, latest ts]}
+
+    for repo_id, author_id, ts in rows:
+        for stats, key in ((repos, repo_id), (authors, (repo_id, author_id))):
+            if key not in stats:
+                stats[key] = [0, ts]
+            stats[key][0] += 1
+            stats[key][1] = max(stats[key][1], ts)
+
+    if not repos:
+        return
+
+    # Sorted, so that concurrent writers lock rows in the same order
+    query = ('INSERT INTO repo_stats AS s (repo_id, commit_cnt, latest_commit_ts) '
+             'VALUES %s ON CONFLICT (repo_id) DO UPDATE SET '
+             'commit_cnt = s.commit_cnt + EXCLUDED.commit_cnt, '
+             'latest_commit_ts = greatest(s.latest_commit_ts, EXCLUDED.latest_commit_ts)')
+    exec_values_in_db(cursor, query, [(repo_id, cnt, ts) for repo_id, (cnt, ts)
+                                      in sorted(repos.items())])
+
+    query = ('INSERT INTO repo_contributor_stats AS s '
+             '(repo_id, author_id, commit_cnt, last_commit_ts) '
+             'VALUES %s ON CONFLICT (repo_id, author_id) DO UPDATE SET '
+             'commit_cnt = s.commit_cnt + EXCLUDED.commit_cnt, '
+             'last_commit_ts = greatest(s.last_commit_ts, EXCLUDED.last_commit_ts)')
+    # Filtered before sorting, None does not compare with IDs
+    rows = sorted(key + (cnt, ts) for key, (cnt, ts) in authors.items()
+                  if key[1] is not None)
+    if rows:
+        exec_values_in_db(cursor, query, rows)
+
+
+class StatsHandler():
+    """Rollups of repo_stats and repo_contributor_stats, see 0003_rollups.sql.
+
+    Written commits are added to them by add_commits(). Commits are
+    never deleted, commits of removed branches are moved to others.
+    """
+
+    def __init__(self, cursor: PgCursor):
+        self.cursor = cursor
+        self.exec_in_db = exec_in_db
+
+    def refresh_latest_tag(self, repo_id: int):
+        """Set the time of the repo's latest tagged commit."""
+        query = ('INSERT INTO repo_stats AS s (repo_id, latest_tag_ts) '
+                 'SELECT %s, max(c.ts) FROM tags AS t '
+                 'JOIN commits AS c ON c.id = t.commit_id WHERE t.repo_id = %s '
+                 'ON CONFLICT (repo_id) DO UPDATE SET latest_tag_ts = EXCLUDED.latest_tag_ts')
+        self.exec_in_db(self.cursor, query, (repo_id, repo_id), ret_all=False)
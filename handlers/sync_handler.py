@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+from psycopg2.extensions import cursor as PgCursor
+from psycopg2.extras import Json
+
+from .abc_handler import Handler
+
+from utils.connection import exec_in_db
+
+# A stage in progress saves its state every this many pages
+CHECKPOINT_PAGES = 10
+
+
+class SyncRunHandler(Handler):
+    """Collection runs, see the sync_runs table."""
+
+    def __init__(self, cursor: PgCursor):
+        self.cursor = cursor
+        self.exec_in_db = exec_in_db
+
+    def get_id(self, org: str) -> int:
+        """Get the ID of the org's latest run that has not finished."""
+        query = ("SELECT id FROM sync_runs WHERE org IS NOT DISTINCT FROM %s "
+                 "AND status IN ('running', 'interrupted') ORDER BY id DESC LIMIT 1")
+        res = self.exec_in_db(self.cursor, query, (org,))
+        if res:
+            return res[0][0]
+        return None
+
+    def add(self, org: str) -> int:
+        """Start a new run, give up unfinished runs of the org."""
+        query = ("UPDATE sync_runs SET status = 'abandoned' WHERE org IS NOT DISTINCT FROM %s "
+                 "AND status IN ('running', 'interrupted') RETURNING id")
+        abandoned = [row[0] for row in self.exec_in_db(self.cursor, query, (org,))]
+        if abandoned:
+            query = 'DELETE FROM sync_checkpoints WHERE run_id = ANY(%s)'
+            self.exec_in_db(self.cursor, query, (abandoned,), ret_all=False)
+
+            # Workers find nothing left of the runs
+            query = 'DELETE FROM sync_jobs WHERE run_id = ANY(%s)'
+            self.exec_in_db(self.cursor, query, (abandoned,), ret_all=False)
+
+        query = 'INSERT INTO sync_runs (org) VALUES (%s) RETURNING id'
+        return self.exec_in_db(self.cursor, query, (org,))[0][0]
+
+    def set_status(self, run_id: int, status: str):
+        query = 'UPDATE sync_runs SET status = %s WHERE id = %s'
+        self.exec_in_db(self.cursor, query, (status, run_id), ret_all=False)
+
+    def finish(self, run_id: int):
+        """Mark the run finished, its checkpoints are not needed any more."""
+        query = ("UPDATE sync_runs SET status = 'finished', "
+                 "finished_at = now() AT TIME ZONE 'UTC' WHERE id = %s")
+        self.exec_in_db(self.cursor, query, (run_id,), ret_all=False)
+
+        query = 'DELETE FROM sync_checkpoints WHERE run_id = %s'
+        self.exec_in_db(self.cursor, query, (run_id,), ret_all=False)
+
+    def mark_ingested(self):
+        """Move the last ingestion marker, cached dashboard results expire."""
+        query = ("UPDATE ingestion_marker SET updated_at = now() AT TIME ZONE 'UTC'")
+        self.exec_in_db(self.cursor, query, ret_all=False)
+
+    def get_done_repos(self, run_id: int) -> set:
+        """Get IDs of repos the run has completely collected."""
+        query = ("SELECT repo_id FROM sync_checkpoints "
+                 "WHERE run_id = %s AND stage = 'repo' AND done")
+        return {row[0] for row in self.exec_in_db(self.cursor, query, (run_id,))}
+
+
+class RepoCheckpoints():
+    """Progress of a run on a single repo, by stage.
+
+    All the repo's checkpoints are read at once. Every save is written
+    right away, the collector works in autocommit mode.
+    """
+
+    def __init__(self, cursor: PgCursor, run_id: int, repo_id: int):
+        self.cursor = cursor
+        self.exec_in_db = exec_in_db
+        self.run_id = run_id
+        self.repo_id = repo_id
+
+        query = ('SELECT stage, done, state FROM sync_checkpoints '
+                 'WHERE run_id = %s AND repo_id = %s')
+        res = self.exec_in_db(self.cursor, query, (run_id, repo_id))
+        self.stages = {row[0]: (row[1], row[2] or {}) for row in res}
+
+    def is_done(self, stage: str) -> bool:
+        return self.stages.get(stage, (False, {}))[0]
+
+    def get_state(self, stage: str) -> dict:
+        """Get the state a stage saved when it was interrupted."""
+        return self.stages.get(stage, (False, {}))[1]
+
+    def save(self, stage: str, state: dict):
+        self.__write(stage, False, state)
+
+    def done(self, stage: str):
+        self.__write(stage, True, None)
+
+    def __write(self, stage: str, done: bool, state: dict):
+        query = ("INSERT INTO sync_checkpoints AS c "
+                 "(run_id, repo_id, stage, done, state, updated_at) "
+                 "VALUES (%s, %s, %s, %s, %s, now() AT TIME ZONE 'UTC') "
+                 "ON CONFLICT (run_id, repo_id, stage) DO UPDATE SET "
+                 "done = EXCLUDED.done, state = EXCLUDED.state, "
+                 "updated_at = EXCLUDED.updated_at")
+        self.exec_in_db(self.cursor, query,
+                        (self.run_id, self.repo_id, stage, done,
+                         Json(state) if state is not None else None),
+                        ret_all=False)
+        self.stages[stage] = (done, state or {})
+
+
+class StageCheckpoint():
+    """Checkpoint of a single stage, handed to the handler running it."""
+
+    def __init__(self, checkpoints: RepoCheckpoints, stage: str):
+        self.checkpoints = checkpoints
+        self.stage = stage
+        self.state = checkpoints.get_state(stage)
+
+    def save(self, state: dict):
+        self.checkpoints.save(self.stage, state)
+
+    def resume_page(self) -> int:
+        """Get the page to continue from.
+
+        Starts one page before the last saved one: items added at the top
+        of a listing meanwhile push the unprocessed ones further, items
+        removed pull them back, the extra page covers the latter.
+        """
+        return max(self.state.get('page', 0) - 1, 0)
@@ -8,7 +8,10 @@ from .abc_handler import Handler
 
 from .commit_handler import CommitHandler
 from .repo_handler import RepoHandler
+from .stats_handler import StatsHandler
 
+from utils import metrics
+from utils.batch_writer import BatchWriter
 from utils.connection import exec_in_db
 
 
@@ -21,6 +24,15 @@ class TagHandler(Handler):
         self.tags = None
         self.commit = CommitHandler(cursor)
         self.repo_handler = RepoHandler(cursor)
+        self.stats = StatsHandler(cursor)
+        # Tags stored before their commit was collected get it set
+        self.writer = BatchWriter(cursor, 'tags',
+                                  ('repo_id', 'name', 'tarball', 'commit_id', 'commit_sha'),
+                                  on_conflict=('ON CONFLICT (repo_id, name) DO UPDATE SET '
+                                               'commit_id = EXCLUDED.commit_id, '
+                                               'commit_sha = EXCLUDED.commit_sha '
+                                               'WHERE tags.commit_id IS NULL'),
+                                  key=1)
 
     def handle(self, repo: Repository):
         if not self.__init_attrs(repo):
@@ -31,27 +43,47 @@ class TagHandler(Handler):
         self.__handle_tags()
 
     def __handle_tags(self):
-        for tag in self.tags:
-            tag_id = self.get_id(tag.name)
+        stored_tags = self.get_stored()
 
-            if tag_id is None:
-                commit_id = self.commit.get_id(tag.commit.sha)
+        # New tags and those whose commit has not been collected yet
+        pending = [tag for tag in self.tags
+                   if stored_tags.get(tag.name, (None,))[0] is None]
+        if not pending:
+            return
+
+        # Resolve all the SHAs with one query
+        commit_ids = self.commit.get_ids({tag.commit.sha for tag in pending})
+
+        unresolved = 0
+        for tag in pending:
+            sha = tag.commit.sha
+            commit_id = commit_ids.get(sha)
+
+            if commit_id is None:
+                unresolved += 1
 
-                if commit_id is None:
-                    pass
+                if tag.name in stored_tags and stored_tags[tag.name][1] == sha:
+                    # Still waiting for the commit, nothing to update
+                    continue
 
-                if tag.tarball_url:
-                    tarball = True
-                else:
-                    tarball = False
+            if tag.tarball_url:
+                tarball = True
+            else:
+                tarball = False
 
-                self.add(tag.name, tarball, commit_id)
+            self.add(tag.name, tarball, commit_id, sha)
+
+        self.writer.flush()
+        self.stats.refresh_latest_tag(self.repo_id)
+
+        # Resolved by a later run, once the commit is collected
+        metrics.registry.inc('tags_unresolved_total', unresolved)
 
     def __init_attrs(self, repo: Repository):
         self.repo = repo
         self.repo_id = 0
 
-        self.tags = self.repo.get_tags()
+        self.tags = list(self.repo.get_tags())
         if not self.tags:
             # If there are no tags
             return False
@@ -60,11 +92,18 @@ class TagHandler(Handler):
 
         return True
 
-    def add(self, tag_name: str, tarball: bool, commit_id: int):
-        query = ('INSERT INTO tags (repo_id, name, tarball, commit_id) '
-                 'VALUES (%s, %s, %s, %s)')
-        args = (self.repo_id, tag_name, tarball, commit_id,)
-        self.exec_in_db(self.cursor, query, args, ret_all=False)
+    def add(self, tag_name: str, tarball: bool, commit_id: int, commit_sha: str):
+        """Add a tag to the database or set the commit of the stored one.
+
+        The tag is written when the batch is flushed.
+        """
+        self.writer.add((self.repo_id, tag_name, tarball, commit_id, commit_sha))
+
+    def get_stored(self) -> dict:
+        """Get a dict {tag name: (commit ID, commit SHA)} of the repo's stored tags."""
+        query = 'SELECT name, commit_id, commit_sha FROM tags WHERE repo_id = %s'
+        res = self.exec_in_db(self.cursor, query, (self.repo_id,))
+        return {row[0]: (row[1], row[2]) for row in res}
 
     def get_id(self, tag_name: str) -> int:
         """Get a tag ID from the database."""
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import sys
+
+from argparse import ArgumentParser
+
+from utils.connection import (
+    StatementError,
+    connect_to_db,
+)
+from utils.gh_stats_collector_functions import parse_config
+from utils.migrations import (
+    get_applied,
+    load_migrations,
+    migrate,
+)
+
+
+def get_cli_args():
+    """Get command-line arguments."""
+    parser = ArgumentParser(description='Apply schema migrations of migrations/ '
+                                        'to a database created with database.sql')
+
+    # Config
+    parser.add_argument('-c', '--config', dest='config',
+                        help='Path to config file', metavar='PATH')
+
+    # DB connection related parameters
+    parser.add_argument('-d', '--database', dest='database',
+                        help='Database name to connect to', metavar='DBNAME')
+
+    parser.add_argument('-u', '--user', dest='user',
+                        help='Database user to log in with', metavar='DBUSER')
+
+    parser.add_argument('-p', '--password', dest='password',
+                        help='Database password', metavar='DBPASS')
+
+    partition_msg = ('Also partition commits and comments by month; the tables '
+                     'are rebuilt, stop collecting meanwhile')
+    parser.add_argument('--partition', dest='partition',
+                        help=partition_msg, action='store_true')
+
+    parser.add_argument('--list', dest='list',
+                        help='List migrations and whether they are applied',
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    if not args.config:
+        if not all((args.database, args.user, args.password)):
+            print('-c or all of -d, -u, -p arguments must be specified')
+            sys.exit(1)
+
+    return args
+
+
+def print_migrations(applied: dict):
+    for migration in load_migrations():
+        status = 'applied' if migration.version in applied else 'pending'
+        if migration.feature and migration.version not in applied:
+            status = 'optional, --%s' % migration.feature
+
+        print('%04d_%s: %s' % (migration.version, migration.name, status))
+
+
+def main():
+    cli_args = get_cli_args()
+
+    if cli_args.config:
+        cli_args = parse_config(cli_args, github=False)
+
+    conn, _ = connect_to_db(database=cli_args.database,
+                            user=cli_args.user,
+                            password=cli_args.password)
+
+    try:
+        if cli_args.list:
+            print_migrations(get_applied(conn))
+
+        else:
+            features = ('partition',) if cli_args.partition else ()
+            applied = migrate(conn, features)
+            print('%s migration(s) applied' % applied)
+
+    except StatementError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    finally:
+        conn.close()
+
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
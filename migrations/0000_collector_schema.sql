@@ -0,0 +1,54 @@
+-- Columns, tables and constraints the collector relies on that the
+-- baseline schema of database.sql lacks. Every statement can be applied
+-- again, so databases created with a database.sql that already had
+-- some of them are brought to the same schema.
+
+-- Users stored without their profiles (--defer-users)
+ALTER TABLE contributors ADD COLUMN IF NOT EXISTS profile_pending BOOLEAN NOT NULL DEFAULT false;
+CREATE INDEX IF NOT EXISTS idx_contributors_profile_pending ON contributors (id) WHERE profile_pending;
+
+-- The moments issues / comments changed after which are requested by the next run
+ALTER TABLE repos ADD COLUMN IF NOT EXISTS issues_synced_at TIMESTAMP;
+ALTER TABLE repos ADD COLUMN IF NOT EXISTS comments_synced_at TIMESTAMP;
+
+-- The sync watermark: the branch head seen by the last complete run
+ALTER TABLE branches ADD COLUMN IF NOT EXISTS head_sha TEXT;
+ALTER TABLE branches ADD COLUMN IF NOT EXISTS head_ts TIMESTAMP;
+
+-- The tagged commit, tags.commit_id stays NULL until the commit is collected
+ALTER TABLE tags ADD COLUMN IF NOT EXISTS commit_sha TEXT;
+
+-- Branch names are unique within a repo and tag names too, the collector
+-- upserts them relying on it. Commits of duplicated branches are moved
+-- to the first one, the duplicates are removed.
+UPDATE commits AS c SET branch_id = d.id FROM branches AS b, branches AS d
+WHERE c.branch_id = b.id AND b.repo_id = d.repo_id AND b.name = d.name AND b.id > d.id
+AND NOT EXISTS (SELECT 1 FROM branches AS e WHERE e.repo_id = d.repo_id AND e.name = d.name AND e.id < d.id);
+DELETE FROM branches AS b USING branches AS d WHERE b.repo_id = d.repo_id AND b.name = d.name AND b.id > d.id;
+DELETE FROM tags AS t USING tags AS d WHERE t.repo_id = d.repo_id AND t.name = d.name AND t.id > d.id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uniq_branches_repo_id_name') THEN
+        ALTER TABLE branches ADD CONSTRAINT uniq_branches_repo_id_name UNIQUE (repo_id, name);
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uniq_tags_repo_id_name') THEN
+        ALTER TABLE tags ADD CONSTRAINT uniq_tags_repo_id_name UNIQUE (repo_id, name);
+    END IF;
+END;
+$$;
+
+-- Collection runs and their progress, used by --resume.
+-- status is one of running, interrupted, finished, abandoned;
+-- a run killed without a chance to update it stays running
+CREATE TABLE IF NOT EXISTS sync_runs (id BIGSERIAL PRIMARY KEY, org TEXT, status TEXT NOT NULL DEFAULT 'running', started_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'), finished_at TIMESTAMP);
+-- stage is issues, branches, commits, commits/<branch>, tags or repo for the whole repo;
+-- state keeps what is needed to continue a stage, e.g. the next page to request
+CREATE TABLE IF NOT EXISTS sync_checkpoints (run_id BIGINT REFERENCES sync_runs (id) ON DELETE CASCADE, repo_id INT REFERENCES repos (id) ON DELETE CASCADE, stage TEXT, done BOOLEAN NOT NULL DEFAULT FALSE, state JSONB, updated_at TIMESTAMP, PRIMARY KEY (run_id, repo_id, stage));
+
+-- Jobs of distributed runs (--enqueue, --worker), one per repo and stage.
+-- status is one of queued, running, done, failed; a running job belongs
+-- to its worker until leased_until, the worker extends it while working
+CREATE TABLE IF NOT EXISTS sync_jobs (id BIGSERIAL PRIMARY KEY, run_id BIGINT NOT NULL REFERENCES sync_runs (id) ON DELETE CASCADE, org TEXT, repo TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', worker TEXT, leased_until TIMESTAMP, attempts INT NOT NULL DEFAULT 0, error TEXT, UNIQUE (run_id, repo, stage));
+CREATE INDEX IF NOT EXISTS idx_sync_jobs_claim ON sync_jobs (org, id) WHERE status IN ('queued', 'running');
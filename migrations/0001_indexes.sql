@@ -0,0 +1,20 @@
+-- no-transaction
+-- Indexes on the columns queries filter and join on.
+-- They are built CONCURRENTLY, so that collection can go on meanwhile;
+-- an index whose build has failed is left INVALID, drop it before running again.
+-- tags.repo_id and branches.repo_id are covered by the
+-- uniq_tags_repo_id_name and uniq_branches_repo_id_name constraints of 0000.
+
+-- Commits of a repo and their latest time (contributor and release stats)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_commits_repo_id_ts ON commits (repo_id, ts);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_commits_author_id ON commits (author_id);
+-- Removing a branch moves its commits
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_commits_branch_id ON commits (branch_id);
+-- Time ranges over all commits; commits are inserted roughly in time order,
+-- a BRIN index is a tiny fraction of a B-tree on tens of millions of rows
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_commits_ts_brin ON commits USING brin (ts);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_issues_repo_id ON issues (repo_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comments_issue_id ON comments (issue_id);
+-- Deleting a commit unlinks its tags
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tags_commit_id ON tags (commit_id);
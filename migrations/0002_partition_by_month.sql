@@ -0,0 +1,83 @@
+-- feature: partition
+-- Range partitioning of commits by ts and comments by ts_created, a partition per month.
+-- Applied only with "migrate.py --partition". The tables are rebuilt: it takes
+-- an exclusive lock for the time of copying them, stop collecting meanwhile.
+--
+-- Unique constraints of a partitioned table must include the partition key,
+-- so the primary keys become (id, ts) and (id, ts_created) and commits.sha is
+-- unique together with ts, which is the same for the same commit. Foreign keys
+-- cannot reference commits then: the one of tags.commit_id is replaced
+-- with a trigger unlinking tags of deleted commits.
+--
+-- Months are created up to two years ahead, later rows go to the default
+-- partitions until more months are added, e.g. for 2030:
+-- SELECT gh_stats_add_month_partitions('commits', '2030-01-01', '2031-01-01');
+
+CREATE OR REPLACE FUNCTION gh_stats_add_month_partitions(parent TEXT, since DATE, until DATE)
+RETURNS void AS $$
+DECLARE
+    month DATE := date_trunc('month', since);
+BEGIN
+    WHILE month < until LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                       parent || '_' || to_char(month, 'YYYY_MM'), parent,
+                       month, month + interval '1 month');
+        month := month + interval '1 month';
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Commits
+ALTER TABLE commits RENAME TO commits_unpartitioned;
+-- The sequence would be dropped with the old table
+ALTER SEQUENCE commits_id_seq OWNED BY NONE;
+
+CREATE TABLE commits (id BIGINT NOT NULL DEFAULT nextval('commits_id_seq'), sha TEXT, author_id BIGINT, repo_id INT, ts TIMESTAMP NOT NULL, branch_id INT) PARTITION BY RANGE (ts);
+ALTER SEQUENCE commits_id_seq OWNED BY commits.id;
+
+SELECT gh_stats_add_month_partitions('commits', (SELECT coalesce(min(ts), now())::date FROM commits_unpartitioned), (now() + interval '2 years')::date);
+CREATE TABLE commits_default PARTITION OF commits DEFAULT;
+
+INSERT INTO commits (id, sha, author_id, repo_id, ts, branch_id) SELECT id, sha, author_id, repo_id, ts, branch_id FROM commits_unpartitioned;
+-- Drops fk_commit_id of tags and the indexes of the old table
+DROP TABLE commits_unpartitioned CASCADE;
+
+ALTER TABLE commits ADD CONSTRAINT commits_pkey PRIMARY KEY (id, ts);
+ALTER TABLE commits ADD CONSTRAINT uniq_commits_sha UNIQUE (sha, ts);
+ALTER TABLE commits ADD CONSTRAINT fk_author_id FOREIGN KEY (author_id) REFERENCES contributors (id);
+ALTER TABLE commits ADD CONSTRAINT fk_repo_id FOREIGN KEY (repo_id) REFERENCES repos (id);
+ALTER TABLE commits ADD CONSTRAINT fk_branch_id FOREIGN KEY (branch_id) REFERENCES branches (id) ON DELETE CASCADE;
+
+CREATE INDEX IF NOT EXISTS idx_commits_repo_id_ts ON commits (repo_id, ts);
+CREATE INDEX IF NOT EXISTS idx_commits_author_id ON commits (author_id);
+CREATE INDEX IF NOT EXISTS idx_commits_branch_id ON commits (branch_id);
+CREATE INDEX IF NOT EXISTS idx_commits_ts_brin ON commits USING brin (ts);
+
+-- Tags of a deleted commit wait for it to be collected again, as new tags do
+CREATE OR REPLACE FUNCTION gh_stats_unlink_tags() RETURNS trigger AS $$
+BEGIN
+    UPDATE tags SET commit_id = NULL WHERE commit_id = OLD.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_commits_unlink_tags AFTER DELETE ON commits
+    FOR EACH ROW EXECUTE FUNCTION gh_stats_unlink_tags();
+
+-- Comments
+ALTER TABLE comments RENAME TO comments_unpartitioned;
+
+CREATE TABLE comments (id BIGINT NOT NULL, repo_id BIGINT, issue_id BIGINT, author_id BIGINT, ts_created TIMESTAMP NOT NULL) PARTITION BY RANGE (ts_created);
+
+SELECT gh_stats_add_month_partitions('comments', (SELECT coalesce(min(ts_created), now())::date FROM comments_unpartitioned), (now() + interval '2 years')::date);
+CREATE TABLE comments_default PARTITION OF comments DEFAULT;
+
+INSERT INTO comments (id, repo_id, issue_id, author_id, ts_created) SELECT id, repo_id, issue_id, author_id, ts_created FROM comments_unpartitioned;
+DROP TABLE comments_unpartitioned;
+
+ALTER TABLE comments ADD CONSTRAINT comments_pkey PRIMARY KEY (id, ts_created);
+ALTER TABLE comments ADD CONSTRAINT fk_contributor_id FOREIGN KEY (author_id) REFERENCES contributors (id);
+ALTER TABLE comments ADD CONSTRAINT fk_repo_id FOREIGN KEY (repo_id) REFERENCES repos (id);
+ALTER TABLE comments ADD CONSTRAINT fk_issue_id FOREIGN KEY (issue_id) REFERENCES issues (id);
+
+CREATE INDEX IF NOT EXISTS idx_comments_issue_id ON comments (issue_id);
@@ -0,0 +1,24 @@
+-- Rollups of commits and tags that reports read instead of aggregating
+-- the whole tables. The collector updates them as it writes commits
+-- and tags; here they are filled from the data collected so far.
+
+-- Per repo: number of commits, time of the latest commit and of the latest tagged commit
+CREATE TABLE IF NOT EXISTS repo_stats (repo_id INT PRIMARY KEY REFERENCES repos (id) ON DELETE CASCADE, commit_cnt BIGINT NOT NULL DEFAULT 0, latest_commit_ts TIMESTAMP, latest_tag_ts TIMESTAMP);
+
+-- Per repo and commit author: number of commits and time of the latest one
+CREATE TABLE IF NOT EXISTS repo_contributor_stats (repo_id INT REFERENCES repos (id) ON DELETE CASCADE, author_id BIGINT REFERENCES contributors (id), commit_cnt BIGINT NOT NULL DEFAULT 0, last_commit_ts TIMESTAMP, PRIMARY KEY (repo_id, author_id));
+
+INSERT INTO repo_stats (repo_id, commit_cnt, latest_commit_ts)
+SELECT repo_id, count(*), max(ts) FROM commits WHERE repo_id IS NOT NULL GROUP BY repo_id
+ON CONFLICT (repo_id) DO UPDATE SET commit_cnt = EXCLUDED.commit_cnt, latest_commit_ts = EXCLUDED.latest_commit_ts;
+
+INSERT INTO repo_stats AS s (repo_id, latest_tag_ts)
+SELECT t.repo_id, max(c.ts) FROM tags AS t JOIN commits AS c ON c.id = t.commit_id WHERE t.repo_id IS NOT NULL GROUP BY t.repo_id
+ON CONFLICT (repo_id) DO UPDATE SET latest_tag_ts = EXCLUDED.latest_tag_ts;
+
+INSERT INTO repo_contributor_stats (repo_id, author_id, commit_cnt, last_commit_ts)
+SELECT repo_id, author_id, count(*), max(ts) FROM commits WHERE repo_id IS NOT NULL AND author_id IS NOT NULL GROUP BY repo_id, author_id
+ON CONFLICT (repo_id, author_id) DO UPDATE SET commit_cnt = EXCLUDED.commit_cnt, last_commit_ts = EXCLUDED.last_commit_ts;
+
+-- Contributors of a repo by number of commits
+CREATE INDEX IF NOT EXISTS idx_repo_contributor_stats_repo_id_commit_cnt ON repo_contributor_stats (repo_id, commit_cnt DESC);
@@ -0,0 +1,3 @@
+-- Time the collector last stored data, the dashboard caches query results until it moves
+CREATE TABLE IF NOT EXISTS ingestion_marker (id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id), updated_at TIMESTAMP NOT NULL);
+INSERT INTO ingestion_marker (id, updated_at) VALUES (true, now() AT TIME ZONE 'UTC') ON CONFLICT (id) DO NOTHING;
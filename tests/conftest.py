@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Tests marked with the db fixture run against a local PostgreSQL
+# when these are set; a database is created for every test and dropped
+DB_USER = os.environ.get('GH_STATS_TEST_USER')
+DB_PASSWORD = os.environ.get('GH_STATS_TEST_PASSWORD')
+
+
+@pytest.fixture(autouse=True)
+def id_caches():
+    """Forget IDs cached by the previous test, its database is gone."""
+    yield
+
+    if 'utils.id_cache' in sys.modules:
+        sys.modules['utils.id_cache'].clear()
+
+
+@pytest.fixture
+def baseline_db():
+    """Yield an autocommit cursor of a new database with the tables of database.sql."""
+    if not DB_USER:
+        pytest.skip('set GH_STATS_TEST_USER and GH_STATS_TEST_PASSWORD '
+                    'to run database tests')
+
+    from utils.connection import connect_to_db
+
+    name = 'gh_stats_test_%s' % os.getpid()
+    admin_conn, admin = connect_to_db('postgres', DB_USER, DB_PASSWORD, autocommit=True)
+    admin.execute('DROP DATABASE IF EXISTS %s' % name)
+    admin.execute('CREATE DATABASE %s' % name)
+
+    conn, cursor = connect_to_db(name, DB_USER, DB_PASSWORD, autocommit=True)
+    try:
+        with open(os.path.join(ROOT, 'database.sql')) as f:
+            cursor.execute(''.join(line for line in f
+                                   if not line.startswith(('CREATE DATABASE', '\\'))))
+
+        yield cursor
+
+    finally:
+        conn.close()
+        admin.execute('DROP DATABASE IF EXISTS %s' % name)
+        admin_conn.close()
+
+
+@pytest.fixture
+def db(baseline_db):
+    """Yield an autocommit cursor of a new database with the schema migrated."""
+    from utils.migrations import migrate
+
+    migrate(baseline_db.connection, verbose=False)
+    return baseline_db
+
+
+@pytest.fixture
+def connect():
+    """Open more connections to the database of the db fixture."""
+    from utils.connection import connect_to_db
+
+    connections = []
+
+    def _connect(cursor, autocommit=False):
+        conn, new_cursor = connect_to_db(cursor.connection.info.dbname,
+                                         DB_USER, DB_PASSWORD, autocommit=autocommit)
+        connections.append(conn)
+        return new_cursor
+
+    yield _connect
+
+    for conn in connections:
+        conn.close()
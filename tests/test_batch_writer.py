@@ -0,0 +1,125 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from utils import (  # noqa: E402
+    id_cache,
+    metrics,
+)
+from utils.batch_writer import (  # noqa: E402
+    BatchWriter,
+    write_rows,
+)
+from utils.connection import StatementError  # noqa: E402
+
+QUERY = 'INSERT INTO t (id, value) VALUES %s RETURNING id'
+
+
+def skipped_rows() -> int:
+    return sum(m['value'] for m in metrics.registry.snapshot()
+               if m['name'] == 'db_rows_skipped_total' and m['labels'].get('table') == 't')
+
+
+def test_write_rows_skips_bad_rows(db, connect):
+    db.execute('CREATE TABLE t (id INT PRIMARY KEY, value INT CHECK (value >= 0))')
+
+    cursor = connect(db)
+    skipped = skipped_rows()
+
+    res = write_rows(cursor, QUERY, [(1, 1), (2, -1), (3, 3), (1, 4)], 't', fetch=True)
+    cursor.connection.commit()
+
+    # The row breaking the check and the duplicate key are skipped,
+    # the rest of the batch is written in the same transaction
+    assert sorted(row[0] for row in res) == [1, 3]
+    assert skipped_rows() == skipped + 2
+
+    db.execute('SELECT id, value FROM t ORDER BY id')
+    assert [tuple(row) for row in db.fetchall()] == [(1, 1), (3, 3)]
+
+
+def test_write_rows_keeps_earlier_statements(db, connect):
+    db.execute('CREATE TABLE t (id INT PRIMARY KEY, value INT CHECK (value >= 0))')
+
+    cursor = connect(db)
+    cursor.execute('INSERT INTO t VALUES (10, 10)')
+
+    # The savepoint undoes only the failed multi-row statement
+    write_rows(cursor, QUERY, [(11, -1), (12, 12)], 't')
+    cursor.connection.commit()
+
+    db.execute('SELECT id FROM t ORDER BY id')
+    assert [row[0] for row in db.fetchall()] == [10, 12]
+
+
+def test_write_rows_raises_statement_errors(db, connect):
+    cursor = connect(db)
+
+    # Not caused by a row: the table does not exist
+    with pytest.raises(StatementError):
+        write_rows(cursor, QUERY, [(1, 1)], 't')
+
+
+def test_write_rows_raises_on_missing_references(db, connect):
+    db.execute('CREATE TABLE p (id INT PRIMARY KEY)')
+    db.execute('CREATE TABLE t (id INT PRIMARY KEY, value INT REFERENCES p (id))')
+    db.execute('INSERT INTO p VALUES (1)')
+
+    cursor = connect(db)
+    id_cache.branch_ids.put((1, 'main'), 2)
+
+    # A stale ID is not skipped, the caches are resolved again
+    with pytest.raises(StatementError):
+        write_rows(cursor, QUERY, [(1, 1), (2, 2)], 't')
+
+    assert id_cache.branch_ids.get((1, 'main')) is None
+
+
+def test_batch_writer_keeps_latest_row_of_key():
+    written = []
+
+    writer = BatchWriter(None, 't', ('id', 'value'), key=0, batch_size=10)
+    writer.write_rows = lambda cursor, query, rows, table, fetch=False: written.extend(rows)
+
+    writer.add((1, 'a'))
+    writer.add((2, 'b'))
+    writer.add((1, 'c'))
+    writer.flush()
+
+    assert sorted(written) == [(1, 'c'), (2, 'b')]
+
+
+def test_batch_writer_flushes_parents_first():
+    written = []
+
+    parent = BatchWriter(None, 'parent', ('id',))
+    child = BatchWriter(None, 'child', ('id',), parents=(parent,))
+    for writer in (parent, child):
+        writer.write_rows = (lambda cursor, query, rows, table, fetch=False:
+                             written.append(table))
+
+    parent.add((1,))
+    child.add((1,))
+    child.flush()
+
+    assert written == ['parent', 'child']
+
+
+def test_batch_writer_passes_returned_rows():
+    returned = []
+    statements = []
+
+    def write_rows(cursor, query, rows, table, fetch=False):
+        statements.append((' '.join(query.split()), fetch))
+        return rows[:1]
+
+    writer = BatchWriter(None, 't', ('id',), returning='RETURNING id',
+                         on_written=lambda cursor, rows: returned.extend(rows))
+    writer.write_rows = write_rows
+
+    writer.add((1,))
+    writer.add((2,))
+    writer.flush()
+
+    assert statements == [('INSERT INTO t (id) VALUES %s RETURNING id', True)]
+    assert returned == [(1,)]
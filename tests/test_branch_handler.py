@@ -0,0 +1,76 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from handlers.branch_handler import BranchHandler  # noqa: E402
+from utils.payload import RawObject  # noqa: E402
+
+
+def branch(name: str, sha: str) -> RawObject:
+    return RawObject({'name': name, 'commit': {'sha': sha}})
+
+
+@pytest.fixture
+def repo_id(db) -> int:
+    db.execute("INSERT INTO repos (name) VALUES ('repo') RETURNING id")
+    return db.fetchone()[0]
+
+
+def get_commits(db) -> list:
+    db.execute('SELECT c.sha, b.name FROM commits AS c '
+               'LEFT JOIN branches AS b ON b.id = c.branch_id ORDER BY c.sha')
+    return [tuple(row) for row in db.fetchall()]
+
+
+def test_sync_adds_and_returns_moved_branches(db, repo_id):
+    handler = BranchHandler(db)
+
+    moved = handler.sync(repo_id, [branch('main', 'a'), branch('devel', 'b')])
+    assert [b.name for b in moved] == ['main', 'devel']
+
+    handler.set_watermark(handler.get_id('main', repo_id), 'a', None)
+    moved = handler.sync(repo_id, [branch('main', 'a'), branch('devel', 'b')])
+    assert [b.name for b in moved] == ['devel']
+
+    moved = handler.sync(repo_id, [branch('main', 'a')], full=True)
+    assert [b.name for b in moved] == ['main']
+    assert handler.get_repo_heads(repo_id).keys() == {'main'}
+
+
+def test_removed_branch_keeps_commits(db, repo_id):
+    handler = BranchHandler(db)
+    handler.sync(repo_id, [branch('devel', 'a'), branch('main', 'b'),
+                           branch('feature', 'c')])
+
+    # Collected from the feature branch first, then merged into main
+    db.execute("INSERT INTO commits (sha, repo_id, branch_id) VALUES "
+               "('c', %s, %s), ('b', %s, %s)",
+               (repo_id, handler.get_id('feature', repo_id),
+                repo_id, handler.get_id('main', repo_id)))
+    db.execute("INSERT INTO tags (name, repo_id, commit_id) "
+               "SELECT 'v1', repo_id, id FROM commits WHERE sha = 'c'")
+
+    handler.sync(repo_id, [branch('devel', 'a'), branch('main', 'c')],
+                 default_branch='main')
+
+    assert handler.get_id('feature', repo_id) is None
+    assert get_commits(db) == [('b', 'main'), ('c', 'main')]
+
+    db.execute('SELECT count(*) FROM tags')
+    assert db.fetchone()[0] == 1
+
+
+def test_removed_branches_without_default(db, repo_id):
+    handler = BranchHandler(db)
+    handler.sync(repo_id, [branch('b1', 'a'), branch('b2', 'b'), branch('b3', 'c')])
+
+    db.execute("INSERT INTO commits (sha, repo_id, branch_id) VALUES ('c', %s, %s)",
+               (repo_id, handler.get_id('b3', repo_id)))
+
+    # Another remaining branch
+    handler.sync(repo_id, [branch('b2', 'b')])
+    assert get_commits(db) == [('c', 'b2')]
+
+    # No branch left, the commits stay in the repo
+    handler.sync(repo_id, [])
+    assert get_commits(db) == [('c', None)]
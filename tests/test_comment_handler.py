@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('github')
+
+from handlers.comment_handler import CommentHandler  # noqa: E402
+from utils.payload import RawObject  # noqa: E402
+from utils.queries import CountingCursor  # noqa: E402
+
+
+def comment(id_: int) -> RawObject:
+    return RawObject({'id': id_, 'user': {'login': 'alice'},
+                      'issue_url': 'https://api.github.com/repos/org/repo/issues/1'})
+
+
+@pytest.fixture
+def issue(db) -> tuple:
+    """Add a repo with an issue, return their IDs."""
+    db.execute("INSERT INTO repos (name) VALUES ('repo') RETURNING id")
+    repo_id = db.fetchone()[0]
+    db.execute('INSERT INTO issues (id, repo_id, number) VALUES (100, %s, 1)', (repo_id,))
+    return repo_id, 100
+
+
+def test_handle_looks_up_stored_comments_once(db, issue):
+    repo_id, issue_id = issue
+    db.execute('INSERT INTO comments (id, repo_id, issue_id) VALUES (1, %s, %s)',
+               (repo_id, issue_id))
+
+    cursor = CountingCursor(db)
+    handler = CommentHandler(cursor)
+    added = []
+    handler.contributor.get_user_id = lambda user: None
+    handler.add = lambda *row: added.append(row[0])
+
+    handler.handle(repo_id, issue_id, [comment(id_) for id_ in range(1, 51)])
+
+    assert len(cursor.statements) == 1
+    assert added == list(range(2, 51))
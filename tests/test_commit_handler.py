@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('github')
+
+from handlers.branch_handler import BranchHandler  # noqa: E402
+from handlers.commit_handler import (  # noqa: E402
+    CommitHandler,
+    Frontier,
+)
+from utils.payload import RawObject  # noqa: E402
+
+
+def walk(frontier: Frontier, listing: list) -> list:
+    """Visit commits of a listing of (SHA, parent SHAs), return the visited SHAs."""
+    visited = []
+    for sha, parents in listing:
+        frontier.visit(sha, parents)
+        visited.append(sha)
+        if frontier.reached():
+            break
+    return visited
+
+
+def test_frontier_stops_at_boundary():
+    listing = [('c3', ['c2']), ('c2', ['c1']), ('c1', [])]
+
+    # The boundary itself is not listed
+    assert walk(Frontier({'c2'}), listing) == ['c3']
+    # Nothing new
+    assert walk(Frontier({'c3'}), listing) == ['c3']
+
+
+def test_frontier_reaches_old_merged_commits():
+    # f1 is dated before c2 and c1, the listing has it after them
+    listing = [('m', ['c2', 'f1']), ('c2', ['c1']), ('c1', ['c0']),
+               ('f1', ['c1']), ('c0', [])]
+
+    assert walk(Frontier({'c2'}), listing) == ['m', 'c2', 'c1', 'f1']
+
+
+def test_frontier_shared_ancestor_listed_between_children():
+    listing = [('m', ['a', 'b']), ('a', ['x']), ('x', ['base']),
+               ('b', ['x']), ('base', ['root']), ('root', [])]
+
+    assert walk(Frontier({'base'}), listing) == ['m', 'a', 'x', 'b']
+
+
+def test_frontier_without_boundaries_walks_everything():
+    listing = [('c3', ['c2']), ('c2', ['c1']), ('c1', [])]
+
+    assert walk(Frontier(set()), listing) == ['c3', 'c2', 'c1']
+
+
+def test_frontier_resumed():
+    # Pending ancestors saved by an interrupted run
+    frontier = Frontier({'c1'}, pending=['c2'])
+
+    assert walk(frontier, [('c2', ['c1']), ('c1', [])]) == ['c2']
+
+
+class Repo():
+    def __init__(self, name: str, branches: dict):
+        self.name = name
+        self.branches = branches
+
+    def get_commits(self, sha=None):
+        return iter(self.branches[sha])
+
+
+def commit(sha: str, parents: list, day: int) -> RawObject:
+    ts = datetime(2024, 1, day).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return RawObject({'sha': sha, 'author': None, 'parents': [{'sha': p} for p in parents],
+                      'commit': {'committer': {'date': ts}, 'author': {'email': None}}})
+
+
+def test_handle_collects_old_merged_commits(db):
+    db.execute("INSERT INTO repos (name) VALUES ('repo') RETURNING id")
+    repo_id = db.fetchone()[0]
+    db.execute("INSERT INTO contributors (login) VALUES ('alice') RETURNING id")
+    alice = db.fetchone()[0]
+
+    c1, c2 = commit('c1', [], 10), commit('c2', ['c1'], 20)
+    repo = Repo('repo', {'main': [c2, c1]})
+
+    handler = CommitHandler(db)
+    handler.contributor.get_user_id = lambda user, email: alice
+    # Commits without an author are not stored
+    for item in (c1, c2):
+        item.raw_data['author'] = {'login': 'alice'}
+
+    handler.handle(repo, 'main')
+    branch_id = BranchHandler(db).get_id('main', repo_id)
+    db.execute('SELECT head_sha FROM branches WHERE id = %s', (branch_id,))
+    assert db.fetchone()[0] == 'c2'
+
+    # A feature branch committed before c2 is merged
+    f1 = commit('f1', ['c1'], 5)
+    m = commit('m', ['c2', 'f1'], 25)
+    for item in (f1, m):
+        item.raw_data['author'] = {'login': 'alice'}
+    repo.branches['main'] = [m, c2, c1, f1]
+
+    handler.handle(repo, 'main')
+
+    db.execute('SELECT sha FROM commits ORDER BY sha')
+    assert [row[0] for row in db.fetchall()] == ['c1', 'c2', 'f1', 'm']
+
+    db.execute('SELECT head_sha FROM branches WHERE id = %s', (branch_id,))
+    assert db.fetchone()[0] == 'm'
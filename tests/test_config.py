@@ -0,0 +1,70 @@
+from argparse import Namespace
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from utils.gh_stats_collector_functions import parse_config  # noqa: E402
+
+CONNECTION = '[connection]\ndatabase = db\nuser = user\npassword = secret\n'
+GITHUB = '[github]\ntokens = t1, t2\norganization = org\n'
+
+
+def write_config(tmp_path, text: str) -> str:
+    path = tmp_path / 'config.ini'
+    path.write_text(text)
+    return str(path)
+
+
+def get_args(config: str, **args) -> Namespace:
+    values = dict(config=config, database=None, user=None, password=None,
+                  token=None, org=None)
+    values.update(args)
+    return Namespace(**values)
+
+
+def test_parse_config(tmp_path):
+    args = parse_config(get_args(write_config(tmp_path, CONNECTION + GITHUB), user='cli'))
+
+    # Command-line arguments win
+    assert (args.database, args.user, args.password) == ('db', 'cli', 'secret')
+    assert (args.token, args.org) == ('t1, t2', 'org')
+
+
+def test_parse_config_requires_github(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        parse_config(get_args(write_config(tmp_path, CONNECTION)))
+
+    assert 'both [connection] and [github] sections' in capsys.readouterr().out
+
+
+def test_parse_config_without_github(tmp_path, capsys):
+    # As migrate.py reads it, its arguments have no token and org
+    args = Namespace(config=write_config(tmp_path, CONNECTION),
+                     database=None, user=None, password=None)
+    args = parse_config(args, github=False)
+    assert (args.database, args.user, args.password) == ('db', 'user', 'secret')
+
+    with pytest.raises(SystemExit):
+        parse_config(Namespace(config=write_config(tmp_path, GITHUB),
+                               database=None, user=None, password=None), github=False)
+
+    assert '[connection] section' in capsys.readouterr().out
+
+
+def test_replay_requires_recorded_comment_sweep(tmp_path, monkeypatch, capsys):
+    from utils.gh_stats_collector_functions import get_cli_args
+    from utils.recording import write_settings
+
+    write_settings(str(tmp_path), {'comment_sweep': True})
+    argv = ['gh_stats_collector.py', '-d', 'db', '-u', 'user', '-p', 'secret',
+            '--replay', str(tmp_path)]
+
+    monkeypatch.setattr('sys.argv', argv + ['--comment-sweep'])
+    assert get_cli_args().comment_sweep
+
+    monkeypatch.setattr('sys.argv', argv)
+    with pytest.raises(SystemExit):
+        get_cli_args()
+
+    assert 'recorded with --comment-sweep' in capsys.readouterr().out
@@ -0,0 +1,93 @@
+import pytest
+
+from utils import http_cache
+from utils.http_cache import HttpCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Make every call of time.time() a second later than the previous one."""
+    clock = {'now': 0}
+
+    def time():
+        clock['now'] += 1
+        return clock['now']
+
+    monkeypatch.setattr(http_cache.time, 'time', time)
+    return clock
+
+
+def open_cache(tmp_path, max_bytes=1000) -> HttpCache:
+    return HttpCache(str(tmp_path), max_bytes)
+
+
+def test_store_and_revalidate(tmp_path):
+    cache = open_cache(tmp_path)
+
+    cache.store('/a', {'etag': '"1"', 'x-ratelimit-remaining': '10'}, 'body')
+    cached = cache.lookup('/a')
+    assert cached == ({'etag': '"1"', 'x-ratelimit-remaining': '10'}, 'body')
+    assert HttpCache.validators(cached) == {'If-None-Match': '"1"'}
+
+    # Rate-limit headers come from the 304 answer
+    response = cache.revalidated('/a', cached, {'x-ratelimit-remaining': '9'})
+    assert (response.status, response.read()) == (200, 'body')
+    assert dict(response.getheaders()) == {'etag': '"1"', 'x-ratelimit-remaining': '9'}
+
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5,
+                             'evictions': 0, 'size': 4}
+
+
+def test_last_modified_validator(tmp_path):
+    cache = open_cache(tmp_path)
+
+    cache.store('/a', {'last-modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}, 'body')
+
+    assert HttpCache.validators(cache.lookup('/a')) == {
+        'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+
+def test_response_without_validators_is_not_stored(tmp_path):
+    cache = open_cache(tmp_path)
+
+    cache.store('/a', {}, 'body')
+
+    assert cache.lookup('/a') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_replaced_response_is_counted_once(tmp_path):
+    cache = open_cache(tmp_path)
+
+    cache.store('/a', {'etag': '"1"'}, 'x' * 100)
+    cache.store('/a', {'etag': '"2"'}, 'x' * 30)
+
+    assert cache.lookup('/a')[0] == {'etag': '"2"'}
+    assert cache.stats()['size'] == 30
+
+
+def test_least_recently_used_are_evicted(tmp_path, clock):
+    cache = open_cache(tmp_path, max_bytes=100)
+
+    for url in ('/a', '/b', '/c'):
+        cache.store(url, {'etag': '"1"'}, 'x' * 30)
+    # /a is used again, /b is now the oldest
+    cache.revalidated('/a', cache.lookup('/a'), {})
+
+    cache.store('/d', {'etag': '"1"'}, 'x' * 30)
+
+    # Evicted down to 90 bytes
+    assert cache.lookup('/b') is None
+    assert all(cache.lookup(url) for url in ('/a', '/c', '/d'))
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size'] == 90
+
+
+def test_size_is_kept_across_runs(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.store('/a', {'etag': '"1"'}, 'x' * 40)
+    cache.close()
+
+    cache = open_cache(tmp_path)
+    assert cache.stats()['size'] == 40
+    assert cache.lookup('/a')[1] == 'x' * 40
@@ -0,0 +1,125 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from handlers.job_handler import (  # noqa: E402
+    MAX_ATTEMPTS,
+    JobHandler,
+)
+from handlers.sync_handler import SyncRunHandler  # noqa: E402
+
+ORG = 'org'
+
+
+@pytest.fixture
+def run(db):
+    """Queue two jobs of a new run, return its ID."""
+    run_id = SyncRunHandler(db).add(ORG)
+    assert JobHandler(db).add(run_id, ORG, [('repo1', 'issues'), ('repo2', 'issues')]) == 2
+    return run_id
+
+
+def expire(db, job_id: int):
+    db.execute("UPDATE sync_jobs SET leased_until = now() AT TIME ZONE 'UTC' "
+               "- interval '1 second' WHERE id = %s", (job_id,))
+
+
+def get_job(db, job_id: int) -> tuple:
+    db.execute('SELECT status, worker, attempts FROM sync_jobs WHERE id = %s', (job_id,))
+    return tuple(db.fetchone())
+
+
+def test_add_skips_queued_jobs(db, run):
+    jobs = JobHandler(db)
+
+    assert jobs.add(run, ORG, [('repo1', 'issues'), ('repo1', 'tags')]) == 1
+    assert jobs.count(ORG) == {'queued': 3}
+
+
+def test_claim_is_exclusive(db, connect, run):
+    # Workers on connections of their own, one's claim is in an open transaction
+    first = JobHandler(connect(db))
+    second = JobHandler(connect(db, autocommit=True))
+
+    job1 = first.claim(ORG, 'w1')
+    job2 = second.claim(ORG, 'w2')
+    first.cursor.connection.commit()
+
+    assert job1[1:] == (run, 'repo1', 'issues')
+    assert job2[1:] == (run, 'repo2', 'issues')
+    assert second.claim(ORG, 'w2') is None
+    assert second.claim('other', 'w2') is None
+
+
+def test_expired_lease_is_claimed_again(db, run):
+    jobs = JobHandler(db)
+
+    job_id = jobs.claim(ORG, 'w1')[0]
+    jobs.claim(ORG, 'w1')
+    assert jobs.claim(ORG, 'w2') is None
+
+    expire(db, job_id)
+    assert jobs.claim(ORG, 'w2')[0] == job_id
+    assert get_job(db, job_id) == ('running', 'w2', 2)
+
+    # The first worker has lost the job
+    assert jobs.extend({job_id: 'w1'}) == set()
+    assert not jobs.complete(job_id, 'w1')
+
+    assert jobs.extend({job_id: 'w2'}) == {job_id}
+    assert jobs.complete(job_id, 'w2')
+    assert get_job(db, job_id) == ('done', 'w2', 2)
+
+
+def test_expired_lease_is_given_up(db, run):
+    jobs = JobHandler(db)
+
+    job_id = jobs.claim(ORG, 'w1')[0]
+    for attempt in range(MAX_ATTEMPTS - 1):
+        expire(db, job_id)
+        assert jobs.claim(ORG, 'w%s' % attempt)[0] == job_id
+
+    # The other job is claimed instead
+    expire(db, job_id)
+    assert jobs.claim(ORG, 'w')[0] != job_id
+    assert get_job(db, job_id) == ('failed', None, MAX_ATTEMPTS)
+
+
+def test_fail_queues_job_again(db, run):
+    jobs = JobHandler(db)
+
+    job_id = jobs.claim(ORG, 'w1')[0]
+    jobs.fail(job_id, 'w1', 'error')
+    assert get_job(db, job_id) == ('queued', None, 1)
+
+    for attempt in range(MAX_ATTEMPTS - 1):
+        assert jobs.claim(ORG, 'w1')[0] == job_id
+        jobs.fail(job_id, 'w1', 'error')
+
+    assert get_job(db, job_id) == ('failed', None, MAX_ATTEMPTS)
+
+
+def test_release_does_not_count_attempt(db, run):
+    jobs = JobHandler(db)
+
+    job_id = jobs.claim(ORG, 'w1')[0]
+    jobs.release({job_id: 'w1'})
+
+    assert get_job(db, job_id) == ('queued', None, 0)
+
+
+def test_finish_run(db, run):
+    jobs = JobHandler(db)
+
+    job1 = jobs.claim(ORG, 'w1')[0]
+    job2 = jobs.claim(ORG, 'w1')[0]
+
+    jobs.complete(job1, 'w1')
+    assert not jobs.finish_run(run)
+
+    jobs.complete(job2, 'w1')
+    assert jobs.finish_run(run)
+    assert not jobs.finish_run(run)
+
+    db.execute('SELECT status FROM sync_runs WHERE id = %s', (run,))
+    assert db.fetchone()[0] == 'finished'
@@ -0,0 +1,63 @@
+from utils.metrics import (
+    Registry,
+    endpoint,
+    written_table,
+)
+
+
+def test_endpoint():
+    assert endpoint('/repos/org/x/issues/12/comments?page=3') == \
+        '/repos/{repo}/issues/{n}/comments'
+    assert endpoint('https://api.github.com/orgs/org/repos?page=2') == '/orgs/{name}/repos'
+    assert endpoint('/users/someone') == '/users/{name}'
+    assert endpoint('/repos/org/x/commits/%s/status' % ('0a' * 20)) == \
+        '/repos/{repo}/commits/{sha}/status'
+    # Branch names are kept, they are not numbers
+    assert endpoint('/repos/org/x/branches/v2') == '/repos/{repo}/branches/v2'
+
+
+def test_written_table():
+    assert written_table('INSERT INTO commits (id) VALUES (1)') == 'commits'
+    assert written_table('  update branches SET head_sha = %s') == 'branches'
+    assert written_table('DELETE FROM branches WHERE id = ANY(%s)') == 'branches'
+    assert written_table('SELECT id FROM repos') is None
+    # Their row count is the ID row, whether inserted or not
+    assert written_table('WITH ins AS (INSERT INTO repos (name) VALUES (%s) '
+                         'RETURNING id) SELECT id FROM ins') is None
+
+
+def test_write_prom(tmp_path):
+    registry = Registry()
+    registry.describe('api_requests_total', 'GitHub API requests')
+
+    with registry.scope(repo='x "y"'):
+        registry.inc('api_requests_total', 2, status=200)
+        registry.observe('stage_seconds', 0.02)
+        registry.observe('stage_seconds', 7)
+    registry.set('users_pending', 3)
+
+    path = str(tmp_path / 'gh_stats.prom')
+    registry.write_prom(path)
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    assert lines[:3] == [
+        '# HELP gh_stats_api_requests_total GitHub API requests',
+        '# TYPE gh_stats_api_requests_total counter',
+        'gh_stats_api_requests_total{repo="x \\"y\\"",status="200"} 2',
+    ]
+    assert '# TYPE gh_stats_users_pending gauge' in lines
+    assert 'gh_stats_users_pending 3' in lines
+
+    assert '# TYPE gh_stats_stage_seconds histogram' in lines
+    # Buckets are cumulative
+    assert 'gh_stats_stage_seconds_bucket{le="0.01",repo="x \\"y\\""} 0' in lines
+    assert 'gh_stats_stage_seconds_bucket{le="0.025",repo="x \\"y\\""} 1' in lines
+    assert 'gh_stats_stage_seconds_bucket{le="10",repo="x \\"y\\""} 2' in lines
+    assert 'gh_stats_stage_seconds_bucket{le="+Inf",repo="x \\"y\\""} 2' in lines
+    assert 'gh_stats_stage_seconds_sum{repo="x \\"y\\""} 7.02' in lines
+    assert 'gh_stats_stage_seconds_count{repo="x \\"y\\""} 2' in lines
+
+    # Replaced atomically, no temporary file is left
+    assert [p.name for p in tmp_path.iterdir()] == ['gh_stats.prom']
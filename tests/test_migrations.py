@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from utils.migrations import (  # noqa: E402
+    get_applied,
+    load_migrations,
+    migrate,
+)
+
+
+def test_load_migrations():
+    migrations = load_migrations()
+
+    assert [m.version for m in migrations] == sorted({m.version for m in migrations})
+    assert migrations[0].name == 'collector_schema'
+    assert migrations[0].transactional and migrations[0].feature is None
+
+    indexes = [m for m in migrations if m.name == 'indexes'][0]
+    assert not indexes.transactional
+    assert all('CONCURRENTLY' in s for s in indexes.statements())
+
+
+def test_migrate_baseline_database(baseline_db):
+    db = baseline_db
+
+    # Duplicates the baseline schema allowed
+    db.execute("INSERT INTO repos (name) VALUES ('repo') RETURNING id")
+    repo_id = db.fetchone()[0]
+    db.execute("INSERT INTO branches (name, repo_id) VALUES ('main', %s), ('main', %s) "
+               "RETURNING id", (repo_id, repo_id))
+    first, second = sorted(row[0] for row in db.fetchall())
+    db.execute("INSERT INTO commits (sha, repo_id, branch_id) VALUES ('a', %s, %s)",
+               (repo_id, second))
+    db.execute("INSERT INTO tags (name, repo_id) VALUES ('v1', %s), ('v1', %s)",
+               (repo_id, repo_id))
+
+    assert migrate(db.connection, verbose=False) == len(get_applied(db.connection))
+    assert migrate(db.connection, verbose=False) == 0
+
+    db.execute('SELECT branch_id FROM commits')
+    assert db.fetchone()[0] == first
+
+    db.execute('SELECT count(*) FROM tags')
+    assert db.fetchone()[0] == 1
+
+    # What the collector upserts relying on
+    db.execute("INSERT INTO branches (name, repo_id) VALUES ('main', %s) "
+               "ON CONFLICT (repo_id, name) DO NOTHING", (repo_id,))
+    db.execute("INSERT INTO tags (name, repo_id) VALUES ('v1', %s) "
+               "ON CONFLICT (repo_id, name) DO NOTHING", (repo_id,))
+
+    db.execute('SELECT head_sha, head_ts FROM branches')
+    db.execute('SELECT count(*) FROM sync_jobs')
+    db.execute('SELECT updated_at FROM ingestion_marker')
+
+
+def test_collector_schema_applies_again(db):
+    # Databases created with an older database.sql have some of it
+    db.execute(load_migrations()[0].sql)
@@ -0,0 +1,77 @@
+import pytest
+
+from utils.pages import iter_pages
+from utils.stopping import (
+    Stopped,
+    stopping,
+)
+
+
+class Listing():
+    """A listing of numbers that can be requested page by page."""
+
+    def __init__(self, total: int, per_page: int):
+        self.items = list(range(total))
+        self.per_page = per_page
+        self.requested = []
+
+    def get_page(self, page: int) -> list:
+        self.requested.append(page)
+        return self.items[page * self.per_page:(page + 1) * self.per_page]
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def test_iter_pages():
+    pages = list(iter_pages(iter(range(7)), per_page=3))
+
+    assert pages == [(0, [0, 1, 2]), (1, [3, 4, 5]), (2, [6])]
+
+
+def test_iter_pages_resumes_by_page():
+    listing = Listing(7, 3)
+
+    pages = list(iter_pages(listing, start=1, per_page=3))
+
+    # The first page is not requested
+    assert pages == [(1, [3, 4, 5]), (2, [6])]
+    assert listing.requested == [1, 2]
+
+
+def test_iter_pages_stops_at_full_last_page():
+    listing = Listing(6, 3)
+
+    assert list(iter_pages(listing, start=1, per_page=3)) == [(1, [3, 4, 5])]
+    assert listing.requested == [1, 2]
+
+
+def test_iter_pages_skips_pages_of_iterators():
+    # Not requested page by page, the items before start are iterated over
+    pages = list(iter_pages(iter(range(7)), start=2, per_page=3))
+
+    assert pages == [(2, [6])]
+
+
+def test_iter_pages_start_past_end():
+    assert list(iter_pages(iter(range(3)), start=2, per_page=3)) == []
+    assert list(iter_pages(Listing(3, 3), start=2, per_page=3)) == []
+
+
+@pytest.mark.parametrize('start', (0, 1))
+def test_iter_pages_stops_between_pages(start):
+    listing = Listing(9, 3)
+    pages = iter_pages(listing, start=start, per_page=3)
+
+    try:
+        assert next(pages) == (start, listing.items[start * 3:start * 3 + 3])
+
+        stopping.set()
+        with pytest.raises(Stopped):
+            next(pages)
+    finally:
+        stopping.clear()
+
+    if start:
+        # The next page is not requested
+        assert listing.requested == [1]
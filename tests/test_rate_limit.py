@@ -0,0 +1,177 @@
+import threading
+
+import pytest
+
+from utils import rate_limit
+from utils.rate_limit import (
+    MAX_BACKOFF,
+    MIN_BACKOFF,
+    RESERVE,
+    RateLimitScheduler,
+)
+from utils.stopping import (
+    Stopped,
+    stopping,
+)
+
+NOW = 1000000.0
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Freeze the time the scheduler sees, move it with clock['now']."""
+    clock = {'now': NOW}
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: clock['now'])
+    return clock
+
+
+def headers(remaining: int, limit=5000, reset=NOW + 3600, **extra) -> dict:
+    res = {'x-ratelimit-remaining': str(remaining), 'x-ratelimit-limit': str(limit),
+           'x-ratelimit-reset': str(reset)}
+    res.update(extra)
+    return res
+
+
+def test_acquire_picks_largest_budget():
+    scheduler = RateLimitScheduler(['a', 'b'])
+
+    budget, _ = scheduler.try_acquire()
+    scheduler.release(budget, 200, headers(100))
+    budget, _ = scheduler.try_acquire()
+    scheduler.release(budget, 200, headers(4000))
+
+    budgets = {b.token: b.remaining for b in scheduler.tokens}
+    best = max(budgets, key=budgets.get)
+
+    budget, wait = scheduler.try_acquire()
+    assert (budget.token, wait) == (best, 0)
+    # Counted before the response comes
+    assert budget.remaining == budgets[best] - 1
+    assert scheduler.in_flight == 1
+
+
+def test_exhausted_tokens_wait_for_reset(clock):
+    scheduler = RateLimitScheduler(['a'])
+
+    budget, _ = scheduler.try_acquire()
+    scheduler.release(budget, 200, headers(RESERVE, reset=NOW + 30))
+
+    assert scheduler.try_acquire() == (None, 30)
+
+    clock['now'] = NOW + 30
+    budget, wait = scheduler.try_acquire()
+    assert budget is not None and wait == 0
+
+
+def test_concurrency_is_throttled_when_budget_runs_low():
+    scheduler = RateLimitScheduler(['a', 'b'], max_concurrency=8)
+    assert scheduler.concurrency() == 8
+
+    for budget, remaining in zip(scheduler.tokens, (400, 100)):
+        budget.remaining, budget.limit = remaining, 1000
+
+    # 500 of 2000 is the throttling share, 250 is half of it
+    assert scheduler.concurrency() == 8
+    scheduler.tokens[0].remaining = 150
+    assert scheduler.concurrency() == 4
+
+    scheduler.tokens[0].remaining = scheduler.tokens[1].remaining = 0
+    assert scheduler.concurrency() == 1
+
+
+def test_in_flight_requests_are_limited():
+    scheduler = RateLimitScheduler(['a'], max_concurrency=2)
+
+    first, _ = scheduler.try_acquire()
+    scheduler.try_acquire()
+    assert scheduler.try_acquire() == (None, 0.1)
+
+    scheduler.release(first, 200, {})
+    assert scheduler.try_acquire()[0] is not None
+
+
+def test_release_detects_rate_limits(clock):
+    scheduler = RateLimitScheduler(['a'])
+
+    budget, _ = scheduler.try_acquire()
+    assert not scheduler.release(budget, 403, {}, 'Must have admin rights')
+    assert not scheduler.release(budget, 404, headers(0))
+
+    # Retry-After is obeyed
+    assert scheduler.release(budget, 429, {'retry-after': '7'})
+    assert budget.blocked_until == NOW + 7
+
+    # The primary limit blocks until the reset
+    assert scheduler.release(budget, 403, headers(0, reset=NOW + 100))
+    assert budget.blocked_until == NOW + 100
+
+
+def test_secondary_limit_backs_off():
+    scheduler = RateLimitScheduler(['a'])
+    budget = scheduler.tokens[0]
+
+    waits = []
+    for _ in range(6):
+        scheduler.in_flight += 1
+        assert scheduler.release(budget, 403, {}, 'You have exceeded a secondary rate limit')
+        waits.append(budget.blocked_until - NOW)
+
+    assert waits == [MIN_BACKOFF, MIN_BACKOFF * 2, MIN_BACKOFF * 4, MIN_BACKOFF * 8,
+                     MAX_BACKOFF, MAX_BACKOFF]
+
+    # A successful response resets it
+    scheduler.in_flight += 1
+    scheduler.release(budget, 200, {})
+    assert budget.backoff == 0
+
+
+def test_other_resources_keep_core_budget():
+    scheduler = RateLimitScheduler(['a'])
+
+    budget, _ = scheduler.try_acquire()
+    scheduler.release(budget, 200, headers(10, **{'x-ratelimit-resource': 'search'}))
+
+    assert budget.remaining is None
+
+
+def test_acquire_waits_for_release(clock):
+    scheduler = RateLimitScheduler(['a'], max_concurrency=1)
+    first = scheduler.acquire()
+
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(scheduler.acquire()))
+    thread.start()
+
+    scheduler.release(first, 200, {})
+    thread.join(5)
+
+    assert acquired == [first]
+    assert scheduler.budget()['in_flight'] == 1
+
+
+def test_waiting_threads_stop():
+    scheduler = RateLimitScheduler(['a'])
+
+    budget, _ = scheduler.try_acquire()
+    # Blocked for an hour
+    scheduler.release(budget, 403, headers(0))
+
+    errors = []
+
+    def acquire():
+        try:
+            scheduler.acquire()
+        except Stopped as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    try:
+        stopping.set()
+        scheduler.wake()
+        thread.join(5)
+    finally:
+        stopping.clear()
+
+    assert not thread.is_alive()
+    assert len(errors) == 1
@@ -0,0 +1,142 @@
+from datetime import (
+    datetime,
+    timezone,
+)
+
+from utils import recording
+from utils.payload import RawObject
+from utils.recording import (
+    RecordingGithub,
+    ReplayGithub,
+    read_settings,
+    since_filter,
+    write_settings,
+)
+
+REPO = {'name': 'repo/x', 'full_name': 'org/repo/x'}
+BRANCHES = [{'name': 'main', 'commit': {'sha': 'b'}},
+            {'name': 'feature/[1]', 'commit': {'sha': 'c'}}]
+COMMITS = {
+    'main': [{'sha': 'b', 'commit': {'committer': {'date': '2024-02-01T00:00:00Z'}}},
+             {'sha': 'a', 'commit': {'committer': {'date': '2024-01-01T00:00:00Z'}}}],
+    'feature/[1]': [{'sha': 'c', 'commit': {'committer': {'date': '2024-03-01T00:00:00Z'}}}],
+}
+ISSUES = [{'number': 1, 'state': 'open', 'updated_at': '2024-01-01T00:00:00Z'},
+          {'number': 2, 'state': 'closed', 'updated_at': '2024-02-01T00:00:00Z'}]
+COMMENTS = {1: [{'id': 10, 'issue_url': '/issues/1', 'updated_at': '2024-01-01T00:00:00Z'}],
+            2: []}
+TAGS = [{'name': 'v1', 'commit': {'sha': 'a'}}]
+
+
+class Issue(RawObject):
+    def get_comments(self):
+        return [RawObject(item) for item in COMMENTS[self.raw_data['number']]]
+
+
+class Repository(RawObject):
+    """The part of a PyGithub repository the recording wraps, without filters."""
+
+    def get_branches(self):
+        return [RawObject(item) for item in BRANCHES]
+
+    def get_commits(self, sha=None):
+        return [RawObject(item) for item in COMMITS[sha]]
+
+    def get_issues(self, state='open'):
+        return [Issue(item) for item in ISSUES]
+
+    def get_issues_comments(self):
+        return [RawObject(item) for items in COMMENTS.values() for item in items]
+
+    def get_tags(self):
+        return [RawObject(item) for item in TAGS]
+
+
+class Organization():
+    def get_repos(self):
+        return [Repository(REPO)]
+
+
+class Github():
+    def get_organization(self, org: str):
+        return Organization()
+
+
+def payloads(items) -> list:
+    return [item.raw_data for item in items]
+
+
+def test_since_filter():
+    items = [{'updated_at': '2024-01-01T00:00:00Z'},
+             {'updated_at': '2024-01-02T12:00:00+02:00'},
+             {'updated_at': None},
+             {'updated_at': '2024-01-03T00:00:00Z'}]
+
+    assert list(since_filter(items, 'updated_at', None)) == items
+    # Aware or naive, the time is UTC
+    since = datetime(2024, 1, 2, 10, tzinfo=timezone.utc)
+    assert list(since_filter(items, 'updated_at', since)) == items[1:]
+    assert list(since_filter(items, 'updated_at', datetime(2024, 1, 2, 11))) == items[2:]
+
+
+def test_since_filter_nested_field():
+    items = COMMITS['main']
+
+    since = datetime(2024, 1, 15)
+    assert list(since_filter(items, 'commit.committer.date', since)) == items[:1]
+    assert list(since_filter([{'commit': None}], 'commit.committer.date', since)) == [
+        {'commit': None}]
+
+
+def test_record_and_replay(tmp_path, monkeypatch):
+    # Listings span several segments
+    monkeypatch.setattr(recording, 'SEGMENT_SIZE', 1)
+    directory = str(tmp_path)
+
+    gh = RecordingGithub(Github(), directory)
+    for repo in gh.get_organization('org').get_repos():
+        for branch in repo.get_branches():
+            list(repo.get_commits(sha=branch.name))
+        for issue in repo.get_issues(state='all'):
+            list(issue.get_comments())
+        list(repo.get_issues_comments())
+        list(repo.get_tags())
+
+    replay = ReplayGithub(directory)
+    repos = list(replay.get_organization('org').get_repos())
+    assert payloads(repos) == [REPO]
+
+    repo = replay.get_repo('org/repo/x')
+    assert payloads(repo.get_branches()) == BRANCHES
+    for name, commits in COMMITS.items():
+        assert payloads(repo.get_commits(sha=name)) == commits
+    assert payloads(repo.get_tags()) == TAGS
+
+    issues = list(repo.get_issues(state='all'))
+    assert payloads(issues) == ISSUES
+    assert [payloads(issue.get_comments()) for issue in issues] == [COMMENTS[1], []]
+    assert payloads(repo.get_issues_comments()) == COMMENTS[1]
+
+
+def test_replay_filters_like_the_api(tmp_path):
+    directory = str(tmp_path)
+
+    repo = RecordingGithub(Github(), directory).get_organization('org')
+    repo = next(iter(repo.get_repos()))
+    list(repo.get_commits(sha='main'))
+    list(repo.get_issues(state='all'))
+
+    repo = ReplayGithub(directory).get_repo('org/repo/x')
+    assert payloads(repo.get_issues()) == ISSUES[:1]
+    assert payloads(repo.get_issues(state='all', since=datetime(2024, 1, 15))) == ISSUES[1:]
+    assert payloads(repo.get_commits(sha='main', since=datetime(2024, 1, 15))) == \
+        COMMITS['main'][:1]
+
+
+def test_settings(tmp_path):
+    directory = str(tmp_path)
+    # Recorded before settings were saved
+    assert read_settings(directory) is None
+
+    write_settings(directory, {'comment_sweep': True})
+    assert read_settings(directory) == {'comment_sweep': True}
@@ -0,0 +1,115 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from handlers import stats_handler  # noqa: E402
+from handlers.commit_handler import CommitHandler  # noqa: E402
+from handlers.stats_handler import (  # noqa: E402
+    StatsHandler,
+    add_commits,
+)
+
+DAY1 = datetime(2024, 1, 1)
+DAY2 = datetime(2024, 1, 2)
+DAY3 = datetime(2024, 1, 3)
+
+
+@pytest.fixture
+def repo(db) -> dict:
+    """Add a repo with two branches and two contributors, return their IDs."""
+    ids = {}
+    db.execute("INSERT INTO repos (name) VALUES ('repo') RETURNING id")
+    ids['repo'] = db.fetchone()[0]
+
+    for branch in ('main', 'devel'):
+        db.execute('INSERT INTO branches (name, repo_id) VALUES (%s, %s) RETURNING id',
+                   (branch, ids['repo']))
+        ids[branch] = db.fetchone()[0]
+
+    for login in ('alice', 'bob'):
+        db.execute('INSERT INTO contributors (login) VALUES (%s) RETURNING id', (login,))
+        ids[login] = db.fetchone()[0]
+
+    return ids
+
+
+def get_stats(db, repo_id: int) -> tuple:
+    db.execute('SELECT commit_cnt, latest_commit_ts FROM repo_stats WHERE repo_id = %s',
+               (repo_id,))
+    repo_stats = tuple(db.fetchone())
+
+    db.execute('SELECT author_id, commit_cnt, last_commit_ts FROM repo_contributor_stats '
+               'WHERE repo_id = %s ORDER BY author_id', (repo_id,))
+    return repo_stats, [tuple(row) for row in db.fetchall()]
+
+
+def count_stats(db, repo_id: int) -> tuple:
+    db.execute('SELECT count(*), max(ts) FROM commits WHERE repo_id = %s', (repo_id,))
+    repo_stats = tuple(db.fetchone())
+
+    db.execute('SELECT author_id, count(*), max(ts) FROM commits '
+               'WHERE repo_id = %s AND author_id IS NOT NULL '
+               'GROUP BY author_id ORDER BY author_id', (repo_id,))
+    return repo_stats, [tuple(row) for row in db.fetchall()]
+
+
+def test_add_commits_aggregates(monkeypatch):
+    statements = []
+    monkeypatch.setattr(stats_handler, 'exec_values_in_db',
+                        lambda cursor, query, rows: statements.append(rows))
+
+    add_commits(None, [(2, 10, DAY1), (1, 10, DAY2), (2, 11, DAY3),
+                       (2, 10, DAY2), (2, None, DAY1)])
+
+    # A row per repo and per author, the latest time of each
+    assert statements == [
+        [(1, 1, DAY2), (2, 4, DAY3)],
+        [(1, 10, 1, DAY2), (2, 10, 2, DAY2), (2, 11, 1, DAY3)],
+    ]
+
+
+def test_add_commits_without_authors(monkeypatch):
+    statements = []
+    monkeypatch.setattr(stats_handler, 'exec_values_in_db',
+                        lambda cursor, query, rows: statements.append(rows))
+
+    add_commits(None, [(1, None, DAY1)])
+    add_commits(None, [])
+
+    assert statements == [[(1, 1, DAY1)]]
+
+
+def test_written_commits_are_counted_once(db, repo):
+    writer = CommitHandler(db).writer
+
+    writer.add(('a1', repo['alice'], repo['repo'], DAY1, repo['main']))
+    writer.add(('b1', repo['bob'], repo['repo'], DAY2, repo['main']))
+    writer.add(('n1', None, repo['repo'], DAY1, repo['main']))
+    writer.flush()
+
+    # Already stored, from another branch
+    writer.add(('a1', repo['alice'], repo['repo'], DAY1, repo['devel']))
+    writer.add(('a2', repo['alice'], repo['repo'], DAY3, repo['devel']))
+    writer.flush()
+
+    assert get_stats(db, repo['repo']) == (
+        (4, DAY3), [(repo['alice'], 2, DAY3), (repo['bob'], 1, DAY2)])
+    assert get_stats(db, repo['repo']) == count_stats(db, repo['repo'])
+
+
+def test_refresh_latest_tag(db, repo):
+    writer = CommitHandler(db).writer
+    writer.add(('a1', repo['alice'], repo['repo'], DAY1, repo['main']))
+    writer.add(('a2', repo['alice'], repo['repo'], DAY2, repo['main']))
+    writer.flush()
+
+    db.execute("INSERT INTO tags (name, repo_id, commit_id) "
+               "SELECT 'v' || sha, repo_id, id FROM commits")
+
+    stats = StatsHandler(db)
+    stats.refresh_latest_tag(repo['repo'])
+
+    db.execute('SELECT latest_tag_ts FROM repo_stats WHERE repo_id = %s', (repo['repo'],))
+    assert db.fetchone()[0] == DAY2
@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from handlers.sync_handler import (  # noqa: E402
+    RepoCheckpoints,
+    StageCheckpoint,
+    SyncRunHandler,
+)
+
+ORG = 'org'
+
+
+@pytest.fixture
+def repo_id(db) -> int:
+    db.execute("INSERT INTO repos (name) VALUES ('repo') RETURNING id")
+    return db.fetchone()[0]
+
+
+def test_get_id_of_unfinished_run(db):
+    runs = SyncRunHandler(db)
+    assert runs.get_id(ORG) is None
+
+    run_id = runs.add(ORG)
+    assert runs.get_id(ORG) == run_id
+    assert runs.get_id('other') is None
+
+    runs.set_status(run_id, 'interrupted')
+    assert runs.get_id(ORG) == run_id
+
+    runs.finish(run_id)
+    assert runs.get_id(ORG) is None
+
+
+def test_add_abandons_unfinished_runs(db, repo_id):
+    runs = SyncRunHandler(db)
+
+    old_id = runs.add(ORG)
+    RepoCheckpoints(db, old_id, repo_id).save('issues', {'page': 3})
+
+    run_id = runs.add(ORG)
+    assert runs.get_id(ORG) == run_id
+    assert RepoCheckpoints(db, old_id, repo_id).stages == {}
+
+    db.execute('SELECT status FROM sync_runs WHERE id = %s', (old_id,))
+    assert db.fetchone()[0] == 'abandoned'
+
+
+def test_checkpoints_resume(db, repo_id):
+    runs = SyncRunHandler(db)
+    run_id = runs.add(ORG)
+
+    checkpoints = RepoCheckpoints(db, run_id, repo_id)
+    StageCheckpoint(checkpoints, 'issues').save({'page': 5, 'since': None})
+    checkpoints.done('branches')
+
+    # Read again as a resumed run does
+    checkpoints = RepoCheckpoints(db, run_id, repo_id)
+    assert checkpoints.is_done('branches')
+    assert not checkpoints.is_done('issues')
+    assert checkpoints.get_state('issues') == {'page': 5, 'since': None}
+
+    # One page before the saved one
+    assert StageCheckpoint(checkpoints, 'issues').resume_page() == 4
+    assert StageCheckpoint(checkpoints, 'tags').resume_page() == 0
+
+    checkpoints.done('issues')
+    assert RepoCheckpoints(db, run_id, repo_id).is_done('issues')
+    assert RepoCheckpoints(db, run_id, repo_id).get_state('issues') == {}
+
+
+def test_resume_page_of_first_page(db, repo_id):
+    run_id = SyncRunHandler(db).add(ORG)
+    checkpoints = RepoCheckpoints(db, run_id, repo_id)
+    checkpoints.save('issues', {'page': 0})
+
+    assert StageCheckpoint(checkpoints, 'issues').resume_page() == 0
+
+
+def test_done_repos(db, repo_id):
+    runs = SyncRunHandler(db)
+    run_id = runs.add(ORG)
+
+    checkpoints = RepoCheckpoints(db, run_id, repo_id)
+    checkpoints.done('issues')
+    assert runs.get_done_repos(run_id) == set()
+
+    checkpoints.done('repo')
+    assert runs.get_done_repos(run_id) == {repo_id}
+
+    # Finished runs keep no checkpoints
+    runs.finish(run_id)
+    assert runs.get_done_repos(run_id) == set()
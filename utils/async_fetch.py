@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+
+import asyncio
+import json
+import re
+import time
+
+from datetime import datetime
+from urllib.parse import urlencode
+
+from utils import metrics
+from utils.http_cache import HttpCache
+from utils.payload import RawObject
+from utils.rate_limit import (
+    MAX_RETRIES,
+    RateLimitScheduler,
+)
+from utils.timestamps import format_ts
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+API_URL = 'https://api.github.com'
+
+# The maximum page size the GitHub REST API allows
+PER_PAGE = 100
+
+LAST_PAGE_RE = re.compile(r'[?&]page=(\d+)[^>]*>;\s*rel="last"')
+
+
+class FetchError(Exception):
+    def __init__(self, status: int, url: str, message: str):
+        super().__init__('%s %s: %s' % (status, url, message))
+        self.status = status
+
+
+class AsyncFetcher():
+    """Fetch GitHub API listings with asyncio.
+
+    The first page of a listing tells from its Link header how many
+    pages there are, the rest are requested concurrently.
+    Not thread-safe: every thread needs its own fetcher.
+    """
+
+    def __init__(self, token: str, base_url=API_URL, concurrency=8,
+                 scheduler: RateLimitScheduler = None, cache: HttpCache = None):
+        if not HAS_AIOHTTP:
+            raise ImportError('asynchronous fetching requires aiohttp, '
+                              'run "pip3 install aiohttp"')
+
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.headers = {
+            'Accept': 'application/vnd.github.v3+json',
+            'Authorization': 'token %s' % token,
+        }
+        # When set, it picks the token for every request
+        self.scheduler = scheduler
+        # When set, requests of cached URLs are made conditional
+        self.cache = cache
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+
+    def close(self):
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+        self.loop.close()
+
+    async def _get(self, url: str, params=None):
+        """Request a URL.
+
+        Returns a tuple (decoded body, response headers with lower-case keys).
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession(headers=self.headers)
+
+        cache_key = None
+        cached = None
+        if self.cache is not None:
+            cache_key = url
+            if params:
+                cache_key += '?' + urlencode(sorted(params.items()))
+            cached = self.cache.lookup(cache_key)
+
+        for attempt in range(MAX_RETRIES + 1):
+            budget = None
+            headers = {}
+
+            if cached is not None:
+                headers.update(self.cache.validators(cached))
+
+            if self.scheduler is not None:
+                budget, wait = self.scheduler.try_acquire()
+                while budget is None:
+                    await asyncio.sleep(wait)
+                    budget, wait = self.scheduler.try_acquire()
+
+                headers['Authorization'] = 'token %s' % budget.token
+
+            started = time.monotonic()
+            try:
+                async with self.session.get(url, params=params, headers=headers) as resp:
+                    status = resp.status
+                    body = await resp.text()
+                    resp_headers = {k.lower(): v for k, v in resp.headers.items()}
+            except BaseException:
+                # No response to update the budget from, only free the slot
+                if budget is not None:
+                    self.scheduler.release(budget, 0, {})
+                raise
+
+            metrics.record_request(url, status, time.monotonic() - started)
+
+            if self.scheduler is not None:
+                limited = self.scheduler.release(
+                    budget, status, resp_headers,
+                    body if status in (403, 429) else '')
+
+                if limited and attempt < MAX_RETRIES:
+                    continue
+
+            if status == 304 and cached is not None:
+                cached_resp = self.cache.revalidated(cache_key, cached, resp_headers)
+                return json.loads(cached_resp.body), cached_resp.headers
+
+            if status >= 400:
+                raise FetchError(status, url, body)
+
+            if cache_key is not None and status == 200:
+                self.cache.store(cache_key, resp_headers, body)
+
+            return json.loads(body), resp_headers
+
+    def get(self, path: str, params=None):
+        """Get a single object or page."""
+        url = path if path.startswith('http') else self.base_url + path
+        data, _ = self.loop.run_until_complete(self._get(url, params))
+        return data
+
+    def iter_items(self, path: str, params=None):
+        """Yield items of a listing as plain dicts, in the listing's order.
+
+        Pages after the first are requested in windows of `concurrency`
+        pages, so a consumer that stops early does not cost the whole
+        listing and memory stays bounded.
+        """
+        url = path if path.startswith('http') else self.base_url + path
+        params = dict(params or {}, per_page=PER_PAGE)
+
+        data, headers = self.loop.run_until_complete(
+            self._get(url, dict(params, page=1)))
+        yield from data
+
+        match = LAST_PAGE_RE.search(headers.get('link', ''))
+        last_page = int(match.group(1)) if match else 1
+
+        page = 2
+        while page <= last_page:
+            concurrency = self.concurrency
+            if self.scheduler is not None:
+                # Fewer pages at once when the budget runs low
+                concurrency = min(concurrency, self.scheduler.concurrency())
+
+            window = range(page, min(page + concurrency, last_page + 1))
+
+            pages = self.loop.run_until_complete(asyncio.gather(
+                *(self._get(url, dict(params, page=n)) for n in window)))
+
+            for data, _ in pages:
+                yield from data
+
+            page = window.stop
+
+
+class RawList():
+    """Iterable over a listing, every iteration requests it again."""
+
+    def __init__(self, fetcher: AsyncFetcher, path: str, params=None,
+                 wrap=RawObject):
+        self.fetcher = fetcher
+        self.path = path
+        self.params = {k: v for k, v in (params or {}).items() if v is not None}
+        self.wrap = wrap
+
+    def __iter__(self):
+        for item in self.fetcher.iter_items(self.path, self.params):
+            yield self.wrap(item)
+
+    def get_page(self, page: int) -> list:
+        """Get a single page of PER_PAGE items, numbered from 0 as in PyGithub."""
+        params = dict(self.params, per_page=PER_PAGE, page=page + 1)
+        return [self.wrap(item) for item in self.fetcher.get(self.path, params)]
+
+
+def since_param(since: datetime) -> str:
+    return format_ts(since) if since is not None else None
+
+
+class RawIssue(RawObject):
+    def __init__(self, data: dict, fetcher: AsyncFetcher):
+        super().__init__(data)
+        self.fetcher = fetcher
+
+    def get_comments(self):
+        return RawList(self.fetcher, self.raw_data['comments_url'])
+
+
+class RawRepository(RawObject):
+    """Provides the part of PyGithub's Repository API the handlers use."""
+
+    def __init__(self, data: dict, fetcher: AsyncFetcher):
+        super().__init__(data)
+        self.fetcher = fetcher
+        self.path = '/repos/%s' % data['full_name']
+
+    def get_branches(self) -> list:
+        # Branches are iterated more than once, keep them
+        return list(RawList(self.fetcher, self.path + '/branches'))
+
+    def get_commits(self, sha=None, since=None):
+        params = {'sha': sha, 'since': since_param(since)}
+        return RawList(self.fetcher, self.path + '/commits', params)
+
+    def get_issues(self, state='open', since=None):
+        params = {'state': state, 'since': since_param(since)}
+        return RawList(self.fetcher, self.path + '/issues', params,
+                       wrap=lambda item: RawIssue(item, self.fetcher))
+
+    def get_issues_comments(self, since=None):
+        params = {'since': since_param(since)}
+        return RawList(self.fetcher, self.path + '/issues/comments', params)
+
+    def get_tags(self):
+        return RawList(self.fetcher, self.path + '/tags')
+
+
+class RawOrganization(RawObject):
+    def __init__(self, data: dict, fetcher: AsyncFetcher):
+        super().__init__(data)
+        self.fetcher = fetcher
+
+    def get_repos(self):
+        return RawList(self.fetcher, '/orgs/%s/repos' % self.raw_data['login'],
+                       {'type': 'all'},
+                       wrap=lambda item: RawRepository(item, self.fetcher))
+
+
+class AsyncGithub():
+    """Drop-in replacement for the github.Github object used by the collector."""
+
+    def __init__(self, token: str, base_url=API_URL, concurrency=8,
+                 scheduler: RateLimitScheduler = None, cache: HttpCache = None):
+        self.fetcher = AsyncFetcher(token, base_url=base_url,
+                                    concurrency=concurrency,
+                                    scheduler=scheduler, cache=cache)
+
+    def get_organization(self, org: str) -> RawOrganization:
+        return RawOrganization(self.fetcher.get('/orgs/%s' % org), self.fetcher)
+
+    def get_repo(self, full_name: str) -> RawRepository:
+        return RawRepository(self.fetcher.get('/repos/%s' % full_name),
+                             self.fetcher)
+
+    def get_user(self, login: str) -> RawObject:
+        return RawObject(self.fetcher.get('/users/%s' % login))
+
+    def close(self):
+        self.fetcher.close()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+import sys
+
+from psycopg2 import (
+    DataError,
+    IntegrityError,
+)
+from psycopg2.errors import ForeignKeyViolation
+from psycopg2.extensions import cursor as PgCursor
+
+from utils import (
+    id_cache,
+    metrics,
+)
+from utils.connection import (
+    StatementError,
+    exec_values_in_db,
+    savepoint,
+)
+from utils.write_pipeline import WritePipeline
+
+# Errors caused by the rows written, not by the database or the statement
+ROW_ERRORS = (DataError, IntegrityError)
+
+
+def check_row_error(e: StatementError):
+    """Raise the error unless it is caused by a row, which can be skipped.
+
+    A row referencing a missing row is not skipped: the ID it has
+    can come from the caches and be stale, e.g. of a branch another
+    process has removed. The caches are cleared, so that the IDs
+    are resolved again when the stage is run again.
+    """
+    if isinstance(e.error, ForeignKeyViolation):
+        id_cache.clear()
+        raise e
+
+    if not isinstance(e.error, ROW_ERRORS):
+        raise e
+
+
+def write_rows(cursor: PgCursor, statement: str, rows: list, table: str,
+               fetch=False) -> list:
+    """Write rows with a multi-row statement.
+
+    If the rows are rejected, e.g. one of them breaks a constraint,
+    they are written one by one and the bad ones are skipped,
+    so that a single bad row does not stop the run. Rows referencing
+    missing rows raise StatementError, see check_row_error().
+    """
+    try:
+        with savepoint(cursor):
+            return exec_values_in_db(cursor, statement, rows, fetch=fetch)
+    except StatementError as e:
+        check_row_error(e)
+
+    res = []
+    for row in rows:
+        try:
+            with savepoint(cursor):
+                res += exec_values_in_db(cursor, statement, [row], fetch=fetch)
+        except StatementError as e:
+            check_row_error(e)
+
+            print('Skipped a row of %s %s: %s' % (table, row, e.error), file=sys.stderr)
+            metrics.registry.inc('db_rows_skipped_total', table=table)
+
+    return res
+
+
+class BatchWriter():
+    """Gather rows of a table and write them with multi-row INSERTs.
+
+    Each flush is a single statement, i.e. one network round trip
+    and, when the connection is in autocommit mode, one commit.
+    """
+
+    def __init__(self, cursor: PgCursor, table: str, columns: tuple,
+                 on_conflict='', key=None, batch_size=1000, parents=(),
+                 pipeline: WritePipeline = None, returning='', on_written=None):
+        """
+        on_conflict - ON CONFLICT clause appended to the INSERT statement.
+        key - index of the column identifying a row; when set, a row added
+              twice before a flush is written once, with its latest values
+              (ON CONFLICT DO UPDATE cannot affect a row twice).
+        parents - writers referenced via foreign keys by this one's rows,
+                  they are flushed first.
+        pipeline - when set, flushes are written through it, in its
+                   transaction, and sync() must be called before
+                   relying on the rows.
+        returning - RETURNING clause appended to the INSERT statement.
+        on_written - when set, called as on_written(cursor, returned rows)
+                     after each flush, with the cursor that has written
+                     the rows, i.e. in the same transaction.
+        """
+        self.cursor = cursor
+        self.write_rows = write_rows
+        self.table = table
+        self.columns = columns
+        self.key = key
+        self.batch_size = batch_size
+        self.parents = list(parents)
+        self.pipeline = pipeline
+        self.on_written = on_written
+        self.rows = {} if key is not None else []
+        self.query = ('INSERT INTO %s (%s) VALUES %%s %s %s' % (
+                      table, ', '.join(columns), on_conflict, returning)).strip()
+
+    def add(self, row: tuple):
+        if self.key is not None:
+            self.rows[row[self.key]] = row
+        else:
+            self.rows.append(row)
+
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> list:
+        """Write gathered rows to the database."""
+        for parent in self.parents:
+            parent.flush()
+
+        if not self.rows:
+            return []
+
+        if self.key is not None:
+            rows = list(self.rows.values())
+            self.rows = {}
+        else:
+            rows = self.rows
+            self.rows = []
+
+        if self.pipeline is not None:
+            self.pipeline.submit(self.__write, rows)
+            return []
+
+        return self.__write(self.cursor, rows)
+
+    def __write(self, cursor: PgCursor, rows: list) -> list:
+        res = self.write_rows(cursor, self.query, rows, self.table,
+                              fetch=self.on_written is not None)
+        if self.on_written is not None and res:
+            self.on_written(cursor, res)
+        return res
+
+    def sync(self):
+        """Flush and wait until the rows are written and committed."""
+        self.flush()
+
+        for writer in [self] + self.parents:
+            if writer.pipeline is not None:
+                writer.pipeline.wait()
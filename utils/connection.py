@@ -1,10 +1,19 @@
 #!/usr/bin/python3
 
 import sys
+import time
+
+from contextlib import contextmanager
 
 from psycopg2 import connect
 from psycopg2.extensions import cursor
-from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import (
+    DictCursor,
+    execute_values,
+)
+
+from utils import metrics
 
 
 def connect_to_db(database: str, user: str, password: str, autocommit=False) -> (connect, cursor):
@@ -32,17 +41,104 @@ def connect_to_db(database: str, user: str, password: str, autocommit=False) ->
     return conn, conn.cursor(cursor_factory=DictCursor)
 
 
+def create_pool(database: str, user: str, password: str,
+                size: int) -> ThreadedConnectionPool:
+    """Create a pool of up to size connections to share between threads."""
+    try:
+        pool = ThreadedConnectionPool(1, size,
+                                      host='localhost',
+                                      database=database,
+                                      user=user,
+                                      password=password)
+    except Exception as e:
+        print('Unable to connect to the database: %s' % e, file=sys.stderr)
+        sys.exit(1)
+
+    return pool
+
+
+@contextmanager
+def pooled_cursor(pool: ThreadedConnectionPool, autocommit=False) -> cursor:
+    """Take a connection from the pool for the time of the with block.
+
+    Yields a cursor of the connection.
+    """
+    conn = pool.getconn()
+    try:
+        conn.set_session(autocommit=autocommit)
+        yield conn.cursor(cursor_factory=DictCursor)
+    finally:
+        pool.putconn(conn)
+
+
+class StatementError(Exception):
+    """A statement has failed, error is the exception raised by psycopg2."""
+
+    def __init__(self, statement: str, error: Exception):
+        super().__init__('Cannot execute statement: %s' % error)
+        self.statement = statement
+        self.error = error
+
+
+@contextmanager
+def savepoint(curs: cursor, name='batch'):
+    """Undo only the statements of the with block if one of them fails.
+
+    The transaction goes on. In autocommit mode every statement
+    is a transaction of its own, nothing is needed.
+    """
+    if curs.connection.autocommit:
+        yield
+        return
+
+    curs.execute('SAVEPOINT %s' % name)
+    try:
+        yield
+    except BaseException:
+        curs.execute('ROLLBACK TO SAVEPOINT %s' % name)
+        raise
+
+    curs.execute('RELEASE SAVEPOINT %s' % name)
+
+
 def exec_in_db(curs: cursor, statement: str,
                args=(), ret_all=True) -> list:
-    """Execute a statement in a database."""
+    """Execute a statement in a database.
+
+    Raises StatementError if it fails, outside of autocommit mode
+    the transaction must be rolled back then.
+    """
     try:
+        start = time.monotonic()
         curs.execute(statement, args)
+        metrics.record_statement(statement, time.monotonic() - start, curs.rowcount)
 
         if ret_all:
             return curs.fetchall()
 
     except Exception as e:
-        print('Cannot execute statement: %s' % e, file=sys.stderr)
-        sys.exit(1)
+        raise StatementError(statement, e) from e
+
+    return []
+
+
+def exec_values_in_db(curs: cursor, statement: str,
+                      rows: list, fetch=False) -> list:
+    """Execute a multi-row statement in a database.
+
+    The statement must contain a single "VALUES %s" placeholder.
+    All the rows are sent in one statement. Raises StatementError if it fails.
+    """
+    try:
+        start = time.monotonic()
+        res = execute_values(curs, statement, rows, page_size=len(rows),
+                             fetch=fetch)
+        metrics.record_statement(statement, time.monotonic() - start, curs.rowcount)
+
+        if res:
+            return res
+
+    except Exception as e:
+        raise StatementError(statement, e) from e
 
     return []
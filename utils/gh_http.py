@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+import time
+
+from github.Requester import (
+    HTTPRequestsConnectionClass,
+    HTTPSRequestsConnectionClass,
+    Requester,
+)
+
+from utils import metrics
+from utils.http_cache import HttpCache
+from utils.rate_limit import (
+    MAX_RETRIES,
+    RateLimitScheduler,
+)
+
+
+class GitHubConnectionMixin():
+    """Sit underneath every request PyGithub sends.
+
+    - Every request is sent with the token the scheduler picks,
+      requests that hit a rate limit are sent again once allowed.
+    - When the cache is set, GET requests of cached URLs are made
+      conditional and 304 answers are served from the cache.
+    """
+
+    scheduler = None
+    cache = None
+
+    def request(self, verb, url, input, headers):
+        self._request_args = (verb, url, input, headers)
+
+        self._cache_key = None
+        self._cached = None
+        if self.cache is not None and verb == 'GET':
+            self._cache_key = '%s%s' % (self.host, url)
+            self._cached = self.cache.lookup(self._cache_key)
+            if self._cached is not None:
+                headers.update(self.cache.validators(self._cached))
+
+        self._send()
+
+    def _send(self):
+        verb, url, input, headers = self._request_args
+
+        self._budget = self.scheduler.acquire()
+        headers['Authorization'] = 'token %s' % self._budget.token
+
+        self._started = time.monotonic()
+        try:
+            super().request(verb, url, input, headers)
+        except BaseException:
+            self._release_failed()
+            raise
+
+    def _release_failed(self):
+        # No response to update the budget from, only free the slot
+        self.scheduler.release(self._budget, 0, {})
+
+    def getresponse(self):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = super().getresponse()
+                headers = {k.lower(): v for k, v in response.getheaders()}
+                body = response.read() if response.status in (403, 429) else ''
+            except BaseException:
+                self._release_failed()
+                raise
+
+            metrics.record_request(self._request_args[1], response.status,
+                                   time.monotonic() - self._started)
+
+            limited = self.scheduler.release(self._budget, response.status,
+                                             headers, body or '')
+            if not limited or attempt == MAX_RETRIES:
+                return self._use_cache(response, headers)
+
+            self._send()
+
+    def _use_cache(self, response, headers: dict):
+        if self._cache_key is None:
+            return response
+
+        if response.status == 304 and self._cached is not None:
+            return self.cache.revalidated(self._cache_key, self._cached, headers)
+
+        if response.status == 200:
+            self.cache.store(self._cache_key, headers, response.read())
+
+        return response
+
+
+class GitHubHTTPSConnection(GitHubConnectionMixin, HTTPSRequestsConnectionClass):
+    pass
+
+
+class GitHubHTTPConnection(GitHubConnectionMixin, HTTPRequestsConnectionClass):
+    pass
+
+
+def install(scheduler: RateLimitScheduler, cache: HttpCache = None):
+    """Make every Github object created afterwards use the scheduler and cache."""
+    GitHubConnectionMixin.scheduler = scheduler
+    GitHubConnectionMixin.cache = cache
+
+    Requester.injectConnectionClasses(GitHubHTTPConnection,
+                                      GitHubHTTPSConnection)
@@ -1,10 +1,23 @@
 #!/usr/bin/python3
 # Copyright: (c) 2021, Andrew Klychkov (@Andersson007) <aklychko@redhat.com>
 
+import os
 import sys
 
 from argparse import ArgumentParser, Namespace
 from configparser import ConfigParser
+from datetime import timedelta
+from threading import Lock
+
+from utils.async_fetch import (
+    API_URL,
+    HAS_AIOHTTP,
+)
+from utils.recording import read_settings
+from utils.write_pipeline import QUEUE_SIZE
+
+# Profiles of deferred users requested per run by default
+USER_REQUESTS = 1000
 
 
 def get_cli_args():
@@ -17,7 +30,12 @@ def get_cli_args():
 
     # Access token
     parser.add_argument('-t', '--token', dest='token',
-                        help='GitHub access token', metavar='TOKEN')
+                        help='GitHub access token or comma-separated list of tokens '
+                             'to spread requests over', metavar='TOKEN')
+
+    parser.add_argument('--base-url', dest='base_url', default=API_URL,
+                        help='GitHub API URL (default %s)' % API_URL,
+                        metavar='URL')
 
     # GH organization
     parser.add_argument('-o', '--org', dest='org',
@@ -47,6 +65,99 @@ def get_cli_args():
                         help='Fetch issues only',
                         action='store_true')
 
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1,
+                        help='Number of repos to collect in parallel (default 1)',
+                        metavar='N')
+
+    async_msg = ('Fetch from GitHub with asyncio, requesting pages of '
+                 'a listing concurrently (requires aiohttp)')
+    parser.add_argument('--async-fetch', dest='async_fetch',
+                        help=async_msg, action='store_true')
+
+    parser.add_argument('--fetch-concurrency', dest='fetch_concurrency',
+                        type=int, default=8, metavar='N',
+                        help='Number of pages requested concurrently by '
+                             '--async-fetch (default 8)')
+
+    cache_msg = ('Directory or file to keep GitHub responses in; cached URLs '
+                 'are requested conditionally, unchanged ones do not count '
+                 'against the rate limit')
+    parser.add_argument('--http-cache', dest='http_cache',
+                        help=cache_msg, metavar='PATH')
+
+    parser.add_argument('--http-cache-size', dest='http_cache_size',
+                        type=int, default=512, metavar='MB',
+                        help='Maximum size of the HTTP cache (default 512)')
+
+    parser.add_argument('--record', dest='record', metavar='DIR',
+                        help='Write raw GitHub payloads to DIR as compressed '
+                             'JSON lines per repo and endpoint; everything is '
+                             'requested, as against an empty database')
+
+    parser.add_argument('--overwrite', dest='overwrite', action='store_true',
+                        help='Replace the recording already in the --record directory')
+
+    parser.add_argument('--replay', dest='replay', metavar='DIR',
+                        help='Ingest payloads recorded with --record from DIR '
+                             'instead of requesting GitHub; --comment-sweep must '
+                             'be passed if it was passed to --record')
+
+    sweep_msg = ('Fetch comments with one repo-wide listing instead of '
+                 'requesting comments of every changed issue')
+    parser.add_argument('--comment-sweep', dest='comment_sweep',
+                        help=sweep_msg, action='store_true')
+
+    defer_msg = ('Store users with the fields listings give, without requesting '
+                 'their profiles while collecting; names and emails are '
+                 'fetched afterwards, see --user-requests')
+    parser.add_argument('--defer-users', dest='defer_users',
+                        help=defer_msg, action='store_true')
+
+    users_msg = ('Maximum number of user profiles requested after collecting '
+                 'to fill in users stored with --defer-users, 0 to leave them '
+                 'for later runs (default %s)' % USER_REQUESTS)
+    parser.add_argument('--user-requests', dest='user_requests', type=int,
+                        default=USER_REQUESTS, help=users_msg, metavar='N')
+
+    queue_msg = ('Number of batches waiting to be written to the database by a '
+                 'writer thread while fetching goes on, 0 to write in the fetching '
+                 'thread (default %s, always 0 with --profile); either way, batches '
+                 'are written in a transaction per stage, committed at checkpoints'
+                 % QUEUE_SIZE)
+    parser.add_argument('--write-queue', dest='write_queue', type=int,
+                        default=QUEUE_SIZE, help=queue_msg, metavar='N')
+
+    enqueue_msg = ('Queue a job per repo and stage for --worker processes '
+                   'instead of collecting; with --resume, jobs are added '
+                   'to the unfinished run')
+    parser.add_argument('--enqueue', dest='enqueue',
+                        help=enqueue_msg, action='store_true')
+
+    worker_msg = ('Claim and run jobs queued with --enqueue until none is left; '
+                  'any number of worker processes can share the queue, '
+                  'jobs of workers that died are taken over')
+    parser.add_argument('--worker', dest='worker',
+                        help=worker_msg, action='store_true')
+
+    resume_msg = ('Continue the last run that has not finished: skip repos and '
+                  'stages it completed and continue listings from the saved page')
+    parser.add_argument('--resume', dest='resume',
+                        help=resume_msg, action='store_true')
+
+    parser.add_argument('--report', dest='report', metavar='PATH',
+                        help='Write a JSON report with per-repo and per-stage '
+                             'metrics of the run to PATH')
+
+    parser.add_argument('--prom-file', dest='prom_file', metavar='PATH',
+                        help='Write metrics of the run to PATH in the Prometheus '
+                             'text format, e.g. for the node_exporter textfile collector')
+
+    profile_msg = ('Profile every repo, write pstats and collapsed stack files '
+                   'to DIR and list the hottest functions at the end; batches '
+                   'are written by the profiled threads, as with --write-queue 0')
+    parser.add_argument('--profile', dest='profile',
+                        help=profile_msg, metavar='DIR')
+
     # DB connection related parameters
     parser.add_argument('-d', '--database', dest='database',
                         help='Database name to connect to', metavar='DBNAME')
@@ -59,18 +170,76 @@ def get_cli_args():
 
     args = parser.parse_args()
 
+    if args.workers < 1:
+        print('-w argument must be a positive number')
+        sys.exit(1)
+
+    if args.async_fetch and not HAS_AIOHTTP:
+        print('--async-fetch requires aiohttp, run "pip3 install aiohttp"')
+        sys.exit(1)
+
+    if args.fetch_concurrency < 1:
+        print('--fetch-concurrency argument must be a positive number')
+        sys.exit(1)
+
+    if args.write_queue < 0:
+        print('--write-queue argument must not be negative')
+        sys.exit(1)
+
+    if args.user_requests < 0:
+        print('--user-requests argument must not be negative')
+        sys.exit(1)
+
+    if args.profile:
+        # Only the threads collecting repos are profiled,
+        # a writer thread would leave database time out
+        args.write_queue = 0
+
+    if args.record and args.replay:
+        print('--record and --replay arguments are mutually exclusive')
+        sys.exit(1)
+
+    if args.overwrite and not args.record:
+        print('--overwrite argument requires --record')
+        sys.exit(1)
+
+    if args.record and args.resume:
+        # Pages of the interrupted run would be missing from the recording
+        print('--record and --resume arguments are mutually exclusive')
+        sys.exit(1)
+
+    if args.record and not args.overwrite and \
+            os.path.isdir(args.record) and os.listdir(args.record):
+        print('%s is not empty, pass --overwrite to replace '
+              'the recording in it' % args.record)
+        sys.exit(1)
+
+    if args.replay:
+        settings = read_settings(args.replay)
+        if settings is not None and settings['comment_sweep'] != args.comment_sweep:
+            print('%s is recorded %s --comment-sweep, replay it the same way'
+                  % (args.replay, 'with' if settings['comment_sweep'] else 'without'))
+            sys.exit(1)
+
     if not args.config:
-        if not all((args.database, args.user, args.password, args.token, args.org,)):
+        if args.replay:
+            # Replay does not access GitHub
+            if not all((args.database, args.user, args.password,)):
+                print('-c or all of -d, -u, -p arguments must be specified')
+                sys.exit(1)
+
+        elif not all((args.database, args.user, args.password, args.token, args.org,)):
             print('-c or all of -t, -d, -u, -p, -o arguments must be specified')
             sys.exit(1)
 
     return args
 
 
-def parse_config(cli_args: Namespace):
+def parse_config(cli_args: Namespace, github=True):
     """Parse a config file.
 
     If an option is already in cli_args, ignore the one from config.
+    Without github, e.g. for migrate.py, only [connection] is read.
     """
     config = ConfigParser()
     config.read(cli_args.config)
@@ -111,13 +280,16 @@ def parse_config(cli_args: Namespace):
                           'setting in config must be specified')
                     sys.exit(1)
 
-        elif section == 'github':
+        elif section == 'github' and github:
 
             github_present = True
 
             if not cli_args.token:
 
-                if config['github'].get('token'):
+                # Several tokens can be listed, comma-separated
+                if config['github'].get('tokens'):
+                    cli_args.token = config['github']['tokens']
+                elif config['github'].get('token'):
                     cli_args.token = config['github']['token']
                 else:
                     print('-t command-line argument or "token" '
@@ -133,7 +305,11 @@ def parse_config(cli_args: Namespace):
                           'setting in config must be specified')
                     sys.exit(1)
 
-    if not all((connection_present, github_present,)):
+    if not github and not connection_present:
+        print('[connection] section in config file must be specified')
+        sys.exit(1)
+
+    if github and not all((connection_present, github_present,)):
         print('both [connection] and [github] sections '
               'in config file must be specified')
         sys.exit(1)
@@ -144,3 +320,22 @@ def parse_config(cli_args: Namespace):
 def extract_repos(cli_arg: str) -> list:
     """Make a list from a passed-via-cli string."""
     return [repo.strip() for repo in cli_arg.split(',')]
+
+
+def extract_tokens(cli_arg: str) -> list:
+    """Make a token list from a comma-separated string."""
+    return [token.strip() for token in cli_arg.split(',') if token.strip()]
+
+
+class ProgressReporter():
+    """Print a line per handled repo, safe to call from several threads."""
+
+    def __init__(self):
+        self.done = 0
+        self.__lock = Lock()
+
+    def report(self, repo_name: str, took: timedelta):
+        with self.__lock:
+            self.done += 1
+            print('[%s] %s done, took %s' % (self.done, repo_name, took),
+                  flush=True)
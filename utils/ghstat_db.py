@@ -3,7 +3,9 @@
 
 from psycopg2.extensions import cursor as PgCursor
 
+from utils import queries
 from utils.connection import (
+    StatementError,
     exec_in_db,
 )
 
@@ -33,6 +35,13 @@ class GhStatDb():
                  'WHERE r.name = %s ORDER BY b.name')
         return self.exec_in_db(self.cursor, query, (repo,))
 
+    def get_repos_and_branches(self) -> list:
+        """Get a list of (repo name, [branch names]) with a single query."""
+        try:
+            return queries.get_repos_and_branches(self.cursor)
+        except Exception as e:
+            raise StatementError(queries.REPOS_AND_BRANCHES, e) from e
+
     def get_repo_release_stats(self) -> list:
         query = ('SELECT t.name AS "Release Version", c.ts AS "Release Date", '
                  'a.login AS "Release Manager", (SELECT NOW() - c.ts) AS "Time elapsed" '
@@ -44,17 +53,24 @@ class GhStatDb():
         return self.exec_in_db(self.cursor, query, (self.repo,))
 
     def get_global_release_stats(self, months_ago=0) -> dict:
+        """Get a dict {repo: {'tag': ts, 'commit': ts}} from the repo_stats rollup.
+
+        With months_ago, only repos released before that many months ago
+        are returned, and the latest commit only if it is that old too.
+        """
         if not months_ago:
-            query = ('SELECT r.name AS "Repo Name", max(c.ts) AS "Latest Release" '
-                     'FROM tags AS t LEFT JOIN commits AS c ON c.id = t.commit_id '
-                     'LEFT JOIN repos AS r ON r.id = t.repo_id '
-                     'GROUP BY "Repo Name"')
+            # Repos whose tags have no collected commit yet have no release date
+            query = ('SELECT r.name AS "Repo Name", s.latest_tag_ts AS "Latest Release", '
+                     's.latest_commit_ts AS "Latest Commit" '
+                     'FROM repos AS r LEFT JOIN repo_stats AS s ON s.repo_id = r.id '
+                     'WHERE EXISTS (SELECT 1 FROM tags AS t WHERE t.repo_id = r.id)')
         else:
-            query = ('SELECT r.name AS "Repo Name", max(c.ts) AS "Latest Release" '
-                     'FROM tags AS t LEFT JOIN commits AS c ON c.id = t.commit_id '
-                     'LEFT JOIN repos AS r ON r.id = t.repo_id '
-                     'GROUP BY "Repo Name" HAVING max(c.ts) < '
-                     '(SELECT now() - \'%s month\'::interval)' % months_ago)
+            query = ('SELECT r.name AS "Repo Name", s.latest_tag_ts AS "Latest Release", '
+                     'CASE WHEN s.latest_commit_ts < (SELECT now() - \'%s month\'::interval) '
+                     'THEN s.latest_commit_ts END AS "Latest Commit" '
+                     'FROM repo_stats AS s JOIN repos AS r ON r.id = s.repo_id '
+                     'WHERE s.latest_tag_ts < (SELECT now() - \'%s month\'::interval)'
+                     % (months_ago, months_ago))
 
         res = self.exec_in_db(self.cursor, query)
 
@@ -63,33 +79,17 @@ class GhStatDb():
             final_result[row[0]] = {}
             final_result[row[0]]['tag'] = row[1]
 
-        if not months_ago:
-            query = ('SELECT r.name AS "Repo Name", max(c.ts) AS "Latest Commit" '
-                     'FROM commits AS c LEFT JOIN repos AS r ON r.id = c.repo_id '
-                     'GROUP BY "Repo Name"')
-        else:
-            query = ('SELECT r.name AS "Repo Name", max(c.ts) AS "Latest Commit" '
-                     'FROM commits AS c LEFT JOIN repos AS r ON r.id = c.repo_id '
-                     'GROUP BY "Repo Name" HAVING max(c.ts) < '
-                     '(SELECT now() - \'%s month\'::interval)' % months_ago)
-
-        res = self.exec_in_db(self.cursor, query)
-
-        for row in res:
-            if row[0] not in final_result:
-                continue
-
-            final_result[row[0]]['commit'] = row[1]
+            if row[2] is not None:
+                final_result[row[0]]['commit'] = row[2]
 
         return final_result
 
     def get_contributors(self):
         query = ('SELECT a.login AS "Author", a.email AS "Email", '
-                 'count(c.id) AS "Commit number", max(c.ts) AS "Last commit TS" '
-                 'FROM commits AS c LEFT JOIN contributors AS a '
-                 'ON a.id = c.author_id LEFT JOIN repos AS r '
-                 'ON c.repo_id = r.id WHERE r.name = %s '
-                 'GROUP BY c.author_id, a.login, a.email '
+                 's.commit_cnt AS "Commit number", s.last_commit_ts AS "Last commit TS" '
+                 'FROM repo_contributor_stats AS s JOIN contributors AS a '
+                 'ON a.id = s.author_id JOIN repos AS r '
+                 'ON s.repo_id = r.id WHERE r.name = %s '
                  'ORDER BY "Commit number" DESC')
 
         return self.exec_in_db(self.cursor, query, (self.repo,))
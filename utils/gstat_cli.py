@@ -51,12 +51,9 @@ class GStatCli():
             cnt += 1
 
     def print_all_repo_branches(self):
-        repo_branches = []
-        for repo in self.repo_set:
-            branches = [row[0] for row in self.ghstat_db.get_branches(repo)]
-            repo_branches.append((repo, branches))
-
-        repo_branches.sort()
+        repo_branches = [(repo, branches) for repo, branches
+                         in self.ghstat_db.get_repos_and_branches()
+                         if repo in self.repo_set]
 
         for elem in repo_branches:
             print(elem[0], elem[1])
@@ -66,7 +63,9 @@ class GStatCli():
 
         output = []
         for repo in result:
-            tag_date = result[repo]['tag'].strftime('%d-%m-%Y')
+            tag_date = None
+            if result[repo]['tag']:
+                tag_date = result[repo]['tag'].strftime('%d-%m-%Y')
 
             if result[repo].get('commit'):
                 commit_date = result[repo]['commit'].strftime('%d-%m-%Y')
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+import json
+import os
+import sqlite3
+import time
+
+from threading import Lock
+
+# When the cache grows over its size, the least recently
+# used responses are removed until it is this share of it
+EVICT_TO_SHARE = 0.9
+
+
+class CachedResponse():
+    """A response served from the cache after GitHub answered 304.
+
+    Provides the interface PyGithub expects from a response.
+    """
+
+    def __init__(self, headers: dict, body: str):
+        self.status = 200
+        self.headers = headers
+        self.body = body
+
+    def getheaders(self):
+        return list(self.headers.items())
+
+    def read(self):
+        return self.body
+
+
+class HttpCache():
+    """Persistent cache of GitHub API responses keyed by URL.
+
+    Responses are stored with their ETag / Last-Modified validators.
+    A cached URL is requested again conditionally, and if GitHub answers
+    304 Not Modified (which does not count against the rate limit),
+    the stored body is used. Safe to use from several threads.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        if os.path.isdir(path):
+            path = os.path.join(path, 'http_cache.sqlite3')
+
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = Lock()
+
+        self.db = sqlite3.connect(path, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses '
+                        '(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                        'headers TEXT, body TEXT, size INTEGER, last_used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_last_used '
+                        'ON responses (last_used)')
+
+        self.size = self.db.execute(
+            'SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, url: str) -> tuple:
+        """Get a tuple (headers, body) stored for the URL or None."""
+        with self.__lock:
+            row = self.db.execute('SELECT headers, body FROM responses '
+                                  'WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row[0]), row[1]
+
+    @staticmethod
+    def validators(cached: tuple) -> dict:
+        """Get request headers to revalidate a cached response with."""
+        headers = {}
+        if cached[0].get('etag'):
+            headers['If-None-Match'] = cached[0]['etag']
+        if cached[0].get('last-modified'):
+            headers['If-Modified-Since'] = cached[0]['last-modified']
+        return headers
+
+    def revalidated(self, url: str, cached: tuple, headers: dict) -> CachedResponse:
+        """Count a 304 answer and build the response to use instead of it.
+
+        headers are the 304 response headers with lower-case keys,
+        they carry the current rate-limit values.
+        """
+        with self.__lock:
+            self.hits += 1
+            self.db.execute('UPDATE responses SET last_used = ? WHERE url = ?',
+                            (time.time(), url))
+
+        return CachedResponse(dict(cached[0], **headers), cached[1])
+
+    def store(self, url: str, headers: dict, body: str):
+        """Store a 200 response if it can be revalidated.
+
+        headers must have lower-case keys.
+        """
+        with self.__lock:
+            self.misses += 1
+
+            if not headers.get('etag') and not headers.get('last-modified'):
+                return
+
+            size = len(body)
+            old = self.db.execute('SELECT size FROM responses WHERE url = ?',
+                                  (url,)).fetchone()
+            if old is not None:
+                self.size -= old[0]
+
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES '
+                            '(?, ?, ?, ?, ?, ?, ?)',
+                            (url, headers.get('etag'), headers.get('last-modified'),
+                             json.dumps(headers), body, size, time.time()))
+            self.size += size
+
+            if self.size > self.max_bytes:
+                self.__evict()
+
+    def __evict(self):
+        rows = self.db.execute('SELECT url, size FROM responses '
+                               'ORDER BY last_used').fetchall()
+
+        removed = []
+        for url, size in rows:
+            if self.size <= self.max_bytes * EVICT_TO_SHARE:
+                break
+
+            removed.append((url,))
+            self.size -= size
+
+        self.db.executemany('DELETE FROM responses WHERE url = ?', removed)
+        self.evictions += len(removed)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'size': self.size,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print('HTTP cache: %s of %s requests not modified (hit rate %.1f%%), '
+              '%.1f MB stored, %s evictions' % (
+                  stats['hits'], stats['hits'] + stats['misses'],
+                  stats['hit_rate'] * 100, stats['size'] / 2 ** 20,
+                  stats['evictions']))
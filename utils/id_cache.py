@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+from collections import OrderedDict
+from threading import Lock
+
+from psycopg2.extensions import cursor as PgCursor
+
+from utils.connection import exec_in_db
+
+
+class LruCache():
+    """Size-bounded mapping with LRU eviction and hit/miss statistics."""
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__data = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key):
+        """Get a value or None if the key is not cached."""
+        with self.__lock:
+            value = self.__data.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if value is None:
+            return
+
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+
+            if len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, key):
+        with self.__lock:
+            self.__data.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self.__data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Caches shared by all handlers
+contributor_ids = LruCache('contributors', 200000)  # login -> id
+repo_ids = LruCache('repos', 20000)  # repo name -> id
+branch_ids = LruCache('branches', 200000)  # (repo_id, branch name) -> id
+
+ALL_CACHES = (contributor_ids, repo_ids, branch_ids)
+
+
+def clear():
+    """Forget all the cached IDs, e.g. when one of them has turned out stale."""
+    for cache in ALL_CACHES:
+        cache.clear()
+
+
+def warm_up(cursor: PgCursor):
+    """Fill the caches with one bulk SELECT per table."""
+    query = 'SELECT login, id FROM contributors LIMIT %s'
+    for login, id_ in exec_in_db(cursor, query, (contributor_ids.maxsize,)):
+        contributor_ids.put(login, id_)
+
+    query = 'SELECT name, id FROM repos LIMIT %s'
+    for name, id_ in exec_in_db(cursor, query, (repo_ids.maxsize,)):
+        repo_ids.put(name, id_)
+
+    query = 'SELECT repo_id, name, id FROM branches LIMIT %s'
+    for repo_id, name, id_ in exec_in_db(cursor, query, (branch_ids.maxsize,)):
+        branch_ids.put((repo_id, name), id_)
+
+
+def print_stats():
+    for cache in ALL_CACHES:
+        stats = cache.stats()
+        stats['hit_rate'] *= 100
+        print('%(name)s ID cache: %(size)s entries, %(hits)s hits, '
+              '%(misses)s misses (hit rate %(hit_rate).1f%%), '
+              '%(evictions)s evictions' % stats)
@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+
+import json
+import os
+import re
+import time
+
+from contextlib import contextmanager
+from threading import (
+    Lock,
+    local,
+)
+
+PROM_PREFIX = 'gh_stats_'
+
+# Upper bounds of histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Parts of API paths replaced to keep the number of endpoints bounded
+REPO_PATH_RE = re.compile(r'^/repos/[^/]+/[^/]+')
+ORG_PATH_RE = re.compile(r'^/(orgs|users)/[^/]+')
+SHA_RE = re.compile(r'/[0-9a-f]{40}(?=/|$)')
+NUMBER_RE = re.compile(r'/\d+(?=/|$)')
+
+# WITH name AS (INSERT INTO ...) upserts are not matched: their row count
+# is that of the outer SELECT, the ID row, whether a row was inserted or not
+TABLE_RE = re.compile(r'^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)', re.I)
+
+
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry():
+    """Counters, gauges and histograms of a collector run.
+
+    Every value is recorded with the labels set by scope() in the
+    current thread, i.e. the repo and the stage being collected,
+    plus the labels given to the call. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.counters = {}  # {(name, labels): value}
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+        self.started = time.time()
+        self.__lock = Lock()
+        self.__local = local()
+
+    def labels(self, **labels) -> tuple:
+        current = dict(getattr(self.__local, 'labels', {}))
+        current.update(labels)
+        return tuple(sorted(current.items()))
+
+    @contextmanager
+    def scope(self, **labels):
+        """Add labels to everything recorded by the thread in the with block."""
+        saved = getattr(self.__local, 'labels', {})
+        self.__local.labels = dict(saved, **labels)
+        try:
+            yield
+        finally:
+            self.__local.labels = saved
+
+    def inc(self, name: str, value=1, **labels):
+        key = (name, self.labels(**labels))
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value, **labels):
+        key = (name, self.labels(**labels))
+        with self.__lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, self.labels(**labels))
+        with self.__lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the duration of the with block."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Label everything recorded in the with block with the stage and time it."""
+        with self.scope(stage=stage):
+            with self.timer('stage_seconds'):
+                yield
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def snapshot(self) -> list:
+        """Get all the values as a list of dicts."""
+        with self.__lock:
+            metrics = []
+            for (name, labels), value in sorted(self.counters.items()):
+                metrics.append({'name': name, 'type': 'counter',
+                                'labels': dict(labels), 'value': value})
+
+            for (name, labels), value in sorted(self.gauges.items()):
+                metrics.append({'name': name, 'type': 'gauge',
+                                'labels': dict(labels), 'value': value})
+
+            for (name, labels), hist in sorted(self.histograms.items()):
+                metrics.append({'name': name, 'type': 'histogram',
+                                'labels': dict(labels), 'count': hist.count,
+                                'sum': round(hist.sum, 6),
+                                'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'],
+                                                    hist.counts))})
+            return metrics
+
+    def repo_summary(self) -> dict:
+        """Sum the main values by repo."""
+        summary = {}
+
+        def add(labels: dict, field: str, value):
+            repo = labels.get('repo')
+            if repo is None:
+                return
+            entry = summary.setdefault(repo, {
+                'seconds': 0.0, 'api_requests': 0, 'github_seconds': 0.0,
+                'db_statements': 0, 'db_seconds': 0.0, 'rows_written': 0})
+            entry[field] += value
+
+        for metric in self.snapshot():
+            name, labels = metric['name'], metric['labels']
+            if name == 'api_requests_total':
+                add(labels, 'api_requests', metric['value'])
+            elif name == 'db_statements_total':
+                add(labels, 'db_statements', metric['value'])
+            elif name == 'db_rows_written_total':
+                add(labels, 'rows_written', metric['value'])
+            elif name == 'github_request_seconds':
+                add(labels, 'github_seconds', metric['sum'])
+            elif name == 'db_statement_seconds':
+                add(labels, 'db_seconds', metric['sum'])
+            elif name == 'repo_seconds':
+                add(labels, 'seconds', metric['sum'])
+
+        for entry in summary.values():
+            for field in ('seconds', 'github_seconds', 'db_seconds'):
+                entry[field] = round(entry[field], 3)
+
+        return summary
+
+    def write_report(self, path: str, extra=None):
+        """Write a JSON run report."""
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'duration': round(time.time() - self.started, 3),
+        }
+        report.update(extra or {})
+        report['repos'] = self.repo_summary()
+        report['metrics'] = self.snapshot()
+
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    def write_prom(self, path: str):
+        """Write the values in the Prometheus text format.
+
+        The file is replaced atomically, so it can be read
+        by node_exporter's textfile collector at any moment.
+        """
+        lines = []
+        typed = set()
+
+        def header(name: str, type_: str):
+            if name in typed:
+                return
+            typed.add(name)
+            if name in self.help:
+                lines.append('# HELP %s%s %s' % (PROM_PREFIX, name, self.help[name]))
+            lines.append('# TYPE %s%s %s' % (PROM_PREFIX, name, type_))
+
+        for metric in self.snapshot():
+            name = metric['name']
+            header(name, metric['type'])
+
+            if metric['type'] != 'histogram':
+                lines.append(prom_line(name, metric['labels'], metric['value']))
+                continue
+
+            cumulative = 0
+            for bound, count in metric['buckets'].items():
+                cumulative += count
+                lines.append(prom_line(name + '_bucket',
+                                       dict(metric['labels'], le=bound), cumulative))
+            lines.append(prom_line(name + '_sum', metric['labels'], metric['sum']))
+            lines.append(prom_line(name + '_count', metric['labels'], metric['count']))
+
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+
+def prom_line(name: str, labels: dict, value) -> str:
+    if labels:
+        pairs = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                         for k, v in sorted(labels.items()))
+        return '%s%s{%s} %s' % (PROM_PREFIX, name, pairs, value)
+    return '%s%s %s' % (PROM_PREFIX, name, value)
+
+
+def endpoint(path: str) -> str:
+    """Turn an API path into its endpoint, e.g. /repos/{repo}/issues/{n}/comments."""
+    path = path.split('?', 1)[0]
+    # Full URLs come from pagination links
+    if '://' in path:
+        path = '/' + path.split('://', 1)[1].split('/', 1)[-1]
+
+    path = REPO_PATH_RE.sub('/repos/{repo}', path)
+    path = ORG_PATH_RE.sub(r'/\1/{name}', path)
+    path = SHA_RE.sub('/{sha}', path)
+    return NUMBER_RE.sub('/{n}', path)
+
+
+def statement_kind(statement: str) -> str:
+    words = statement.split(None, 1)
+    return words[0].lower() if words else ''
+
+
+def written_table(statement: str) -> str:
+    """Get the table an INSERT / UPDATE / DELETE statement writes to."""
+    match = TABLE_RE.match(statement)
+    return match.group(1) if match else None
+
+
+def record_request(path: str, status: int, seconds: float):
+    registry.inc('api_requests_total', endpoint=endpoint(path), status=status)
+    registry.observe('github_request_seconds', seconds, endpoint=endpoint(path))
+
+
+def record_statement(statement: str, seconds: float, rowcount: int):
+    kind = statement_kind(statement)
+    registry.inc('db_statements_total', kind=kind)
+    registry.observe('db_statement_seconds', seconds, kind=kind)
+
+    table = written_table(statement)
+    if table is not None and rowcount > 0:
+        registry.inc('db_rows_written_total', rowcount, table=table)
+
+
+# The registry of the process
+registry = Registry()
+
+registry.describe('api_requests_total', 'GitHub API requests by endpoint and status')
+registry.describe('github_request_seconds', 'Time spent waiting for GitHub responses')
+registry.describe('db_statements_total', 'Database statements executed')
+registry.describe('db_statement_seconds', 'Time spent executing database statements')
+registry.describe('db_rows_written_total', 'Rows inserted, updated or deleted')
+registry.describe('db_rows_skipped_total', 'Rows skipped because the database rejected them')
+registry.describe('db_commits_total', 'Transactions of batch writes committed')
+registry.describe('stage_seconds', 'Time spent in a collection stage of a repo')
+registry.describe('repo_seconds', 'Time spent collecting a repo')
+registry.describe('branches_unchanged_total', 'Branches skipped because their head has not moved')
+registry.describe('tags_unresolved_total', 'Tags whose commit has not been collected yet')
+registry.describe('comments_skipped_total', 'Swept comments skipped because their issue is not stored')
+registry.describe('users_enriched_total', 'Profiles of deferred users fetched')
+registry.describe('users_pending', 'Users whose profiles are still to be fetched')
+registry.describe('id_cache_hit_rate', 'Share of ID lookups served from memory')
+registry.describe('http_cache_hit_rate', 'Share of GitHub requests answered 304')
+registry.describe('rate_limit_remaining', 'GitHub requests left, summed over tokens')
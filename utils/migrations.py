@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+import os
+import re
+
+from psycopg2.extensions import connection as PgConnection
+
+from utils.connection import exec_in_db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'migrations')
+
+FILE_NAME_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Leading comment lines of a file that change how it is applied
+DIRECTIVE_RE = re.compile(r'^--\s*(no-transaction|feature:\s*(\w+))\s*$')
+
+# Statements of a file applied without a transaction must end lines
+STATEMENT_END_RE = re.compile(r';\s*$', re.M)
+
+
+class Migration():
+    """A versioned change of the schema, migrations/NNNN_name.sql.
+
+    A file is applied in a transaction unless it starts with
+    a "-- no-transaction" line, as CREATE INDEX CONCURRENTLY must be.
+    A file starting with a "-- feature: NAME" line is applied
+    only when the feature is asked for.
+    """
+
+    def __init__(self, path: str):
+        match = FILE_NAME_RE.match(os.path.basename(path))
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+
+        with open(path) as f:
+            self.sql = f.read()
+
+        self.transactional = True
+        self.feature = None
+        for line in self.sql.splitlines():
+            directive = DIRECTIVE_RE.match(line)
+            if directive is None:
+                break
+
+            if directive.group(2):
+                self.feature = directive.group(2)
+            else:
+                self.transactional = False
+
+    def statements(self) -> list:
+        """Split the file into statements, comments are left with the next one."""
+        statements = []
+        for chunk in STATEMENT_END_RE.split(self.sql):
+            if any(line.strip() and not line.lstrip().startswith('--')
+                   for line in chunk.splitlines()):
+                statements.append(chunk.strip())
+        return statements
+
+
+def load_migrations(directory=MIGRATIONS_DIR) -> list:
+    """Get the migrations of the directory ordered by version."""
+    migrations = [Migration(os.path.join(directory, name))
+                  for name in os.listdir(directory) if FILE_NAME_RE.match(name)]
+    return sorted(migrations, key=lambda m: m.version)
+
+
+def get_applied(conn: PgConnection) -> dict:
+    """Get a dict {version: name} of the migrations applied to the database."""
+    conn.set_session(autocommit=True)
+    cursor = conn.cursor()
+
+    query = ("CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, "
+             "name TEXT NOT NULL, applied_at TIMESTAMP NOT NULL "
+             "DEFAULT (now() AT TIME ZONE 'UTC'))")
+    exec_in_db(cursor, query, ret_all=False)
+
+    query = 'SELECT version, name FROM schema_migrations'
+    return {row[0]: row[1] for row in exec_in_db(cursor, query)}
+
+
+def get_pending(conn: PgConnection, features=(), directory=MIGRATIONS_DIR) -> list:
+    """Get migrations not applied yet, leaving out features not asked for."""
+    applied = get_applied(conn)
+    return [m for m in load_migrations(directory) if m.version not in applied
+            and (m.feature is None or m.feature in features)]
+
+
+def apply(conn: PgConnection, migration: Migration):
+    """Apply a migration and record it.
+
+    A transactional migration is applied completely or not at all.
+    """
+    query = 'INSERT INTO schema_migrations (version, name) VALUES (%s, %s)'
+
+    if migration.transactional:
+        conn.set_session(autocommit=False)
+        cursor = conn.cursor()
+        try:
+            # No arguments, so that % in the file is not taken for a placeholder
+            exec_in_db(cursor, migration.sql, None, ret_all=False)
+            exec_in_db(cursor, query, (migration.version, migration.name), ret_all=False)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return
+
+    conn.set_session(autocommit=True)
+    cursor = conn.cursor()
+    for statement in migration.statements():
+        exec_in_db(cursor, statement, None, ret_all=False)
+    exec_in_db(cursor, query, (migration.version, migration.name), ret_all=False)
+
+
+def migrate(conn: PgConnection, features=(), directory=MIGRATIONS_DIR,
+            verbose=True) -> int:
+    """Apply pending migrations in order, return the number applied."""
+    pending = get_pending(conn, features, directory)
+
+    for migration in pending:
+        if verbose:
+            print('Applying %04d_%s' % (migration.version, migration.name), flush=True)
+        apply(conn, migration)
+
+    conn.set_session(autocommit=True)
+    return len(pending)
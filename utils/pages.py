@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+
+from utils.async_fetch import PER_PAGE
+from utils.stopping import check_stopping
+
+
+def iter_pages(listing, start=0, per_page=PER_PAGE):
+    """Yield tuples (page number, list of items) of a listing, from page start.
+
+    Pages are numbered from 0 and hold per_page items, as the listings
+    the collector gets from GitHub are requested. When start is not 0,
+    listings that can be requested page by page (PyGithub's PaginatedList,
+    RawList) skip the pages before it without requesting them; otherwise
+    the listing is iterated as usual, e.g. fetching pages concurrently.
+    Raises Stopped before a page once stopping is set.
+    """
+    if start and hasattr(listing, 'get_page'):
+        page = start
+        while True:
+            check_stopping()
+            items = listing.get_page(page)
+            if items:
+                yield page, items
+
+            if len(items) < per_page:
+                # The last page, no need to request an empty one
+                return
+
+            page += 1
+
+    items = []
+    page = 0
+    for item in listing:
+        items.append(item)
+        if len(items) == per_page:
+            if page >= start:
+                check_stopping()
+                yield page, items
+            items = []
+            page += 1
+
+    if items and page >= start:
+        check_stopping()
+        yield page, items
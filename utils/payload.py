@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+from utils.timestamps import parse_ts
+
+
+def wrap(name: str, value):
+    """Wrap a payload value the way PyGithub exposes it."""
+    if isinstance(value, dict):
+        return RawObject(value)
+
+    if isinstance(value, list):
+        return [wrap(name, elem) for elem in value]
+
+    if isinstance(value, str) and (name.endswith('_at') or name == 'date'):
+        return parse_ts(value)
+
+    return value
+
+
+class RawObject():
+    """Read-only attribute view of a GitHub API payload (a plain dict).
+
+    It lets handlers consume payloads through the attribute names
+    of PyGithub objects. Fields absent in the payload are None,
+    nothing is ever fetched lazily.
+    """
+
+    def __init__(self, data: dict):
+        self.raw_data = data
+
+    def __getattr__(self, name: str):
+        # Payload keys never start with an underscore
+        if name.startswith('_') or name == 'raw_data':
+            raise AttributeError(name)
+
+        return wrap(name, self.raw_data.get(name))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.raw_data)
+
+
+def raw_payload(obj) -> dict:
+    """Get the payload an object has been built from.
+
+    Unlike PyGithub's raw_data property, it never completes
+    the object with an extra request.
+    """
+    if isinstance(obj, dict):
+        return obj
+
+    if hasattr(obj, '_rawData'):
+        return obj._rawData
+
+    return obj.raw_data
@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+
+import cProfile
+import os
+import pstats
+import re
+import sys
+
+from collections import Counter
+from contextlib import contextmanager
+from threading import (
+    Event,
+    Lock,
+    Thread,
+    get_ident,
+)
+
+from tabulate import tabulate
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Number of functions listed at the end of a run
+TOP_FUNCTIONS = 15
+
+UNSAFE_CHARS_RE = re.compile(r'[^\w.-]+')
+
+
+def frame_name(code) -> str:
+    return '%s (%s:%s)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class Sampler(Thread):
+    """Take stacks of registered threads at regular intervals.
+
+    Stacks are counted by the name a thread is registered with,
+    e.g. by the repo it collects, so it works with several workers.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.threads = {}  # {thread ident: name}
+        self.stacks = {}  # {name: Counter({collapsed stack: samples})}
+        self.__lock = Lock()
+        self.__stopped = Event()
+
+    def register(self, name: str):
+        with self.__lock:
+            self.threads[get_ident()] = name
+            self.stacks.setdefault(name, Counter())
+
+    def unregister(self):
+        with self.__lock:
+            self.threads.pop(get_ident(), None)
+
+    def run(self):
+        while not self.__stopped.wait(self.interval):
+            frames = sys._current_frames()
+
+            with self.__lock:
+                for ident, name in self.threads.items():
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame_name(frame.f_code))
+                        frame = frame.f_back
+
+                    self.stacks[name][';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.__stopped.set()
+        self.join()
+
+    def take(self, name: str) -> Counter:
+        with self.__lock:
+            return self.stacks.pop(name, Counter())
+
+
+class Profiler():
+    """Profile parts of a run, e.g. every repo or every command.
+
+    For each part, the directory gets NAME.collapsed with sampled stacks,
+    one "frame;frame;frame count" line per stack, as flamegraph.pl and
+    speedscope read them. Unless several threads are profiled at once,
+    which cProfile cannot do, it also gets NAME.pstats written by cProfile
+    (snakeviz, flameprof, gprof2dot). close() prints the hottest functions
+    of the whole run.
+
+    Only the threads running profile() are profiled, work handed to other
+    threads is not; the collector writes batches in them when profiling.
+    """
+
+    def __init__(self, directory: str, threads=1, interval=SAMPLE_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.use_cprofile = threads == 1
+        self.pstats_files = []
+        self.self_samples = Counter()
+        self.total_samples = 0
+        self.__lock = Lock()
+
+        self.sampler = Sampler(interval)
+        self.sampler.start()
+
+    def path(self, name: str, ext: str) -> str:
+        return os.path.join(self.directory, '%s.%s' % (UNSAFE_CHARS_RE.sub('_', name), ext))
+
+    @contextmanager
+    def profile(self, name: str):
+        profile = None
+        if self.use_cprofile:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        self.sampler.register(name)
+        try:
+            yield
+
+        finally:
+            self.sampler.unregister()
+
+            if profile is not None:
+                profile.disable()
+                path = self.path(name, 'pstats')
+                profile.dump_stats(path)
+                self.pstats_files.append(path)
+
+            self.__write_collapsed(name, self.sampler.take(name))
+
+    def __write_collapsed(self, name: str, stacks: Counter):
+        with open(self.path(name, 'collapsed'), 'w') as f:
+            for stack, count in stacks.items():
+                f.write('%s %s\n' % (stack, count))
+
+        with self.__lock:
+            for stack, count in stacks.items():
+                self.self_samples[stack.rsplit(';', 1)[-1]] += count
+                self.total_samples += count
+
+    def close(self):
+        """Stop sampling and print the hottest functions."""
+        self.sampler.stop()
+
+        if self.pstats_files:
+            self.print_pstats_top()
+        elif self.total_samples:
+            self.print_samples_top()
+
+        print('Profiles are written to %s' % self.directory)
+
+    def print_pstats_top(self):
+        stats = pstats.Stats(*self.pstats_files)
+
+        rows = []
+        for func, (_, calls, tottime, cumtime, _) in stats.stats.items():
+            filename, line, func_name = func
+            if filename != '~':
+                # Built-ins have no file
+                func_name = '%s (%s:%s)' % (func_name, os.path.basename(filename), line)
+
+            rows.append((func_name, calls, tottime, cumtime))
+
+        rows.sort(key=lambda row: row[2], reverse=True)
+
+        print('Hottest functions by own time, all profiles combined:')
+        print(tabulate(rows[:TOP_FUNCTIONS],
+                       headers=('Function', 'Calls', 'Own, s', 'Cumulative, s'),
+                       floatfmt='.3f'))
+
+    def print_samples_top(self):
+        rows = [(func, count, count * 100 / self.total_samples)
+                for func, count in self.self_samples.most_common(TOP_FUNCTIONS)]
+
+        print('Hottest functions by samples on top of the stack, %s samples:'
+              % self.total_samples)
+        print(tabulate(rows, headers=('Function', 'Samples', '%'), floatfmt='.1f'))
+
+
+class NoProfiler():
+    """Stands in for Profiler when profiling is off."""
+
+    @contextmanager
+    def profile(self, name: str):
+        yield
+
+    def close(self):
+        pass
+
+
+def create_profiler(directory: str, threads=1):
+    if not directory:
+        return NoProfiler()
+
+    return Profiler(directory, threads=threads)
@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+
+# Repos with their branch names, one row per repo; the "C" collation
+# sorts names the way Python does. The dashboard runs the same query,
+# see gstats/views.py
+REPOS_AND_BRANCHES = ('SELECT r.name, '
+                      'array_remove(array_agg(b.name ORDER BY b.name COLLATE "C"), NULL) '
+                      'FROM repos AS r LEFT JOIN branches AS b ON b.repo_id = r.id '
+                      'GROUP BY r.id, r.name ORDER BY r.name COLLATE "C"')
+
+
+def get_repos_and_branches(cursor) -> list:
+    """Get a list of (repo name, [branch names]) with a single query.
+
+    Takes any DB-API cursor, e.g. a psycopg2 one or a CountingCursor.
+    """
+    cursor.execute(REPOS_AND_BRANCHES)
+    return [(row[0], list(row[1])) for row in cursor.fetchall()]
+
+
+class CountingCursor():
+    """Cursor wrapper counting the statements executed through it."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = []
+
+    def execute(self, statement, args=None):
+        self.statements.append(statement)
+        return self.cursor.execute(statement, args)
+
+    def executemany(self, statement, args_list):
+        self.statements.append(statement)
+        return self.cursor.executemany(statement, args_list)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+import time
+
+from threading import Condition
+
+from utils.stopping import check_stopping
+
+# Tokens with fewer requests left are not used until their window resets,
+# the rest of the budget is left for requests that are already in flight
+RESERVE = 20
+
+# Below this share of the total budget, fewer requests are run concurrently
+THROTTLE_SHARE = 0.25
+
+# How many times a request that hit a rate limit is sent again
+MAX_RETRIES = 5
+
+# Secondary rate limit responses without Retry-After: wait at least
+# a minute, doubling the wait on every repeated hit
+MIN_BACKOFF = 60
+MAX_BACKOFF = 900
+
+
+class TokenBudget():
+    """Rate-limit state of a single token, as reported by GitHub."""
+
+    def __init__(self, token: str):
+        self.token = token
+        self.remaining = None  # None until the first response
+        self.limit = None
+        self.reset = 0.0  # epoch seconds
+        self.blocked_until = 0.0
+        self.backoff = 0
+
+    def is_available(self, now: float) -> bool:
+        if now < self.blocked_until:
+            return False
+
+        if self.remaining is not None and self.remaining <= RESERVE:
+            return now >= self.reset
+
+        return True
+
+    def available_at(self) -> float:
+        if self.remaining is not None and self.remaining <= RESERVE:
+            return max(self.blocked_until, self.reset)
+
+        return self.blocked_until
+
+
+class RateLimitScheduler():
+    """Spread GitHub requests over tokens, keeping each within its budget.
+
+    Before every request a token is acquired: the one with the largest
+    remaining budget among those not blocked. When the total budget runs
+    low, fewer requests are allowed in flight; when every token is
+    exhausted, callers wait for the earliest reset instead of failing.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, tokens: list, max_concurrency=8):
+        self.tokens = [TokenBudget(token) for token in tokens]
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.throttled = 0
+        self.__cond = Condition()
+
+    def concurrency(self) -> int:
+        """Number of requests allowed in flight with the current budget."""
+        remaining = 0
+        limit = 0
+        for budget in self.tokens:
+            if budget.remaining is None:
+                # Not known yet, don't throttle
+                return self.max_concurrency
+
+            remaining += budget.remaining
+            limit += budget.limit or budget.remaining
+
+        if not limit or remaining >= limit * THROTTLE_SHARE:
+            return self.max_concurrency
+
+        share = remaining / (limit * THROTTLE_SHARE)
+        return max(1, int(self.max_concurrency * share))
+
+    def try_acquire(self) -> tuple:
+        """Take a token without waiting.
+
+        Returns a tuple (TokenBudget, 0) or, when a request cannot be
+        made now, (None, seconds to wait before trying again).
+        """
+        with self.__cond:
+            now = time.time()
+
+            if self.in_flight >= self.concurrency():
+                return None, 0.1
+
+            available = [b for b in self.tokens if b.is_available(now)]
+            if not available:
+                wait = min(b.available_at() for b in self.tokens) - now
+                return None, max(wait, 1.0)
+
+            budget = max(available, key=lambda b: b.remaining
+                         if b.remaining is not None else float('inf'))
+
+            # Count the request right away, other threads see it
+            if budget.remaining is not None:
+                budget.remaining -= 1
+
+            self.in_flight += 1
+            return budget, 0
+
+    def acquire(self) -> TokenBudget:
+        """Take a token, waiting until one can be used.
+
+        Raises Stopped if stopping is set while waiting, see wake().
+        """
+        while True:
+            budget, wait = self.try_acquire()
+            if budget is not None:
+                return budget
+
+            self.throttled += 1
+            with self.__cond:
+                check_stopping()
+                self.__cond.wait(wait)
+
+    def wake(self):
+        """Wake threads waiting for a token, e.g. to let them see stopping."""
+        with self.__cond:
+            self.__cond.notify_all()
+
+    def release(self, budget: TokenBudget, status: int,
+                headers: dict, body='') -> bool:
+        """Update the token's budget from a response.
+
+        headers must have lower-case keys.
+        Returns True if the request hit a rate limit and must be retried.
+        """
+        with self.__cond:
+            self.in_flight -= 1
+            self.__update(budget, headers)
+
+            limited = self.__is_limited(status, headers, body)
+            now = time.time()
+
+            if not limited:
+                budget.backoff = 0
+
+            elif headers.get('retry-after'):
+                budget.blocked_until = now + int(headers['retry-after'])
+
+            elif budget.remaining == 0:
+                budget.blocked_until = budget.reset
+
+            else:
+                budget.backoff = min(max(budget.backoff * 2, MIN_BACKOFF),
+                                     MAX_BACKOFF)
+                budget.blocked_until = now + budget.backoff
+
+            self.__cond.notify_all()
+            return limited
+
+    @staticmethod
+    def __update(budget: TokenBudget, headers: dict):
+        # Search and GraphQL have budgets of their own
+        if headers.get('x-ratelimit-resource', 'core') != 'core':
+            return
+
+        if headers.get('x-ratelimit-remaining') is not None:
+            budget.remaining = int(headers['x-ratelimit-remaining'])
+
+        if headers.get('x-ratelimit-limit') is not None:
+            budget.limit = int(headers['x-ratelimit-limit'])
+
+        if headers.get('x-ratelimit-reset') is not None:
+            budget.reset = float(headers['x-ratelimit-reset'])
+
+    @staticmethod
+    def __is_limited(status: int, headers: dict, body: str) -> bool:
+        if status == 429:
+            return True
+
+        if status != 403:
+            return False
+
+        # 403 is also returned for missing permissions
+        return (headers.get('retry-after') is not None
+                or headers.get('x-ratelimit-remaining') == '0'
+                or 'rate limit' in body.lower())
+
+    def budget(self) -> dict:
+        """Current budget summed over all tokens."""
+        with self.__cond:
+            known = [b for b in self.tokens if b.remaining is not None]
+            return {
+                'tokens': len(self.tokens),
+                'remaining': sum(b.remaining for b in known),
+                'limit': sum(b.limit or 0 for b in known),
+                'reset': min((b.reset for b in known), default=0),
+                'in_flight': self.in_flight,
+                'throttled': self.throttled,
+            }
+
+    def print_budget(self):
+        budget = self.budget()
+        print('GitHub rate limit: %(remaining)s of %(limit)s requests left '
+              'over %(tokens)s token(s), throttled %(throttled)s times' % budget)
@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+
+import gzip
+import json
+import os
+import shutil
+
+from glob import glob
+from urllib.parse import quote
+
+from utils.payload import (
+    RawObject,
+    raw_payload,
+)
+from utils.timestamps import (
+    parse_ts,
+    to_naive_utc,
+)
+
+# Items per compressed segment file
+SEGMENT_SIZE = 10000
+
+# Directory of org-level listings inside a recording
+ORG_DIR = '_org'
+
+# Options of the recording run, see write_settings()
+SETTINGS_FILE = '_settings.json'
+
+
+def endpoint_path(directory: str, repo_name: str, endpoint: str) -> str:
+    """Get the path prefix of an endpoint's segments.
+
+    Endpoints may contain branch names, they are quoted to stay one file name.
+    """
+    return os.path.join(directory, quote(repo_name, safe=''),
+                        quote(endpoint, safe=''))
+
+
+class SegmentWriter():
+    """Write payloads as gzip-compressed JSON lines, SEGMENT_SIZE per file."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.segment = 0
+        self.count = 0
+        self.file = None
+
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+
+        # Requested again by the same run, e.g. the branch list,
+        # the new listing replaces the previous one
+        for path in glob(glob_escape(prefix) + '.*.jsonl.gz'):
+            os.remove(path)
+
+    def write(self, payload: dict):
+        if self.file is None or self.count == SEGMENT_SIZE:
+            self.close()
+            self.file = gzip.open('%s.%04d.jsonl.gz' % (self.prefix, self.segment),
+                                  'wt', encoding='utf-8')
+            self.segment += 1
+            self.count = 0
+
+        self.file.write(json.dumps(payload))
+        self.file.write('\n')
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def clear_recording(directory: str):
+    """Remove a recording, so that a new one does not mix with it."""
+    if not os.path.isdir(directory):
+        return
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def write_settings(directory: str, settings: dict):
+    """Save options a recording depends on, e.g. comment_sweep.
+
+    With --comment-sweep comments are recorded from the repo-wide listing
+    only, without it from the listings of issues only; a replay must
+    read them the same way.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, SETTINGS_FILE), 'w') as f:
+        json.dump(settings, f)
+
+
+def read_settings(directory: str) -> dict:
+    """Get options a recording was made with, None if they were not saved."""
+    path = os.path.join(directory, SETTINGS_FILE)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def glob_escape(path: str) -> str:
+    return path.replace('[', '[[]')
+
+
+def read_segments(prefix: str):
+    """Stream payloads of an endpoint, segment by segment."""
+    for path in sorted(glob(glob_escape(prefix) + '.*.jsonl.gz')):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def record(items, prefix: str):
+    """Yield items of a listing, writing their payloads on the way."""
+    writer = SegmentWriter(prefix)
+    try:
+        for item in items:
+            writer.write(raw_payload(item))
+            yield item
+    finally:
+        writer.close()
+
+
+class RecordingIssue():
+    def __init__(self, issue, directory: str, repo_name: str):
+        self.__issue = issue
+        self.__directory = directory
+        self.__repo_name = repo_name
+
+    def __getattr__(self, name: str):
+        return getattr(self.__issue, name)
+
+    def get_comments(self):
+        endpoint = 'issues/%s/comments' % self.__issue.number
+        return record(self.__issue.get_comments(),
+                      endpoint_path(self.__directory, self.__repo_name, endpoint))
+
+
+class RecordingRepository():
+    """Wrap a repository, writing every payload the handlers read from it."""
+
+    def __init__(self, repo, directory: str):
+        self.__repo = repo
+        self.__directory = directory
+
+    def __getattr__(self, name: str):
+        return getattr(self.__repo, name)
+
+    def __path(self, endpoint: str) -> str:
+        return endpoint_path(self.__directory, self.__repo.name, endpoint)
+
+    def get_branches(self) -> list:
+        # Branches are iterated more than once, keep them
+        return list(record(self.__repo.get_branches(), self.__path('branches')))
+
+    def get_commits(self, sha=None, **kwargs):
+        return record(self.__repo.get_commits(sha=sha, **kwargs),
+                      self.__path('commits/%s' % sha))
+
+    def get_issues(self, **kwargs):
+        for issue in record(self.__repo.get_issues(**kwargs), self.__path('issues')):
+            yield RecordingIssue(issue, self.__directory, self.__repo.name)
+
+    def get_issues_comments(self, **kwargs):
+        return record(self.__repo.get_issues_comments(**kwargs),
+                      self.__path('issues/comments'))
+
+    def get_tags(self):
+        return record(self.__repo.get_tags(), self.__path('tags'))
+
+
+class RecordingOrganization():
+    def __init__(self, org, directory: str):
+        self.__org = org
+        self.__directory = directory
+
+    def get_repos(self):
+        for repo in record(self.__org.get_repos(),
+                           endpoint_path(self.__directory, ORG_DIR, 'repos')):
+            yield RecordingRepository(repo, self.__directory)
+
+
+class RecordingGithub():
+    """Wrap a Github object, writing raw payloads under a directory.
+
+    Layout: DIR/<repo>/<endpoint>.NNNN.jsonl.gz, org-level listings
+    are kept in DIR/_org. Replay them with ReplayGithub.
+    """
+
+    def __init__(self, gh, directory: str):
+        self.__gh = gh
+        self.__directory = directory
+
+    def get_organization(self, org: str) -> RecordingOrganization:
+        return RecordingOrganization(self.__gh.get_organization(org),
+                                     self.__directory)
+
+    def get_repo(self, full_name: str) -> RecordingRepository:
+        return RecordingRepository(self.__gh.get_repo(full_name),
+                                   self.__directory)
+
+    def get_user(self, login: str):
+        # Profiles are not part of what is replayed
+        return self.__gh.get_user(login)
+
+    def close(self):
+        if hasattr(self.__gh, 'close'):
+            self.__gh.close()
+
+
+def since_filter(items, field: str, since):
+    """Keep what a listing with the since= parameter would return."""
+    if since is None:
+        yield from items
+        return
+
+    since = to_naive_utc(since)
+    for item in items:
+        value = item
+        for key in field.split('.'):
+            value = (value or {}).get(key)
+
+        if value is None or to_naive_utc(parse_ts(value)) >= since:
+            yield item
+
+
+class ReplayIssue(RawObject):
+    def __init__(self, data: dict, directory: str, repo_name: str):
+        super().__init__(data)
+        self.directory = directory
+        self.repo_name = repo_name
+
+    def get_comments(self):
+        endpoint = 'issues/%s/comments' % self.raw_data['number']
+        for item in read_segments(endpoint_path(self.directory, self.repo_name,
+                                                endpoint)):
+            yield RawObject(item)
+
+
+class ReplayRepository(RawObject):
+    """Provides the part of PyGithub's Repository API the handlers use,
+    reading payloads from a recording instead of GitHub."""
+
+    def __init__(self, data: dict, directory: str):
+        super().__init__(data)
+        self.directory = directory
+
+    def __read(self, endpoint: str):
+        return read_segments(endpoint_path(self.directory, self.raw_data['name'],
+                                           endpoint))
+
+    def get_branches(self) -> list:
+        return [RawObject(item) for item in self.__read('branches')]
+
+    def get_commits(self, sha=None, since=None):
+        items = since_filter(self.__read('commits/%s' % sha),
+                             'commit.committer.date', since)
+        for item in items:
+            yield RawObject(item)
+
+    def get_issues(self, state='open', since=None):
+        for item in since_filter(self.__read('issues'), 'updated_at', since):
+            if state in ('all', item.get('state')):
+                yield ReplayIssue(item, self.directory, self.raw_data['name'])
+
+    def get_issues_comments(self, since=None):
+        for item in since_filter(self.__read('issues/comments'), 'updated_at', since):
+            yield RawObject(item)
+
+    def get_tags(self):
+        for item in self.__read('tags'):
+            yield RawObject(item)
+
+
+class ReplayOrganization():
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_repos(self):
+        for item in read_segments(endpoint_path(self.directory, ORG_DIR, 'repos')):
+            yield ReplayRepository(item, self.directory)
+
+
+class ReplayGithub():
+    """Drop-in replacement for the github.Github object that feeds
+    the handlers from a recording, without network access."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.repos = None  # {full name: ReplayRepository}
+
+    def get_organization(self, org: str) -> ReplayOrganization:
+        return ReplayOrganization(self.directory)
+
+    def get_repo(self, full_name: str) -> ReplayRepository:
+        # The org listing is read once, not on every call
+        if self.repos is None:
+            self.repos = {repo.full_name: repo for repo
+                          in ReplayOrganization(self.directory).get_repos()}
+
+        if full_name not in self.repos:
+            raise KeyError('%s is not in the recording' % full_name)
+
+        return self.repos[full_name]
@@ -0,0 +1,16 @@
+#!/usr/bin/python3
+
+from threading import Event
+
+# Set to make worker threads stop, e.g. on Ctrl-C. They stop between
+# pages of listings, after the checkpoint of the last page is saved
+stopping = Event()
+
+
+class Stopped(Exception):
+    """Raised in a worker thread that has seen stopping set."""
+
+
+def check_stopping():
+    if stopping.is_set():
+        raise Stopped()
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+from datetime import (
+    datetime,
+    timezone,
+)
+
+
+def to_naive_utc(ts: datetime) -> datetime:
+    """Convert a datetime to naive UTC, the way TIMESTAMP columns return it.
+
+    Depending on the version, PyGithub returns aware or naive UTC datetimes.
+    """
+    if ts is None or ts.tzinfo is None:
+        return ts
+
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def utc_now() -> datetime:
+    """Return the current time as naive UTC."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_ts(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp of the GitHub API into an aware datetime."""
+    if not value:
+        return None
+
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def format_ts(ts: datetime) -> str:
+    """Format a datetime the way the GitHub API expects it in parameters."""
+    return to_naive_utc(ts).strftime('%Y-%m-%dT%H:%M:%SZ')
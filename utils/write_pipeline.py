@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+import time
+
+from queue import Queue
+from threading import Thread
+
+from psycopg2.extensions import cursor as PgCursor
+
+from utils import metrics
+
+# Batches waiting to be written before fetching is paused
+QUEUE_SIZE = 4
+
+
+def commit(cursor: PgCursor):
+    cursor.connection.commit()
+    metrics.registry.inc('db_commits_total')
+
+
+class WritePipeline():
+    """Write batches to the database in a thread of its own.
+
+    Handlers keep fetching from GitHub while the previous batch is being
+    written. The queue is bounded: when the database falls behind,
+    submit() blocks until there is room, so memory stays bounded.
+    With size 0, batches are written right away by the submitting thread.
+    Jobs run in the order they were submitted.
+
+    The cursor must belong to a connection used by the pipeline only,
+    not in autocommit mode: batches are written in a transaction
+    committed by wait(), so the batches written between two waits,
+    e.g. a stage or the pages between two checkpoints, are stored
+    with one commit or not at all.
+    """
+
+    def __init__(self, cursor: PgCursor, size=QUEUE_SIZE):
+        self.cursor = cursor
+        self.error = None
+        self.queue = None
+        self.thread = None
+
+        if size:
+            self.queue = Queue(maxsize=size)
+            self.thread = Thread(target=self.__run, daemon=True)
+            self.thread.start()
+
+    def submit(self, func, *args):
+        """Queue a call of func(cursor, *args)."""
+        self.__check()
+
+        if self.thread is None:
+            self.__execute(func, args)
+            self.__check()
+            return
+
+        start = time.monotonic()
+        # Labels of the submitting thread, e.g. the repo
+        self.queue.put((func, args, dict(metrics.registry.labels())))
+        metrics.registry.observe('write_queue_wait_seconds', time.monotonic() - start)
+
+    def wait(self):
+        """Wait until everything submitted so far is written, commit it."""
+        self.submit(commit)
+
+        if self.thread is not None:
+            self.queue.join()
+            self.__check()
+
+    def close(self):
+        """Stop the pipeline, what has not been committed is rolled back."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+
+        self.__rollback()
+
+    def __check(self):
+        # Errors of the writer are raised in the thread that uses the pipeline
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def __execute(self, func, args):
+        # Once a job has failed, the rest are dropped
+        if self.error is not None:
+            return
+
+        try:
+            func(self.cursor, *args)
+
+        except BaseException as e:
+            # The transaction cannot go on
+            self.__rollback()
+            self.error = e
+
+    def __rollback(self):
+        try:
+            self.cursor.connection.rollback()
+        except Exception:
+            # The connection is broken, the error is already known
+            pass
+
+    def __run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+
+                func, args, labels = job
+                with metrics.registry.scope(**labels):
+                    self.__execute(func, args)
+
+            finally:
+                self.queue.task_done()